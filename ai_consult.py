@@ -0,0 +1,393 @@
+"""
+Background AI consultation for risk analysis.
+
+An LLM round-trip takes seconds, so it never runs in the request thread.
+analyze_patient_risk returns the rule-based result immediately and calls
+AIConsultant.request(), which:
+
+- applies advice already known for (patient, latest vital), or
+- builds the patient's case summary (the DB work happens here, in the
+  caller) and queues it.
+
+A dispatcher thread packs queued cases into one multi-patient prompt per
+free worker (up to AI_CONSULT_BATCH_SIZE cases, waiting at most
+AI_CONSULT_BATCH_WAIT_MS for more to arrive), so a sweep of 200 patients
+costs a few dozen model round trips instead of 200. The model answers with
+a JSON array that is split back per patient; if it cannot be parsed, or a
+case is missing from it, those patients are retried with single-patient
+prompts. When advice arrives it is cached, patched into the patient's
+cached risk result and pushed to browsers as a risk_ai_update event.
+
+Protection for the LLM and for us:
+  AI_CONSULT_CONCURRENCY       concurrent calls (default 4)
+  AI_CONSULT_TIMEOUT_SECONDS   per-call timeout (default 15)
+  AI_SWEEP_BUDGET_SECONDS      wall-clock budget for the consults a
+                               census sweep may queue (default 60)
+  AI_BREAKER_FAILURES          consecutive failures/timeouts that open the
+                               circuit breaker (default 5)
+  AI_BREAKER_COOLDOWN_SECONDS  how long it stays open before a single
+                               trial call is let through (default 60)
+  AI_CONSULT_CACHE_SIZE        advice entries kept (default 2048)
+  AI_CONSULT_BATCH_SIZE        patients per prompt (default 8, 1 disables)
+  AI_CONSULT_BATCH_WAIT_MS     how long a free worker waits to fill a
+                               batch (default 200)
+
+AI_FAKE_MODEL_LATENCY_MS (with AI_FAKE_MODEL_PER_CASE_MS) swaps Gemini for
+the local fake model in fake_llm.py; bench_ai_batching.py uses it to
+measure the batching gain.
+"""
+
+import logging
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+
+class CircuitBreaker:
+    """Closed -> open after N consecutive failures -> half-open (one trial) after a cooldown"""
+
+    def __init__(self, failure_threshold, cooldown_seconds):
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.cooldown_seconds:
+            return 'half_open'
+        return 'open'
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half_open' and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return True
+            return False
+
+    def release(self):
+        """A permitted call was abandoned before it reached the LLM"""
+        with self._lock:
+            self.trial_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.trial_in_flight = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logger.warning(f"AI consult circuit opened after {self.failures} consecutive failures")
+                self.opened_at = time.monotonic()
+
+
+class SweepBudget:
+    """Wall-clock budget shared by the consults queued during one census sweep"""
+
+    def __init__(self, seconds):
+        self.deadline = time.monotonic() + seconds
+
+    @property
+    def exhausted(self):
+        return time.monotonic() >= self.deadline
+
+
+class AIConsultant:
+    def __init__(self):
+        self.concurrency = int(os.environ.get('AI_CONSULT_CONCURRENCY', '4'))
+        self.timeout_seconds = float(os.environ.get('AI_CONSULT_TIMEOUT_SECONDS', '15'))
+        self.sweep_budget_seconds = float(os.environ.get('AI_SWEEP_BUDGET_SECONDS', '60'))
+        self.cache_size = int(os.environ.get('AI_CONSULT_CACHE_SIZE', '2048'))
+        self.batch_size = max(1, int(os.environ.get('AI_CONSULT_BATCH_SIZE', '8')))
+        self.batch_wait_seconds = float(os.environ.get('AI_CONSULT_BATCH_WAIT_MS', '200')) / 1000
+        self.breaker = CircuitBreaker(
+            int(os.environ.get('AI_BREAKER_FAILURES', '5')),
+            float(os.environ.get('AI_BREAKER_COOLDOWN_SECONDS', '60')),
+        )
+        # prompt -> response text; None means the configured Gemini client
+        self.llm = None
+        if os.environ.get('AI_FAKE_MODEL_LATENCY_MS'):
+            from fake_llm import FakeLLM
+            self.llm = FakeLLM(
+                latency=float(os.environ['AI_FAKE_MODEL_LATENCY_MS']) / 1000,
+                per_case_latency=float(os.environ.get('AI_FAKE_MODEL_PER_CASE_MS', '50')) / 1000,
+            )
+        self._workers = None
+        # LLM calls run here so a worker can give up on a hung call after the timeout
+        self._calls = None
+        self._queue = queue.Queue()  # (key, case, budget)
+        self._free_workers = threading.Semaphore(self.concurrency)
+        self._dispatcher = None
+        self._advice = OrderedDict()  # (patient_id, latest_vital_id) -> advice
+        self._in_flight = set()
+        self._lock = threading.Lock()
+        self.stats = {'cache_hits': 0, 'queued': 0, 'completed': 0, 'empty': 0, 'failed': 0,
+                      'timed_out': 0, 'skipped_breaker': 0, 'skipped_budget': 0,
+                      'batches': 0, 'batched_cases': 0, 'parse_failures': 0, 'fallback_singles': 0}
+
+    def enabled(self):
+        if self.llm is not None:
+            return True
+        from app import genai
+        return genai is not None
+
+    def begin_sweep(self):
+        return SweepBudget(self.sweep_budget_seconds)
+
+    def _executors(self):
+        with self._lock:
+            if self._workers is None:
+                self._workers = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='ai-consult')
+                self._calls = ThreadPoolExecutor(max_workers=self.concurrency * self.batch_size,
+                                                 thread_name_prefix='ai-call')
+                self._dispatcher = threading.Thread(target=self._dispatch, name='ai-dispatch', daemon=True)
+                self._dispatcher.start()
+            return self._workers, self._calls
+
+    def cached_advice(self, patient_id, latest_vital_id):
+        with self._lock:
+            advice = self._advice.get((patient_id, latest_vital_id))
+            if advice is not None:
+                self._advice.move_to_end((patient_id, latest_vital_id))
+            return advice
+
+    def request(self, patient_id, latest_vital_id, result, budget=None):
+        """
+        Attach known advice to `result` (and the cached copy), or queue a
+        consult for it. Never blocks on the LLM. Returns True if advice was attached.
+        """
+        from predictive_analytics import risk_predictor
+        from risk_cache import risk_cache
+
+        if latest_vital_id is None or not self.enabled():
+            return False
+        key = (patient_id, latest_vital_id)
+        advice = self.cached_advice(patient_id, latest_vital_id)
+        if advice is not None:
+            self.stats['cache_hits'] += 1
+            risk_predictor.apply_ai_advice(result, advice)
+            risk_cache.patch(patient_id, latest_vital_id, lambda r: risk_predictor.apply_ai_advice(r, advice))
+            return True
+
+        with self._lock:
+            if key in self._in_flight:
+                return False
+        if budget is not None and budget.exhausted:
+            self.stats['skipped_budget'] += 1
+            return False
+        if not self.breaker.allow():
+            self.stats['skipped_breaker'] += 1
+            return False
+
+        try:
+            case = self._case(patient_id, result)
+        except Exception as e:
+            logger.debug(f"AI consult skipped for patient {patient_id}: {e}")
+            self.breaker.release()
+            return False
+        with self._lock:
+            if key in self._in_flight:
+                self.breaker.release()
+                return False
+            self._in_flight.add(key)
+        self._executors()
+        self._queue.put((key, case, budget))
+        self.stats['queued'] += 1
+        return False
+
+    def _case(self, patient_id, result):
+        from models import Patient, VitalSign
+        from predictive_analytics import risk_predictor
+
+        patient = Patient.query.get(patient_id)
+        vitals = VitalSign.query.filter_by(patient_id=patient_id).order_by(
+            VitalSign.recorded_at.desc(), VitalSign.id.desc()
+        ).limit(10).all()
+        return risk_predictor.build_ai_case(patient, vitals, result['risk_score'], result.get('risk_factors', []))
+
+    def _dispatch(self):
+        """Hand each free worker everything queued, up to batch_size cases"""
+        workers, _ = self._executors()
+        while True:
+            batch = [self._queue.get()]
+            # While every worker is busy the queue keeps filling, so batches
+            # grow with load instead of adding round trips
+            self._free_workers.acquire()
+            deadline = time.monotonic() + self.batch_wait_seconds
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            try:
+                workers.submit(self._consult_batch, batch)
+            except RuntimeError:
+                # Interpreter shutting down
+                return
+
+    def _consult_batch(self, batch):
+        from predictive_analytics import risk_predictor
+
+        try:
+            live = []
+            for item in batch:
+                budget = item[2]
+                if budget is not None and budget.exhausted:
+                    # Queued behind slower calls until the sweep ran out of time
+                    self.stats['skipped_budget'] += 1
+                    self.breaker.release()
+                elif self.breaker.state == 'open':
+                    # The breaker tripped while this consult was waiting in the queue
+                    self.stats['skipped_breaker'] += 1
+                else:
+                    live.append(item)
+            if len(live) == 1:
+                self._consult_single(live)
+            elif live:
+                self.stats['batches'] += 1
+                self.stats['batched_cases'] += len(live)
+                prompt = risk_predictor.build_batch_ai_prompt([case for _, case, _ in live])
+                ok, text = self._call([prompt], self._timeout(live))[0]
+                if not ok:
+                    return
+                if not text:
+                    self.stats['empty'] += len(live)
+                    return
+                try:
+                    advice = risk_predictor.parse_batch_ai_advice(text, len(live))
+                except ValueError as e:
+                    self.stats['parse_failures'] += 1
+                    logger.warning(f"Unparseable batched AI response, retrying {len(live)} patients singly: {e}")
+                    advice = {}
+                missing = []
+                for n, item in enumerate(live, start=1):
+                    if n in advice:
+                        self.stats['completed'] += 1
+                        self._deliver(item[0], advice[n])
+                    else:
+                        missing.append(item)
+                if missing:
+                    self.stats['fallback_singles'] += len(missing)
+                    self._consult_single(missing)
+        finally:
+            with self._lock:
+                for key, _, _ in batch:
+                    self._in_flight.discard(key)
+            self._free_workers.release()
+
+    def _consult_single(self, items):
+        """One single-patient prompt per item, sent concurrently"""
+        from predictive_analytics import risk_predictor
+
+        prompts = [risk_predictor.build_ai_prompt(case) for _, case, _ in items]
+        for item, (ok, text) in zip(items, self._call(prompts, self._timeout(items))):
+            if not ok:
+                continue
+            if not text:
+                self.stats['empty'] += 1
+                continue
+            self.stats['completed'] += 1
+            self._deliver(item[0], risk_predictor.parse_ai_advice(text))
+
+    def _timeout(self, items):
+        timeout = self.timeout_seconds
+        for _, _, budget in items:
+            if budget is not None:
+                timeout = min(timeout, max(0.0, budget.deadline - time.monotonic()))
+        return timeout
+
+    def _call(self, prompts, timeout):
+        """
+        Send the prompts concurrently and wait at most `timeout` seconds for
+        all of them. Returns (ok, text) per prompt; failures feed the breaker.
+        """
+        from predictive_analytics import risk_predictor
+
+        _, calls = self._executors()
+        llm = self.llm or risk_predictor.call_llm
+        deadline = time.monotonic() + timeout
+        futures = [calls.submit(llm, prompt) for prompt in prompts]
+        results = []
+        for future in futures:
+            try:
+                text = future.result(timeout=max(0.0, deadline - time.monotonic()))
+            except FutureTimeout:
+                self.stats['timed_out'] += 1
+                self.breaker.record_failure()
+                results.append((False, None))
+                continue
+            except Exception as e:
+                self.stats['failed'] += 1
+                self.breaker.record_failure()
+                logger.error(f"AI consult failed: {e}")
+                results.append((False, None))
+                continue
+            self.breaker.record_success()
+            results.append((True, text))
+        return results
+
+    def _deliver(self, key, advice):
+        from predictive_analytics import risk_predictor
+        from risk_cache import risk_cache
+
+        patient_id, latest_vital_id = key
+        with self._lock:
+            self._advice[key] = advice
+            self._advice.move_to_end(key)
+            while len(self._advice) > self.cache_size:
+                self._advice.popitem(last=False)
+
+        patched = {}
+
+        def attach(result):
+            risk_predictor.apply_ai_advice(result, advice)
+            patched.update(result)
+
+        risk_cache.patch(patient_id, latest_vital_id, attach)
+        try:
+            from app import socketio
+            socketio.emit('risk_ai_update', {
+                'patient_id': patient_id,
+                'note': advice.get('note'),
+                'suggested_level': patched.get('risk_level', advice.get('suggested_level')),
+                'suggested_score': patched.get('risk_score', advice.get('suggested_score')),
+            })
+        except Exception as e:
+            logger.error(f"Socket emit error: {e}")
+
+    def report(self):
+        return {
+            **self.stats,
+            'in_flight': len(self._in_flight),
+            'cached': len(self._advice),
+            'breaker': self.breaker.state,
+            'queue_depth': self._queue.qsize(),
+            'concurrency': self.concurrency,
+            'batch_size': self.batch_size,
+            'batch_wait_ms': round(self.batch_wait_seconds * 1000),
+            'avg_batch_cases': round(self.stats['batched_cases'] / self.stats['batches'], 2) if self.stats['batches'] else None,
+            'model': type(self.llm).__name__ if self.llm is not None else 'gemini',
+            'timeout_seconds': self.timeout_seconds,
+            'sweep_budget_seconds': self.sweep_budget_seconds,
+        }
+
+
+ai_consultant = AIConsultant()
@@ -0,0 +1,243 @@
+"""
+Escalation of unacknowledged alerts.
+
+Every routed alert gets a deadline that depends on its severity. If nobody
+acknowledges it in time, the alert is re-routed through AlertRouter to the
+next tier (department/specialty staff, then every on-duty doctor and nurse)
+and emitted to the newly added staff rooms.
+
+Deadlines are held in memory in a hashed timing wheel, so scheduling and
+cancelling are O(1) and the scheduler never polls the database; it only
+loads an alert when its deadline actually fires.
+
+Every process that routes alerts runs a wheel, and every process re-arms
+the open alerts when it starts, so several may hold the same deadline. Each
+escalation step is therefore claimed with a conditional
+UPDATE alerts SET escalation_tier = t + 1 WHERE escalation_tier = t; only
+the process whose update matched routes and emits that tier, the others
+drop their timer. Staff already notified are read from alert_recipients, so
+a re-armed alert does not page its original recipients again.
+
+Deadlines are configured in seconds with ESCALATION_DEADLINE_<SEVERITY>
+(e.g. ESCALATION_DEADLINE_CRITICAL=60).
+"""
+
+import logging
+import math
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+DEFAULT_DEADLINES = {
+    'emergency': 30,
+    'critical': 60,
+    'warning': 300,
+    'info': 900,
+}
+
+# Tier 0 is the initial routing done when the alert is created
+MAX_TIER = 2
+
+
+def escalation_deadline(severity):
+    default = DEFAULT_DEADLINES.get(severity, DEFAULT_DEADLINES['warning'])
+    return int(os.environ.get(f'ESCALATION_DEADLINE_{severity.upper()}', default))
+
+
+class TimerWheel:
+    """
+    Hashed timing wheel. Each slot holds the timers whose deadline tick maps
+    to it; timers further away than one revolution simply stay in their slot
+    until their tick comes round. Schedule and cancel are O(1) dict operations.
+    """
+
+    def __init__(self, tick_seconds=1.0, num_slots=512):
+        self.tick_seconds = tick_seconds
+        self.num_slots = num_slots
+        self.slots = [dict() for _ in range(num_slots)]
+        self.index = {}  # key -> slot number
+        self.current_tick = 0
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def schedule(self, key, delay_seconds, payload):
+        self.cancel(key)
+        ticks = max(1, math.ceil(delay_seconds / self.tick_seconds))
+        target = self.current_tick + ticks
+        slot = target % self.num_slots
+        self.slots[slot][key] = (target, payload)
+        self.index[key] = slot
+
+    def cancel(self, key):
+        slot = self.index.pop(key, None)
+        if slot is None:
+            return False
+        self.slots[slot].pop(key, None)
+        return True
+
+    def advance(self, ticks=1):
+        """Move the wheel forward and return the (key, payload) pairs that expired"""
+        expired = []
+        for _ in range(ticks):
+            self.current_tick += 1
+            bucket = self.slots[self.current_tick % self.num_slots]
+            if not bucket:
+                continue
+            due = [key for key, (target, _) in bucket.items() if target <= self.current_tick]
+            for key in due:
+                _, payload = bucket.pop(key)
+                self.index.pop(key, None)
+                expired.append((key, payload))
+        return expired
+
+
+class EscalationScheduler:
+    def __init__(self, tick_seconds=1.0):
+        self.wheel = TimerWheel(tick_seconds=tick_seconds)
+        self._lock = threading.Lock()
+        self._thread = None
+        self.stats = {'scheduled': 0, 'cancelled': 0, 'escalated': 0}
+
+    def start(self):
+        """Start the wheel thread once per process and re-arm alerts left open by a restart"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='alert-escalation', daemon=True)
+            self._thread.start()
+        try:
+            self.rearm_open_alerts()
+        except Exception as e:
+            logger.error(f"Could not re-arm open alerts: {e}")
+
+    def _run(self):
+        tick = self.wheel.tick_seconds
+        next_tick = time.monotonic() + tick
+        while True:
+            time.sleep(max(0, next_tick - time.monotonic()))
+            # Catch up if the thread was starved for more than one tick
+            behind = 1 + int((time.monotonic() - next_tick) // tick)
+            next_tick += behind * tick
+            with self._lock:
+                expired = self.wheel.advance(behind)
+            for alert_id, state in expired:
+                try:
+                    self._escalate(alert_id, state)
+                except Exception as e:
+                    logger.error(f"Error escalating alert {alert_id}: {e}")
+
+    def schedule(self, alert_id, severity, notified_ids=(), tier=0, delay=None):
+        """Arm the deadline for an alert that has just been routed at `tier`"""
+        if tier >= MAX_TIER:
+            return
+        if self._thread is None:
+            self.start()
+        state = {
+            'severity': severity,
+            'tier': tier,
+            'notified': set(notified_ids),
+        }
+        with self._lock:
+            self.wheel.schedule(alert_id, escalation_deadline(severity) if delay is None else delay, state)
+        self.stats['scheduled'] += 1
+
+    def cancel(self, alert_id):
+        with self._lock:
+            cancelled = self.wheel.cancel(alert_id)
+        if cancelled:
+            self.stats['cancelled'] += 1
+        return cancelled
+
+    def pending(self):
+        return len(self.wheel)
+
+    def rearm_open_alerts(self, horizon_hours=24):
+        """Schedule deadlines for alerts that were still open when the process started"""
+        from app import app, db
+        from models import Alert, AlertRecipient
+        now = datetime.now()
+        with app.app_context():
+            rows = Alert.query.with_entities(Alert.id, Alert.severity, Alert.created_at, Alert.escalation_tier).filter(
+                Alert.is_acknowledged == False,
+                Alert.created_at >= now - timedelta(hours=horizon_hours),
+                db.func.coalesce(Alert.escalation_tier, 0) < MAX_TIER
+            ).all()
+            notified = {}
+            for alert_id, staff_id in db.session.query(AlertRecipient.alert_id, AlertRecipient.staff_id).filter(
+                AlertRecipient.alert_id.in_([row.id for row in rows])
+            ):
+                notified.setdefault(alert_id, set()).add(staff_id)
+        for alert_id, severity, created_at, tier in rows:
+            if alert_id in self.wheel:
+                continue
+            severity, tier = severity or 'warning', tier or 0
+            # Each tier has one deadline's worth of time from the alert's creation
+            remaining = (tier + 1) * escalation_deadline(severity) - (now - created_at).total_seconds()
+            self.schedule(alert_id, severity, notified_ids=notified.get(alert_id, ()), tier=tier,
+                          delay=max(self.wheel.tick_seconds, remaining))
+        logger.info(f"Re-armed escalation deadlines for {len(rows)} open alerts")
+
+    def claim(self, alert_id, tier):
+        """Move an open alert from `tier` to tier + 1; True only for the one process whose update matched"""
+        from sqlalchemy import update
+        from app import db
+        from models import Alert
+
+        claimed = db.session.execute(
+            update(Alert.__table__).where(
+                Alert.__table__.c.id == alert_id,
+                Alert.__table__.c.is_acknowledged == False,
+                db.func.coalesce(Alert.__table__.c.escalation_tier, 0) == tier
+            ).values(escalation_tier=tier + 1)
+        ).rowcount
+        db.session.commit()
+        return claimed == 1
+
+    def _escalate(self, alert_id, state):
+        from app import app, db, socketio
+        from models import Alert, AlertRecipient
+        from alert_router import alert_router, record_recipients
+
+        with app.app_context():
+            if not self.claim(alert_id, state['tier']):
+                # Acknowledged, or another process escalated this tier
+                return
+            alert = Alert.query.get(alert_id)
+            patient = alert.patient
+            tier = state['tier'] + 1
+            already = {staff_id for (staff_id,) in db.session.query(AlertRecipient.staff_id).filter_by(alert_id=alert_id)}
+            notified = state['notified'] | already
+            recipients = alert_router.route_escalation(patient, alert.severity, tier)
+            new_recipients = [r for r in recipients if r.id not in notified]
+
+            payload = {
+                'id': alert.id,
+                'patient_id': patient.id,
+                'patient_name': patient.full_name,
+                'title': alert.title,
+                'message': alert.message,
+                'severity': alert.severity,
+                'room': patient.room_number,
+                'bed': patient.bed_number,
+                'escalation_tier': tier,
+            }
+            record_recipients(alert.id, new_recipients, tier=tier)
+            for recipient in new_recipients:
+                socketio.emit('new_alert', payload, to=f"staff_{recipient.id}")
+
+            self.stats['escalated'] += 1
+            logger.info(f"Escalated alert {alert_id} to tier {tier} ({len(new_recipients)} new recipients)")
+
+            notified |= {r.id for r in new_recipients}
+            self.schedule(alert_id, alert.severity, notified_ids=notified, tier=tier)
+
+
+escalation_scheduler = EscalationScheduler()
@@ -0,0 +1,166 @@
+"""
+End-to-end latency of the vital -> alert -> nurse pipeline.
+
+Each alert produced by the simulator carries a trace of wall-clock stage
+timestamps: ingest (vital recorded), evaluated (thresholds checked),
+inserted (alert row committed), routed (recipients chosen), emitted
+(new_alert sent) and received (client acknowledged receipt over the
+socket). Stage-to-stage spans are folded into fixed-bucket histograms per
+(severity, ward), from which p50/p95/p99 are read without keeping samples.
+"""
+
+import bisect
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+STAGES = ['ingest', 'evaluated', 'inserted', 'routed', 'emitted', 'received']
+
+# span name -> (from stage, to stage)
+SPANS = OrderedDict([
+    ('evaluate', ('ingest', 'evaluated')),
+    ('insert', ('evaluated', 'inserted')),
+    ('route', ('inserted', 'routed')),
+    ('emit', ('routed', 'emitted')),
+    ('ingest_to_emit', ('ingest', 'emitted')),
+    ('ingest_to_receipt', ('ingest', 'received')),
+])
+
+
+def _bucket_bounds(lowest_ms=0.1, highest_ms=120000.0, growth=1.15):
+    bounds = []
+    value = lowest_ms
+    while value < highest_ms:
+        bounds.append(value)
+        value *= growth
+    bounds.append(highest_ms)
+    return bounds
+
+
+class LatencyHistogram:
+    """Log-bucketed histogram in milliseconds; percentiles are accurate to one bucket (~15%)"""
+
+    BOUNDS = _bucket_bounds()
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.total = 0
+        self.max_ms = 0.0
+
+    def record(self, ms):
+        self.counts[bisect.bisect_left(self.BOUNDS, ms)] += 1
+        self.total += 1
+        self.max_ms = max(self.max_ms, ms)
+
+    def merge(self, other):
+        for i, c in enumerate(other.counts):
+            self.counts[i] += c
+        self.total += other.total
+        self.max_ms = max(self.max_ms, other.max_ms)
+
+    def percentile(self, q):
+        if not self.total:
+            return None
+        target = q * self.total
+        running = 0
+        for i, c in enumerate(self.counts):
+            running += c
+            if running >= target:
+                upper = self.BOUNDS[i] if i < len(self.BOUNDS) else self.max_ms
+                return round(min(upper, self.max_ms), 2)
+        return round(self.max_ms, 2)
+
+    def summary(self):
+        return {
+            'count': self.total,
+            'p50_ms': self.percentile(0.50),
+            'p95_ms': self.percentile(0.95),
+            'p99_ms': self.percentile(0.99),
+            'max_ms': round(self.max_ms, 2) if self.total else None,
+        }
+
+
+class AlertLatencyTracker:
+    def __init__(self, max_traces=10000):
+        self.max_traces = max_traces
+        self._traces = OrderedDict()  # alert_id -> {'severity', 'ward', 'stages': {}}
+        self._histograms = {}  # (severity, ward, span) -> LatencyHistogram
+        self._lock = threading.Lock()
+
+    def begin(self, alert_id, severity, ward, **stage_times):
+        """Start a trace for a freshly inserted alert, with any stages already timed"""
+        with self._lock:
+            self._traces[alert_id] = {
+                'severity': severity or 'warning',
+                'ward': ward or 'Unassigned',
+                'stages': dict(stage_times),
+            }
+            while len(self._traces) > self.max_traces:
+                self._traces.popitem(last=False)
+
+    def mark(self, alert_id, stage, at=None):
+        at = time.time() if at is None else at
+        with self._lock:
+            trace = self._traces.get(alert_id)
+            if trace is None:
+                return
+            trace['stages'][stage] = at
+            if stage == 'emitted':
+                self._record_spans(trace, exclude=('ingest_to_receipt',))
+
+    def record_receipt(self, alert_id, at=None):
+        """A client confirmed it displayed the alert; every recipient's receipt is a sample"""
+        at = time.time() if at is None else at
+        with self._lock:
+            trace = self._traces.get(alert_id)
+            if trace is None or 'ingest' not in trace['stages']:
+                return
+            self._add(trace, 'ingest_to_receipt', at - trace['stages']['ingest'])
+
+    def _record_spans(self, trace, exclude=()):
+        stages = trace['stages']
+        for span, (start, end) in SPANS.items():
+            if span in exclude or start not in stages or end not in stages:
+                continue
+            self._add(trace, span, stages[end] - stages[start])
+
+    def _add(self, trace, span, seconds):
+        key = (trace['severity'], trace['ward'], span)
+        hist = self._histograms.get(key)
+        if hist is None:
+            hist = self._histograms[key] = LatencyHistogram()
+        hist.record(max(0.0, seconds) * 1000.0)
+
+    def report(self):
+        """Percentiles per (severity, ward) and overall per severity"""
+        with self._lock:
+            groups = {}
+            overall = {}
+            for (severity, ward, span), hist in self._histograms.items():
+                groups.setdefault((severity, ward), {})[span] = hist.summary()
+                merged = overall.setdefault(severity, {}).setdefault(span, LatencyHistogram())
+                merged.merge(hist)
+            return {
+                'spans': list(SPANS.keys()),
+                'groups': [
+                    {'severity': severity, 'ward': ward, 'spans': spans}
+                    for (severity, ward), spans in sorted(groups.items())
+                ],
+                'overall': [
+                    {'severity': severity, 'spans': {span: h.summary() for span, h in spans.items()}}
+                    for severity, spans in sorted(overall.items())
+                ],
+                'open_traces': len(self._traces),
+            }
+
+    def reset(self):
+        with self._lock:
+            self._traces.clear()
+            self._histograms.clear()
+
+
+latency_tracker = AlertLatencyTracker()
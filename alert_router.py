@@ -6,6 +6,14 @@ from datetime import datetime
 
 logging.basicConfig(level=logging.DEBUG)
 
+# Ordering used wherever alerts are compared or sorted by severity
+SEVERITY_RANK = {
+    'info': 0,
+    'warning': 1,
+    'critical': 2,
+    'emergency': 3,
+}
+
 
 class AlertRouter:
     def __init__(self):
@@ -129,6 +137,12 @@ class AlertRouter:
         else:
             return paths['primary'] or paths['secondary'] or paths['broadcast']
     
+    def route_escalation(self, patient, alert_severity, tier):
+        """Recipients for an unacknowledged alert escalated to `tier`"""
+        if tier <= 1:
+            return self.route_by_specialty(patient, alert_severity)
+        return self.route_by_availability()
+    
     def distribute_alert(self, patient_id, alert_id, alert_severity):
         """Distribute alert to assigned doctor and nurses only when on-duty"""
         from models import Patient, Alert, StaffMember
@@ -161,13 +175,37 @@ class AlertRouter:
         return recipients
 
 
+def severity_rank(column):
+    """SQL expression ranking a severity column by SEVERITY_RANK (unknown values rank lowest)"""
+    from sqlalchemy import case
+    return case(SEVERITY_RANK, value=column, else_=-1)
+
+
+def record_recipients(alert_id, recipients, tier=0):
+    """Persist who an alert was routed to so per-staff alert queries can filter on it"""
+    from app import db
+    from models import AlertRecipient
+    if not recipients:
+        return
+    try:
+        existing = {
+            staff_id for (staff_id,) in db.session.query(AlertRecipient.staff_id).filter_by(alert_id=alert_id)
+        }
+        for staff_id in {staff.id for staff in recipients} - existing:
+            db.session.add(AlertRecipient(alert_id=alert_id, staff_id=staff_id, tier=tier))
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"Error recording recipients for alert {alert_id}: {e}")
+
+
 alert_router = AlertRouter()
 
 
 def distribute_alerts_to_staff(patient_id, alert_severity, alert_id):
     """Distribute alert to multiple staff members via different paths"""
     try:
-        recipients = alert_router.distribute_alert(patient_id, alert_severity, alert_id)
+        recipients = alert_router.distribute_alert(patient_id, alert_id, alert_severity)
         logging.info(f"Distributed alert {alert_id} to {len(recipients)} recipients")
         return recipients
     except Exception as e:
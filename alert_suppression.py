@@ -0,0 +1,133 @@
+"""
+Alert storm suppression.
+
+While a patient stays in the same abnormal state, every simulator cycle
+re-triggers the same threshold breach. Instead of inserting a new Alert each
+time, repeat breaches inside the aggregation window are folded into the open
+alert for the same (patient, alert type, severity): its occurrence counter and
+last-seen timestamp are bumped and no routing or socket fan-out happens.
+A breach of higher severity than any open alert always creates a new alert.
+
+The window is configured with ALERT_SUPPRESSION_WINDOW_SECONDS (default 300,
+0 disables suppression).
+"""
+
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, update
+
+from alert_router import SEVERITY_RANK
+
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+
+class AlertSuppressor:
+    def __init__(self, window_seconds=None):
+        if window_seconds is None:
+            window_seconds = int(os.environ.get('ALERT_SUPPRESSION_WINDOW_SECONDS', 300))
+        self.window = timedelta(seconds=window_seconds)
+        # (patient_id, alert_type, severity) -> (alert_id, created_at)
+        self._open = {}
+        self._warmed = False
+        self._lock = threading.Lock()
+        self.stats = {'inserted': 0, 'suppressed': 0}
+
+    @property
+    def enabled(self):
+        return self.window.total_seconds() > 0
+
+    def _warm(self):
+        """Load open alerts still inside the window once, so later lookups stay in memory"""
+        from models import Alert
+        cutoff = datetime.now() - self.window
+        rows = Alert.query.with_entities(
+            Alert.id, Alert.patient_id, Alert.alert_type, Alert.severity, Alert.created_at
+        ).filter(
+            Alert.is_acknowledged == False,
+            Alert.created_at >= cutoff
+        ).all()
+        for alert_id, patient_id, alert_type, severity, created_at in rows:
+            key = (patient_id, alert_type, severity)
+            current = self._open.get(key)
+            if current is None or created_at > current[1]:
+                self._open[key] = (alert_id, created_at)
+        self._warmed = True
+
+    def _candidates(self, patient_id, alert_type, severity, now):
+        """Open alerts of equal or higher severity, exact severity first"""
+        rank = SEVERITY_RANK.get(severity, 0)
+        severities = [severity] + sorted(
+            (s for s, r in SEVERITY_RANK.items() if r > rank and s != severity),
+            key=lambda s: SEVERITY_RANK[s]
+        )
+        for sev in severities:
+            key = (patient_id, alert_type, sev)
+            entry = self._open.get(key)
+            if entry is None:
+                continue
+            if now - entry[1] > self.window:
+                self._open.pop(key, None)
+                continue
+            yield key, entry[0]
+
+    def _fold(self, alert_id, now):
+        """Bump the counter on an open alert; returns False if it was acknowledged meanwhile"""
+        from app import db
+        from models import Alert
+        result = db.session.execute(
+            update(Alert)
+            .where(Alert.id == alert_id, Alert.is_acknowledged == False)
+            .values(
+                occurrence_count=func.coalesce(Alert.occurrence_count, 1) + 1,
+                last_seen_at=now
+            )
+        )
+        db.session.commit()
+        return result.rowcount == 1
+
+    def record_breach(self, patient_id, vital_sign_id, alert_data):
+        """
+        Record a threshold breach produced by check_vital_thresholds.
+        Returns the newly inserted Alert, or None when the breach was folded
+        into an alert that is already open.
+        """
+        from app import db
+        from models import Alert
+
+        now = datetime.now()
+        with self._lock:
+            if self.enabled:
+                if not self._warmed:
+                    self._warm()
+                for key, alert_id in list(self._candidates(patient_id, alert_data['type'], alert_data['severity'], now)):
+                    if self._fold(alert_id, now):
+                        self.stats['suppressed'] += 1
+                        logger.debug(f"Suppressed repeat {key} into alert {alert_id}")
+                        return None
+                    # Acknowledged since we cached it - forget and keep looking
+                    self._open.pop(key, None)
+
+            alert = Alert(
+                patient_id=patient_id,
+                vital_sign_id=vital_sign_id,
+                alert_type=alert_data['type'],
+                severity=alert_data['severity'],
+                title=alert_data['title'],
+                message=alert_data['message'],
+                occurrence_count=1,
+                created_at=now,
+                last_seen_at=now
+            )
+            db.session.add(alert)
+            db.session.commit()
+            self.stats['inserted'] += 1
+            if self.enabled:
+                self._open[(patient_id, alert.alert_type, alert.severity)] = (alert.id, now)
+            return alert
+
+
+alert_suppressor = AlertSuppressor()
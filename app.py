@@ -128,6 +128,16 @@ def handle_connect(auth=None):
         # Optional: handling for non-staff connections or anonymous
         pass
 
+@socketio.on('alert_received')
+def handle_alert_received(data):
+    # Client-side receipt of a new_alert; escalation re-sends are not part of the SLO
+    from alert_latency import latency_tracker
+    if isinstance(data, dict) and data.get('id') and not data.get('escalation_tier'):
+        try:
+            latency_tracker.record_receipt(int(data['id']))
+        except (TypeError, ValueError):
+            pass
+
 # Expose socketio to other modules if needed via app context or direct import
 app.socketio = socketio
 
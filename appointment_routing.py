@@ -4,8 +4,10 @@ Uses multiple factors to intelligently allocate patients to doctors
 """
 
 from datetime import datetime, timedelta
+import numpy as np
 from database import db
 from models import StaffMember, Patient, AppointmentRequest, VitalSign, DoctorNote, Shift
+from slot_calendar import requested_start, slot_calendar
 import logging
 
 logging.basicConfig(level=logging.DEBUG)
@@ -157,33 +159,103 @@ class AppointmentRoutingEngine:
         Calculate routing score for a doctor
         Higher score = better match for patient
         """
-        score = 0
-        
-        # 1. Specialization Match (0.30)
-        specialization_score = self._calculate_specialization_match(
-            doctor, 
-            appointment_request.department,
-            appointment_request.appointment_type
-        )
-        score += specialization_score * self.weights['specialization_match']
-        
-        # 2. Workload Assessment (0.25)
-        workload_score = self._calculate_workload_score(doctor, appointment_request.preferred_date)
-        score += workload_score * self.weights['workload']
-        
-        # 3. Availability (0.20)
-        availability_score = self._calculate_availability_score(doctor, appointment_request.preferred_date)
-        score += availability_score * self.weights['availability']
-        
-        # 4. Patient History (0.15)
-        history_score = self._calculate_patient_history_score(doctor, appointment_request.patient)
-        score += history_score * self.weights['patient_history']
-        
-        # 5. Urgency Response Capability (0.10)
-        urgency_score = self._calculate_urgency_response_score(doctor, appointment_request.urgency)
-        score += urgency_score * self.weights['urgency_response']
+        return float(self.score_doctors([doctor], appointment_request)[0])
+    
+    def score_doctors(self, doctors, appointment_request):
+        """
+        Routing scores of all candidate doctors at once, in `doctors` order.
+        The per-doctor factors come from three grouped queries (see
+        _prefetch), so the cost does not grow with the number of round trips
+        per candidate.
+        """
+        workload, shifts, notes = self._prefetch(doctors, appointment_request)
+        return self.weighted_scores(self.factor_matrix(doctors, appointment_request, workload, shifts, notes))
+    
+    def weighted_scores(self, matrix):
+        """Scores of a (... x factors) matrix, factor columns in self.weights order"""
+        # Weighted sum accumulated factor by factor, in the same order and
+        # with the same float operations as scoring one doctor at a time
+        scores = np.zeros(matrix.shape[:-1])
+        for column, weight in enumerate(self.weights.values()):
+            scores += matrix[..., column] * weight
+        return scores
+    
+    def factor_matrix(self, doctors, appointment_request, workload, shifts, notes):
+        """
+        (doctors x factors) matrix, columns in self.weights order, from
+        prefetched lookups shaped like _prefetch's results
+        """
+        patient = appointment_request.patient
+        rows = []
+        for doctor in doctors:
+            factors = {
+                # 1. Specialization Match (0.30)
+                'specialization_match': self._calculate_specialization_match(
+                    doctor,
+                    appointment_request.department,
+                    appointment_request.appointment_type
+                ),
+                # 2. Workload Assessment (0.25)
+                'workload': self._calculate_workload_score(workload.get(doctor.id, 0)
+                                                           if workload is not None else None),
+                # 3. Availability (0.20)
+                'availability': self._calculate_availability_score(shifts.get(doctor.id, False)
+                                                                   if shifts is not None else None),
+                # 4. Patient History (0.15)
+                'patient_history': self._calculate_patient_history_score(doctor, patient, notes.get(doctor.id, 0)),
+                # 5. Urgency Response Capability (0.10)
+                'urgency_response': self._calculate_urgency_response_score(doctor, appointment_request.urgency),
+            }
+            rows.append([factors[name] for name in self.weights])
+        return np.array(rows, dtype=np.float64).reshape(len(doctors), len(self.weights))
+    
+    def _prefetch(self, doctors, appointment_request):
+        """
+        ({doctor_id: appointments that day}, {doctor_id: available},
+        {doctor_id: notes on this patient}). With a requested time a doctor is
+        available when that slot is free in their calendar; with only a date,
+        when their first shift that day is active. Without a preferred date
+        the first two are None.
+        """
+        doctor_ids = [d.id for d in doctors]
+        preferred_date = appointment_request.preferred_date
+        workload, shifts = None, None
+        if preferred_date:
+            # Range predicates rather than date(...) = day, so the
+            # (doctor_id, preferred_date) and (staff_id, start_time) indexes apply
+            day_start = datetime.combine(preferred_date.date(), datetime.min.time())
+            day_end = day_start + timedelta(days=1)
+            workload = dict(db.session.query(
+                AppointmentRequest.doctor_id, db.func.count(AppointmentRequest.id)
+            ).filter(
+                AppointmentRequest.doctor_id.in_(doctor_ids),
+                AppointmentRequest.preferred_date >= day_start,
+                AppointmentRequest.preferred_date < day_end,
+                AppointmentRequest.status.in_(['confirmed', 'pending'])
+            ).group_by(AppointmentRequest.doctor_id))
+            
+            start = requested_start(appointment_request)
+            if start is not None:
+                # One calendar row per doctor: the requested slot decides availability
+                free = slot_calendar.free_doctors(doctor_ids, start)
+                shifts = {doctor_id: doctor_id in free for doctor_id in doctor_ids}
+            else:
+                # A doctor's first shift of the day decides availability
+                shifts = {}
+                for staff_id, is_active in db.session.query(Shift.staff_id, Shift.is_active).filter(
+                    Shift.staff_id.in_(doctor_ids),
+                    Shift.start_time >= day_start,
+                    Shift.start_time < day_end
+                ).order_by(Shift.staff_id, Shift.id):
+                    shifts.setdefault(staff_id, bool(is_active))
         
-        return score
+        notes = dict(db.session.query(
+            DoctorNote.doctor_id, db.func.count(DoctorNote.id)
+        ).filter(
+            DoctorNote.doctor_id.in_(doctor_ids),
+            DoctorNote.patient_id == appointment_request.patient.id
+        ).group_by(DoctorNote.doctor_id))
+        return workload, shifts, notes
     
     def _calculate_specialization_match(self, doctor, department, appointment_type):
         """Match doctor specialization with appointment requirements"""
@@ -208,49 +280,30 @@ class AppointmentRoutingEngine:
         
         return 0.3
     
-    def _calculate_workload_score(self, doctor, preferred_date):
-        """Calculate workload score (fewer appointments = higher score)"""
-        if not preferred_date:
+    def _calculate_workload_score(self, appointment_count):
+        """Calculate workload score (fewer appointments = higher score); None = no preferred date"""
+        if appointment_count is None:
             return 0.5
         
-        # Count appointments on that date
-        appointment_count = AppointmentRequest.query.filter(
-            AppointmentRequest.doctor_id == doctor.id,
-            db.func.date(AppointmentRequest.preferred_date) == preferred_date.date(),
-            AppointmentRequest.status.in_(['confirmed', 'pending'])
-        ).count()
-        
         # Max 10 appointments per day
         workload = appointment_count / 10.0
         score = max(0, 1 - workload)  # Inverse relationship
         
         return score
     
-    def _calculate_availability_score(self, doctor, preferred_date):
-        """Check doctor availability on preferred date"""
-        if not preferred_date:
+    def _calculate_availability_score(self, shift_active):
+        """Availability from the doctor's shift that day; None = no preferred date"""
+        if shift_active is None:
             return 0.5
         
-        # Check shifts
-        shift = Shift.query.filter(
-            Shift.staff_id == doctor.id,
-            db.func.date(Shift.start_time) == preferred_date.date()
-        ).first()
-        
-        if shift and shift.is_active:
+        if shift_active:
             return 1.0
         
         # Doctor might be available even without a shift
         return 0.6
     
-    def _calculate_patient_history_score(self, doctor, patient):
+    def _calculate_patient_history_score(self, doctor, patient, previous_notes):
         """Prefer doctors who have treated the patient before"""
-        # Check if doctor has previous notes for patient
-        previous_notes = DoctorNote.query.filter(
-            DoctorNote.doctor_id == doctor.id,
-            DoctorNote.patient_id == patient.id
-        ).count()
-        
         if previous_notes > 0:
             return 1.0  # Perfect match - doctor knows patient
         
@@ -295,19 +348,15 @@ class AppointmentRoutingEngine:
             if not doctors:
                 return None
             
-            # Calculate scores for each doctor
-            doctor_scores = {}
-            for doctor in doctors:
-                score = self.calculate_doctor_score(doctor, appointment_request)
-                doctor_scores[doctor.id] = {
-                    'doctor': doctor,
-                    'score': score
-                }
-            
-            # Select doctor with highest score
-            best_doctor_id = max(doctor_scores, key=lambda x: doctor_scores[x]['score'])
-            best_doctor = doctor_scores[best_doctor_id]['doctor']
-            best_score = doctor_scores[best_doctor_id]['score']
+            # Score all candidates at once; ties go to the first doctor listed
+            workload, shifts, notes = self._prefetch(doctors, appointment_request)
+            scores = self.weighted_scores(self.factor_matrix(doctors, appointment_request, workload, shifts, notes))
+            if requested_start(appointment_request) is not None and any(shifts.values()):
+                # Only doctors with the requested slot free can be booked into it
+                scores = np.where([shifts[d.id] for d in doctors], scores, -np.inf)
+            best = int(np.argmax(scores))
+            best_doctor = doctors[best]
+            best_score = float(scores[best])
             
             # Update appointment with routing info
             appointment_request.doctor_id = best_doctor.id
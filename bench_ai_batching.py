@@ -0,0 +1,102 @@
+"""Measure the throughput gain of batched AI risk consultations, offline.
+
+Usage:
+  python bench_ai_batching.py [--patients 200] [--latency-ms 1000]
+                              [--per-case-ms 50] [--batch-sizes 1,4,8,16]
+                              [--concurrency 4] [--malformed]
+
+Synthetic patient cases are pushed through the background AIConsultant
+against the local fake model (fake_llm.py), once per batch size, and the
+wall time until every patient has advice is reported together with the
+number of model round trips. No database or Gemini key is needed.
+--malformed makes the fake model answer batched prompts with text that is
+not JSON, to exercise the single-call fallback.
+"""
+import argparse
+import threading
+import time
+
+from ai_consult import AIConsultant
+from fake_llm import FakeLLM
+
+
+class BenchConsultant(AIConsultant):
+    """Counts deliveries instead of patching the risk cache and emitting to browsers"""
+
+    def __init__(self, expected):
+        super().__init__()
+        self.expected = expected
+        self.delivered = 0
+        self.done = threading.Event()
+        self._count_lock = threading.Lock()
+
+    def _deliver(self, key, advice):
+        with self._count_lock:
+            self.delivered += 1
+            if self.delivered >= self.expected:
+                self.done.set()
+
+
+def synthetic_case(n):
+    score = (n * 37) % 100
+    return (
+        f"Computed risk score: {score}\n"
+        f"Patient: Bench Patient {n} (ID: PAT{n:06d}), age={20 + n % 70}, status=admitted.\n"
+        "Recent vitals (most recent first):\n"
+        "2026-01-01T12:00:00: HR=96, BP=132/84, O2=94%, Temp=99.1F, RR=20\n"
+        "Risk factors: []"
+    )
+
+
+def run(patients, batch_size, args):
+    consultant = BenchConsultant(patients)
+    consultant.llm = FakeLLM(args.latency_ms / 1000, args.per_case_ms / 1000, malformed=args.malformed)
+    consultant.batch_size = batch_size
+    consultant.concurrency = args.concurrency
+    consultant._free_workers = threading.Semaphore(args.concurrency)
+    consultant.timeout_seconds = 120
+
+    started = time.perf_counter()
+    consultant._executors()
+    for n in range(patients):
+        key = (n, n)
+        consultant._in_flight.add(key)
+        consultant._queue.put((key, synthetic_case(n), None))
+    finished = consultant.done.wait(timeout=600)
+    seconds = time.perf_counter() - started
+    report = consultant.report()
+    return {
+        'batch_size': batch_size,
+        'seconds': seconds,
+        'delivered': consultant.delivered,
+        'round_trips': consultant.llm.calls,
+        'parse_failures': report['parse_failures'],
+        'fallback_singles': report['fallback_singles'],
+        'complete': finished,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark batched AI risk consultations against a fake model.')
+    parser.add_argument('--patients', type=int, default=200)
+    parser.add_argument('--latency-ms', type=float, default=1000, help='fixed cost of one model round trip')
+    parser.add_argument('--per-case-ms', type=float, default=50, help='extra cost per patient in a prompt')
+    parser.add_argument('--batch-sizes', default='1,4,8,16')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--malformed', action='store_true')
+    args = parser.parse_args(argv)
+
+    print(f"{args.patients} patients, {args.concurrency} workers, "
+          f"fake model {args.latency_ms:.0f}ms + {args.per_case_ms:.0f}ms/patient")
+    print(f"{'batch':>5} {'seconds':>8} {'patients/s':>10} {'calls':>6} {'speedup':>8} {'fallbacks':>9}")
+    baseline = None
+    for batch_size in [int(b) for b in args.batch_sizes.split(',')]:
+        r = run(args.patients, batch_size, args)
+        baseline = baseline or r['seconds']
+        print(f"{r['batch_size']:>5} {r['seconds']:>8.2f} {r['delivered'] / r['seconds']:>10.1f} "
+              f"{r['round_trips']:>6} {baseline / r['seconds']:>7.1f}x {r['fallback_singles']:>9}"
+              f"{'' if r['complete'] else '  (incomplete)'}")
+
+
+if __name__ == '__main__':
+    main()
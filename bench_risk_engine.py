@@ -0,0 +1,294 @@
+"""Benchmark the risk engine for speed and accuracy on synthetic cohorts.
+
+Usage:
+  python bench_risk_engine.py [--sizes 100,1000,10000] [--readings 20]
+                              [--deteriorating 0.25] [--seed 7]
+                              [--sample 200] [--repeat 3]
+                              [--output-dir bench_results]
+
+Each cohort is generated deterministically from --seed in a scratch SQLite
+database created by this script (DATABASE_URL is ignored). The database is
+emptied between cohorts. Every patient follows one vital-sign pattern:
+'stable', or one of four deterioration patterns whose readings drift
+linearly from normal to clearly abnormal over --readings readings, plus
+Gaussian noise. A patient is labelled deteriorating when its pattern is not
+'stable'.
+
+Timed per cohort:
+  analyze_patient_risk    --sample patients, cold (risk cache cleared and
+                          stream state rebuilt) and cached
+  analyze_all_patients    the batch engine sweep with the cache cleared,
+                          --repeat times, alert writing off
+  news_score              scalar NEWS over every reading
+  news_scores             NumPy NEWS over every reading, --repeat times
+  news_high_query         patients_with_news_at_least(), --repeat times
+
+Accuracy compares the sweep (high/critical = detected) and the latest
+reading's NEWS (>= NEWS_ALERT_THRESHOLD = detected) with the labels, and
+checks that analyze_patient_risk agrees with the sweep on the sampled
+patients. No LLM is consulted.
+
+Results are printed and written to --output-dir as
+risk_engine-<timestamp>.json, one file per run, so runs can be compared.
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+PATTERNS = {
+    # channel -> (normal, deteriorated); stable patients stay at normal
+    'stable': {},
+    'tachycardia': {'heart_rate': (82, 138), 'respiratory_rate': (16, 24)},
+    'hypoxia': {'oxygen_saturation': (97, 85), 'respiratory_rate': (16, 30)},
+    'sepsis': {'temperature': (98.8, 103.6), 'heart_rate': (88, 126),
+               'respiratory_rate': (17, 29), 'blood_pressure_systolic': (118, 86)},
+    'hypotension': {'blood_pressure_systolic': (112, 76), 'blood_pressure_diastolic': (72, 45),
+                    'heart_rate': (84, 118)},
+}
+BASELINE = {
+    'heart_rate': (76, 5), 'blood_pressure_systolic': (120, 7), 'blood_pressure_diastolic': (78, 5),
+    'oxygen_saturation': (97.5, 0.8), 'temperature': (98.4, 0.3), 'respiratory_rate': (16, 1.5),
+}
+INTEGER_CHANNELS = ('blood_pressure_systolic', 'blood_pressure_diastolic', 'respiratory_rate')
+
+
+def generate_cohort(size, readings, deteriorating, seed):
+    """([patient dicts], [vital dicts], {patient_code: pattern}), reproducible for (size, seed)"""
+    rng = random.Random(f"{seed}:{size}")
+    start = datetime(2026, 1, 1, 8, 0)
+    sick_patterns = [name for name in PATTERNS if name != 'stable']
+    patients, vitals, labels = [], [], {}
+    for n in range(1, size + 1):
+        code = f"BENCH{n:06d}"
+        pattern = rng.choice(sick_patterns) if rng.random() < deteriorating else 'stable'
+        labels[code] = pattern
+        patients.append({
+            'patient_id': code, 'first_name': 'Bench', 'last_name': f"Patient {n}",
+            'date_of_birth': datetime(1950 + n % 50, 1 + n % 12, 1 + n % 28).date(),
+            'gender': 'Female' if n % 2 else 'Male', 'room_number': f"B{100 + n % 400}",
+            'status': 'icu' if pattern != 'stable' and n % 3 == 0 else 'admitted',
+            'admission_date': start,
+        })
+        for t in range(readings):
+            progress = t / max(readings - 1, 1)
+            reading = {'patient_code': code, 'recorded_at': start + timedelta(minutes=15 * t), 'status': 'normal'}
+            for channel, (mean, sd) in BASELINE.items():
+                low, high = PATTERNS[pattern].get(channel, (mean, mean))
+                value = low + (high - low) * progress + rng.gauss(0, sd)
+                reading[channel] = int(round(value)) if channel in INTEGER_CHANNELS else round(value, 1)
+            vitals.append(reading)
+    return patients, vitals, labels
+
+
+def load_cohort(patients, vitals):
+    """Replace the scratch database's patients and vitals; returns {patient_code: id}"""
+    from sqlalchemy import delete, insert
+    from app import db
+    from models import (
+        Alert, Patient, PatientFeatureBucket, PatientFeatures, PatientRiskSnapshot, RiskAssessment, VitalSign
+    )
+
+    for model in (Alert, RiskAssessment, PatientRiskSnapshot, PatientFeatureBucket, PatientFeatures, VitalSign, Patient):
+        db.session.execute(delete(model))
+    db.session.execute(insert(Patient), patients)
+    ids = dict(db.session.query(Patient.patient_id, Patient.id))
+    rows = [{**{k: v for k, v in r.items() if k != 'patient_code'}, 'patient_id': ids[r['patient_code']]}
+            for r in vitals]
+    for i in range(0, len(rows), 5000):
+        db.session.execute(insert(VitalSign), rows[i:i + 5000])
+    db.session.commit()
+    return ids
+
+
+def latency_summary(seconds, items=None):
+    """Percentiles in milliseconds; throughput in items/s when `items` are processed per timing"""
+    ms = np.asarray(seconds) * 1000
+    summary = {
+        'runs': len(ms),
+        'p50_ms': round(float(np.percentile(ms, 50)), 3),
+        'p95_ms': round(float(np.percentile(ms, 95)), 3),
+        'p99_ms': round(float(np.percentile(ms, 99)), 3),
+        'max_ms': round(float(ms.max()), 3),
+    }
+    if items:
+        summary['throughput_per_s'] = round(items / float(np.median(seconds)), 1)
+    return summary
+
+
+def detection_metrics(detected, labels):
+    """Confusion counts, precision, recall and accuracy of `detected` codes against the labels"""
+    tp = sum(1 for code, pattern in labels.items() if pattern != 'stable' and code in detected)
+    fp = sum(1 for code, pattern in labels.items() if pattern == 'stable' and code in detected)
+    fn = sum(1 for code, pattern in labels.items() if pattern != 'stable' and code not in detected)
+    tn = len(labels) - tp - fp - fn
+    by_pattern = {}
+    for pattern in PATTERNS:
+        codes = [code for code, p in labels.items() if p == pattern]
+        if codes:
+            by_pattern[pattern] = round(sum(code in detected for code in codes) / len(codes), 4)
+    return {
+        'tp': tp, 'fp': fp, 'fn': fn, 'tn': tn,
+        'precision': round(tp / (tp + fp), 4) if tp + fp else None,
+        'recall': round(tp / (tp + fn), 4) if tp + fn else None,
+        'accuracy': round((tp + tn) / len(labels), 4) if labels else None,
+        'detected_rate_by_pattern': by_pattern,
+    }
+
+
+def timed(fn, repeat):
+    timings, result = [], None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - started)
+    return timings, result
+
+
+def bench_cohort(size, args):
+    from app import db
+    from early_warning import NEWS_ALERT_THRESHOLD, news_score, news_scores, patients_with_news_at_least
+    from models import PatientFeatureBucket, PatientFeatures
+    from predictive_analytics import VITAL_CHANNELS, risk_predictor
+    from risk_batch import batch_risk_engine
+    from risk_cache import risk_cache
+
+    patients, vitals, labels = generate_cohort(size, args.readings, args.deteriorating, args.seed)
+    started = time.perf_counter()
+    ids = load_cohort(patients, vitals)
+    load_seconds = time.perf_counter() - started
+    codes = {pid: code for code, pid in ids.items()}
+
+    sample = random.Random(args.seed).sample(sorted(ids.values()), min(args.sample, size))
+    db.session.query(PatientFeatureBucket).delete()
+    db.session.query(PatientFeatures).delete()
+    db.session.commit()
+    cold, single = [], {}
+    for pid in sample:
+        risk_cache.clear()
+        started = time.perf_counter()
+        single[pid] = risk_predictor.analyze_patient_risk(pid)
+        cold.append(time.perf_counter() - started)
+    cached = []
+    for pid in sample:
+        started = time.perf_counter()
+        risk_predictor.analyze_patient_risk(pid)
+        cached.append(time.perf_counter() - started)
+
+    def sweep():
+        risk_cache.clear()
+        return batch_risk_engine.analyze_all(write_alerts=False)
+    sweep_timings, results = timed(sweep, args.repeat)
+
+    columns = {channel: [v[channel] for v in vitals] for channel in VITAL_CHANNELS}
+    started = time.perf_counter()
+    scalar = [news_score(v) for v in vitals]
+    scalar_seconds = time.perf_counter() - started
+    vector_timings, vector = timed(lambda: news_scores(columns), args.repeat)
+    query_timings, high = timed(lambda: patients_with_news_at_least(NEWS_ALERT_THRESHOLD), args.repeat)
+
+    by_id = {r['patient_id']: r for r in results}
+    agree = sum(
+        1 for pid, r in single.items()
+        if (r['risk_level'], r['risk_score']) == (by_id[pid]['risk_level'], by_id[pid]['risk_score'])
+    )
+    return {
+        'patients': size,
+        'readings': len(vitals),
+        'deteriorating': sum(1 for p in labels.values() if p != 'stable'),
+        'load_seconds': round(load_seconds, 3),
+        'timings': {
+            'analyze_patient_risk_cold': latency_summary(cold),
+            'analyze_patient_risk_cached': latency_summary(cached),
+            'analyze_all_patients': latency_summary(sweep_timings, items=size),
+            'news_score': {'readings_per_s': round(len(vitals) / scalar_seconds, 1)},
+            'news_scores': latency_summary(vector_timings, items=len(vitals)),
+            'news_high_query': latency_summary(query_timings),
+        },
+        'accuracy': {
+            'risk_sweep': detection_metrics(
+                {codes[r['patient_id']] for r in results if r['risk_level'] in ('high', 'critical')}, labels),
+            'news_latest_reading': detection_metrics({patient.patient_id for patient, _ in high}, labels),
+            'single_vs_batch_agreement': round(agree / len(single), 4) if single else None,
+            'news_scalar_vs_vector_agreement': bool(np.array_equal(np.asarray(scalar), vector)),
+        },
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def print_cohort(cohort):
+    t, a = cohort['timings'], cohort['accuracy']
+    sweep, news = a['risk_sweep'], a['news_latest_reading']
+    print(f"{cohort['patients']:>6,} patients ({cohort['deteriorating']:,} deteriorating, "
+          f"{cohort['readings']:,} readings)")
+    print(f"  analyze_patient_risk  cold p50 {t['analyze_patient_risk_cold']['p50_ms']}ms "
+          f"p95 {t['analyze_patient_risk_cold']['p95_ms']}ms, cached p50 {t['analyze_patient_risk_cached']['p50_ms']}ms")
+    print(f"  analyze_all_patients  p50 {t['analyze_all_patients']['p50_ms']}ms "
+          f"({t['analyze_all_patients']['throughput_per_s']:,} patients/s)")
+    print(f"  NEWS                  scalar {t['news_score']['readings_per_s']:,}/s, "
+          f"NumPy {t['news_scores']['throughput_per_s']:,}/s, query p50 {t['news_high_query']['p50_ms']}ms")
+    print(f"  risk sweep            precision {sweep['precision']} recall {sweep['recall']} accuracy {sweep['accuracy']}")
+    print(f"  NEWS >= threshold     precision {news['precision']} recall {news['recall']} accuracy {news['accuracy']}")
+    print(f"  single vs batch agreement {a['single_vs_batch_agreement']}, "
+          f"NEWS scalar == NumPy: {a['news_scalar_vs_vector_agreement']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark risk engine speed and accuracy on synthetic cohorts.')
+    parser.add_argument('--sizes', default='100,1000,10000')
+    parser.add_argument('--readings', type=int, default=20)
+    parser.add_argument('--deteriorating', type=float, default=0.25)
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--sample', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output-dir', default='bench_results')
+    args = parser.parse_args(argv)
+
+    # A private database, set up before app reads the configuration
+    scratch = tempfile.mkdtemp(prefix='bench_risk_')
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(scratch, 'bench.db')}"
+    os.environ['RISK_SWEEP_INTERVAL_SECONDS'] = '0'
+
+    from app import app
+    from ai_consult import ai_consultant
+    from predictive_analytics import risk_predictor
+
+    ai_consultant.enabled = lambda: False  # no LLM round trips in the timings
+    run = {
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'git_commit': git_commit(),
+        'python': sys.version.split()[0],
+        'settings': vars(args),
+        'cohorts': [],
+    }
+    with app.app_context():
+        run['model_version'] = risk_predictor.model_version()
+        for size in [int(s) for s in args.sizes.split(',')]:
+            cohort = bench_cohort(size, args)
+            print_cohort(cohort)
+            run['cohorts'].append(cohort)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    path = os.path.join(args.output_dir, f"risk_engine-{datetime.now():%Y%m%d-%H%M%S}.json")
+    with open(path, 'w') as f:
+        json.dump(run, f, indent=2)
+    print(f"Results written to {path}")
+    return all(c['accuracy']['news_scalar_vs_vector_agreement'] for c in run['cohorts'])
+
+
+if __name__ == '__main__':
+    sys.exit(0 if main() else 1)
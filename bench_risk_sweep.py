@@ -0,0 +1,69 @@
+"""Measure how the census risk sweep scales with process-pool workers.
+
+Usage:
+  python bench_risk_sweep.py [--workers 1,2,4,8] [--repeat 3]
+
+Runs the batch risk engine over every active patient of the configured
+database (DATABASE_URL) once per worker count, with the risk cache cleared
+and alert writing off, and prints the best wall time of --repeat runs and
+the speedup over one worker. Every run's results are compared with the
+single-worker run (ignoring analyzed_at); any difference is reported and
+makes the script exit non-zero.
+"""
+import argparse
+import sys
+import time
+
+from risk_batch import BatchRiskEngine
+from risk_cache import risk_cache
+
+
+def comparable(results):
+    return [{k: v for k, v in r.items() if k != 'analyzed_at'} for r in results]
+
+
+def run(workers, repeat):
+    engine = BatchRiskEngine(workers=workers)
+    # Always shard when workers > 1, however small the census
+    engine.parallel_min = 0
+    try:
+        # Untimed warm-up: starts the pool processes and loads the models
+        risk_cache.clear()
+        engine.analyze_all(write_alerts=False)
+        timings = []
+        for _ in range(repeat):
+            risk_cache.clear()
+            started = time.perf_counter()
+            results = engine.analyze_all(write_alerts=False)
+            timings.append(time.perf_counter() - started)
+    finally:
+        engine.shutdown()
+    return min(timings), results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the risk sweep across process-pool sizes.')
+    parser.add_argument('--workers', default='1,2,4,8')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    from app import app
+    with app.app_context():
+        baseline = reference = None
+        identical = True
+        for workers in [int(w) for w in args.workers.split(',')]:
+            seconds, results = run(workers, args.repeat)
+            if reference is None:
+                baseline, reference = seconds, comparable(results)
+                same = True
+            else:
+                same = comparable(results) == reference
+                identical &= same
+            print(f"{workers:>2} workers: {len(results):,} patients in {seconds:.3f}s "
+                  f"({len(results) / seconds:,.0f} patients/s, {baseline / seconds:.2f}x)"
+                  f"{'' if same else '  RESULTS DIFFER'}")
+        return identical
+
+
+if __name__ == '__main__':
+    sys.exit(0 if main() else 1)
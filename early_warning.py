@@ -0,0 +1,134 @@
+"""
+NEWS (National Early Warning Score) for vital signs.
+
+One rule table drives three equivalent implementations:
+
+  news_score(vital)        one VitalSign (or a dict of its columns)
+  news_scores(columns)     NumPy arrays, {channel: values}
+  news_score_sql(source)   a SQLAlchemy expression, so the database can
+                           compute and filter by NEWS itself
+
+Each channel's rules are checked in order and the first match gives its
+points; a missing or zero reading scores 0. The score is stored on every
+VitalSign when it is inserted (VitalSign.news_score, indexed), so
+"patients whose latest reading has NEWS >= 5" is one indexed query
+(patients_with_news_at_least) rather than scoring every patient in Python.
+Rows written before the column existed are filled in by backfill_news_scores,
+which migrate_schema.py runs.
+"""
+
+import logging
+
+import numpy as np
+from sqlalchemy import and_, case, or_
+
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# Dashboards escalate at this aggregate score
+NEWS_ALERT_THRESHOLD = 5
+
+# channel -> [(comparison, bound, points)], first match wins
+NEWS_RULES = [
+    ('respiratory_rate', [('<=', 8, 3), ('<=', 11, 1), ('>=', 25, 3), ('>=', 21, 2)]),
+    ('oxygen_saturation', [('<=', 91, 3), ('<=', 93, 2), ('<=', 95, 1)]),
+    ('heart_rate', [('<=', 40, 3), ('<=', 50, 1), ('>=', 131, 3), ('>=', 111, 2), ('>=', 91, 1)]),
+    ('blood_pressure_systolic', [('<=', 90, 3), ('<=', 100, 2), ('>=', 220, 3)]),
+    ('temperature', [('<=', 95, 3), ('>=', 102.2, 2), ('>=', 100.4, 1)]),
+]
+
+
+def _matches(op, value, bound):
+    return value <= bound if op == '<=' else value >= bound
+
+
+def news_score(vital):
+    """NEWS of one reading; `vital` is a VitalSign or a dict of its columns"""
+    get = vital.get if isinstance(vital, dict) else lambda name: getattr(vital, name, None)
+    score = 0
+    for channel, rules in NEWS_RULES:
+        value = get(channel)
+        if not value:
+            continue
+        for op, bound, points in rules:
+            if _matches(op, value, bound):
+                score += points
+                break
+    return score
+
+
+def news_scores(columns):
+    """NEWS of many readings at once; `columns` maps channel -> array-like (None/NaN = missing)"""
+    total = None
+    for channel, rules in NEWS_RULES:
+        values = np.asarray(columns[channel], dtype=np.float64)
+        present = np.nan_to_num(values) != 0
+        conditions = [present & _matches(op, values, bound) for op, bound, _ in rules]
+        points = np.select(conditions, [p for _, _, p in rules], default=0)
+        total = points if total is None else total + points
+    return total.astype(np.int64)
+
+
+def news_score_sql(source=None):
+    """
+    SQL expression computing NEWS from the vital columns of `source`
+    (the VitalSign model by default, or an alias of it).
+    """
+    if source is None:
+        from models import VitalSign
+        source = VitalSign
+
+    total = None
+    for channel, rules in NEWS_RULES:
+        column = getattr(source, channel)
+        whens = [(or_(column.is_(None), column == 0), 0)]
+        whens += [(_matches(op, column, bound), points) for op, bound, points in rules]
+        points = case(*whens, else_=0)
+        total = points if total is None else total + points
+    return total
+
+
+def vital_news_default(context):
+    """Column default for VitalSign.news_score, computed from the row being inserted"""
+    return news_score(context.get_current_parameters())
+
+
+def backfill_news_scores():
+    """Score rows inserted before news_score existed, in one UPDATE. Returns the row count."""
+    from app import db
+    from models import VitalSign
+
+    result = db.session.execute(
+        VitalSign.__table__.update()
+        .where(VitalSign.__table__.c.news_score.is_(None))
+        .values(news_score=news_score_sql(VitalSign.__table__.c))
+    )
+    db.session.commit()
+    return result.rowcount
+
+
+def patients_with_news_at_least(threshold=NEWS_ALERT_THRESHOLD, statuses=('admitted', 'icu', 'emergency')):
+    """
+    Patients whose most recent reading has NEWS >= threshold, highest first.
+    The news_score index finds the high-scoring readings; the
+    (patient_id, recorded_at) index rules out those superseded by a later one.
+    """
+    from app import db
+    from models import Patient, VitalSign
+
+    later = db.aliased(VitalSign)
+    newer_reading = db.session.query(later.id).filter(
+        later.patient_id == VitalSign.patient_id,
+        or_(
+            later.recorded_at > VitalSign.recorded_at,
+            and_(later.recorded_at == VitalSign.recorded_at, later.id > VitalSign.id),
+        ),
+    ).exists()
+
+    query = db.session.query(Patient, VitalSign).join(VitalSign, VitalSign.patient_id == Patient.id).filter(
+        VitalSign.news_score >= threshold,
+        ~newer_reading,
+    )
+    if statuses:
+        query = query.filter(Patient.status.in_(statuses))
+    return query.order_by(VitalSign.news_score.desc(), VitalSign.recorded_at.desc()).all()
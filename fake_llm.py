@@ -0,0 +1,66 @@
+"""
+Local stand-in for the Gemini model, for measuring AI consultation
+throughput offline.
+
+FakeLLM is called with a prompt and returns response text after sleeping
+`latency` seconds plus `per_case_latency` seconds for each patient in the
+prompt, so the cost of a round trip versus the cost of a longer answer can
+be tuned separately. Batched prompts (see build_batch_ai_prompt) get a JSON
+array answer, single prompts a one-line answer in the free-text format
+parse_ai_advice reads.
+
+Set AI_FAKE_MODEL_LATENCY_MS (and optionally AI_FAKE_MODEL_PER_CASE_MS) to
+make the background consultant use it instead of Gemini.
+"""
+
+import json
+import re
+import threading
+import time
+
+CASE_HEADER = re.compile(r"^### Case (\d+)$", re.MULTILINE)
+RISK_SCORE = re.compile(r"^Computed risk score: (\d+)", re.MULTILINE)
+
+
+def level_for(score):
+    if score >= 70:
+        return 'critical'
+    if score >= 50:
+        return 'high'
+    if score >= 30:
+        return 'moderate'
+    if score >= 15:
+        return 'low'
+    return 'stable'
+
+
+class FakeLLM:
+    def __init__(self, latency=1.0, per_case_latency=0.05, malformed=False):
+        self.latency = latency
+        self.per_case_latency = per_case_latency
+        # Answer batched prompts with text that is not a JSON array
+        self.malformed = malformed
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, prompt):
+        scores = [int(s) for s in RISK_SCORE.findall(prompt)]
+        cases = [int(n) for n in CASE_HEADER.findall(prompt)]
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.latency + self.per_case_latency * max(1, len(scores)))
+
+        if not cases:
+            score = min(100, (scores[0] if scores else 0) + 5)
+            return f"Risk level {level_for(score)}, score {score}. Reassess vitals within the hour."
+        if self.malformed:
+            return "Case 1 looks high risk; the others are stable."
+        return json.dumps([
+            {
+                'case': case,
+                'risk_level': level_for(min(100, score + 5)),
+                'risk_score': min(100, score + 5),
+                'note': 'Reassess vitals within the hour.',
+            }
+            for case, score in zip(cases, scores)
+        ])
@@ -0,0 +1,435 @@
+"""
+Per-patient rolling vital-sign features, computed once per reading.
+
+Consumers (risk scoring, the chat assistant, handoffs, dashboards) read a
+patient's features through feature_store instead of each querying and
+summarising raw vitals themselves:
+
+  feature_store.get(patient_id)         one patient's features, or None
+  feature_store.get_many(patient_ids)   {patient_id: features} for dashboards
+  feature_store.risk_stats(patient_id)  the risk model's window stats
+
+Features per channel (the six vitals plus 'news'): the last value, whether
+it is outside the normal range, and for each of the 1h, 6h and 24h windows
+ending at the latest reading: count, mean, min, max, slope (units per
+hour) and seconds spent outside the normal range. Normal ranges are the
+warning thresholds of check_vital_thresholds; NEWS is abnormal from
+NEWS_ALERT_THRESHOLD.
+
+Incremental state: each channel keeps aggregates per BUCKET_MINUTES bucket
+(count, sum, min, max and the sums a least-squares slope needs) for the
+last 24 hours, so ingesting a reading touches one bucket and computing the
+windows merges at most 24h / BUCKET_MINUTES buckets, however often vitals
+arrive. Window edges are aligned to buckets, so FEATURE_BUCKET_MINUTES
+(default 10) trades edge precision for the number of buckets. The time
+between two readings counts as abnormal when the earlier reading was
+abnormal, up to MAX_GAP_MINUTES.
+
+Each bucket is a row of patient_feature_buckets, so an ingest reads and
+rewrites only the current bucket (a few hundred bytes) and, when it opens
+a new one, deletes the buckets that left the 24 hours. The patient's row in
+patient_features is the head of the stream: the last reading of every
+channel and the risk model's estimators (vital_stream), so the features
+and the risk window share one row, one staleness check and one rebuild.
+Both rows are written in the same transaction as the vital (ingest). The
+features JSON served to consumers is materialized from the buckets when
+it is first read after an ingest, not on every reading. A head that is
+missing or behind the latest vital is rebuilt from the last 24 hours (and
+at least RISK_WINDOW) of readings.
+
+Reads are served from an in-process cache, dropped on ingest and bounded
+by FEATURE_CACHE_TTL_SECONDS (default 30) for vitals written by other
+processes.
+"""
+
+import json
+import logging
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from early_warning import NEWS_ALERT_THRESHOLD, news_score
+from predictive_analytics import RISK_WINDOW, VITAL_CHANNELS
+from vital_stream import PatientEstimators, latest_vital_id, latest_vital_ids
+
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+FEATURE_CHANNELS = VITAL_CHANNELS + ['news']
+WINDOWS = {'1h': 3600, '6h': 6 * 3600, '24h': 24 * 3600}
+BUCKET_MINUTES = int(os.environ.get('FEATURE_BUCKET_MINUTES', '10'))
+MAX_GAP_MINUTES = 60
+# Layout of PatientFeatures.state; rows in an older layout are rebuilt
+HEAD_VERSION = 2
+
+# (low, high) of the normal range; None = unbounded on that side
+NORMAL_RANGES = {
+    'heart_rate': (50, 130),
+    'blood_pressure_systolic': (90, 160),
+    'blood_pressure_diastolic': (None, None),
+    'oxygen_saturation': (92, None),
+    'temperature': (96.5, 101.5),
+    'respiratory_rate': (10, 25),
+    'news': (None, NEWS_ALERT_THRESHOLD - 1),
+}
+
+# Per-bucket aggregate layout: times are hours from the bucket start
+N, SUM, MIN, MAX, ST, STT, STY, ABNORMAL = range(8)
+
+
+def is_abnormal(channel, value):
+    low, high = NORMAL_RANGES[channel]
+    return (low is not None and value < low) or (high is not None and value > high)
+
+
+def bucket_start(ts):
+    return int(ts - ts % (BUCKET_MINUTES * 60))
+
+
+def horizon(ts):
+    """Buckets starting before this are outside every window ending at `ts`"""
+    return ts - max(WINDOWS.values()) - BUCKET_MINUTES * 60
+
+
+def aggregates_json(aggregates):
+    return json.dumps({c: [round(x, 4) for x in agg] for c, agg in aggregates.items()}, separators=(',', ':'))
+
+
+def reading_values(vital):
+    """{channel: value} of the channels a VitalSign has a reading for"""
+    values = {c: float(getattr(vital, c)) for c in VITAL_CHANNELS if getattr(vital, c)}
+    news = vital.news_score if vital.news_score is not None else news_score(vital)
+    values['news'] = float(news)
+    return values
+
+
+class PatientFeatureState:
+    """Bucketed aggregates of one patient's last 24 hours of readings"""
+
+    def __init__(self, buckets=None, last=None, last_ts=None):
+        self.buckets = buckets if buckets is not None else []  # [[start_ts, {channel: aggregate}]], oldest first
+        self.last = last or {}  # channel -> last value
+        self.last_ts = last_ts
+
+    def push(self, ts, values):
+        """Fold in one reading taken at epoch seconds `ts` (not earlier than the last one)"""
+        start = bucket_start(ts)
+        if not self.buckets or self.buckets[-1][0] != start:
+            self.buckets.append([start, {}])
+        aggregates = self.buckets[-1][1]
+        t = (ts - start) / 3600.0
+
+        gap = min(ts - self.last_ts, MAX_GAP_MINUTES * 60) if self.last_ts is not None else 0
+        for channel, previous in self.last.items():
+            if gap and is_abnormal(channel, previous):
+                agg = aggregates.setdefault(channel, [0, 0.0, previous, previous, 0.0, 0.0, 0.0, 0.0])
+                agg[ABNORMAL] += gap
+
+        for channel, value in values.items():
+            agg = aggregates.get(channel)
+            if agg is None:
+                agg = aggregates[channel] = [0, 0.0, value, value, 0.0, 0.0, 0.0, 0.0]
+            elif agg[N] == 0:
+                agg[MIN] = agg[MAX] = value
+            agg[N] += 1
+            agg[SUM] += value
+            agg[MIN] = min(agg[MIN], value)
+            agg[MAX] = max(agg[MAX], value)
+            agg[ST] += t
+            agg[STT] += t * t
+            agg[STY] += t * value
+            self.last[channel] = value
+        self.last_ts = ts
+
+        oldest = horizon(ts)
+        while self.buckets and self.buckets[0][0] < oldest:
+            self.buckets.pop(0)
+
+    def window(self, channel, seconds):
+        """Merged stats of `channel` over the buckets overlapping the last `seconds`"""
+        cutoff = self.last_ts - seconds
+        n = 0
+        total = st = stt = sty = abnormal = 0.0
+        low = high = None
+        for start, aggregates in self.buckets:
+            agg = aggregates.get(channel)
+            if agg is None or start + BUCKET_MINUTES * 60 <= cutoff:
+                continue
+            abnormal += agg[ABNORMAL]
+            if agg[N] == 0:
+                continue
+            # Shift the bucket's time sums to hours relative to the latest reading
+            offset = (start - self.last_ts) / 3600.0
+            n += agg[N]
+            total += agg[SUM]
+            st += agg[ST] + agg[N] * offset
+            stt += agg[STT] + 2 * offset * agg[ST] + agg[N] * offset * offset
+            sty += agg[STY] + offset * agg[SUM]
+            low = agg[MIN] if low is None else min(low, agg[MIN])
+            high = agg[MAX] if high is None else max(high, agg[MAX])
+        if n == 0:
+            return {'count': 0, 'mean': None, 'min': None, 'max': None, 'slope': None,
+                    'abnormal_seconds': round(abnormal)}
+        denominator = n * stt - st * st
+        slope = (n * sty - st * total) / denominator if n > 1 and denominator > 1e-12 else 0.0
+        return {
+            'count': n,
+            'mean': round(total / n, 3),
+            'min': low,
+            'max': high,
+            'slope': round(slope, 3),
+            'abnormal_seconds': round(abnormal),
+        }
+
+    def features(self, last_vital_id=None, last_status=None):
+        channels = {}
+        for channel in FEATURE_CHANNELS:
+            last = self.last.get(channel)
+            channels[channel] = {
+                'last': last,
+                'abnormal': is_abnormal(channel, last) if last is not None else None,
+                **{name: self.window(channel, seconds) for name, seconds in WINDOWS.items()},
+            }
+        return {
+            'last_vital_id': last_vital_id,
+            'last_recorded_at': datetime.fromtimestamp(self.last_ts).isoformat() if self.last_ts else None,
+            'last_status': last_status,
+            'channels': channels,
+        }
+
+
+class FeatureStore:
+    def __init__(self, max_entries=None, ttl_seconds=None):
+        self.max_entries = max_entries or int(os.environ.get('FEATURE_CACHE_SIZE', '4096'))
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else int(os.environ.get('FEATURE_CACHE_TTL_SECONDS', '30'))
+        self._entries = OrderedDict()  # patient_id -> (stored_at, features)
+        self._lock = threading.Lock()
+        self.stats = {'ingested': 0, 'rebuilt': 0, 'materialized': 0, 'hits': 0, 'misses': 0}
+
+    def ingest(self, vital):
+        """
+        Fold a new vital into its patient's features and risk estimators.
+        The vital must already be flushed (have an id); the caller commits.
+        """
+        from sqlalchemy import delete
+        from app import db
+        from models import PatientFeatureBucket, PatientFeatures
+
+        recorded_at = vital.recorded_at or datetime.now()
+        row = db.session.get(PatientFeatures, vital.patient_id)
+        head = self._head(row) if row is not None else None
+        if head is None or (row.last_recorded_at and recorded_at < row.last_recorded_at):
+            # Nothing to extend, or a late reading landed inside the windows
+            row = self.rebuild(vital.patient_id)
+        else:
+            ts = recorded_at.timestamp()
+            start = bucket_start(ts)
+            bucket = db.session.get(PatientFeatureBucket, (vital.patient_id, start))
+            current = [[start, json.loads(bucket.aggregates)]] if bucket is not None else []
+            state = PatientFeatureState(current, head['last'], head['ts'])
+            state.push(ts, reading_values(vital))
+            aggregates = aggregates_json(state.buckets[-1][1])
+            if bucket is None:
+                db.session.add(PatientFeatureBucket(patient_id=vital.patient_id, bucket_start=start,
+                                                    aggregates=aggregates))
+                # Only a new bucket can push old ones out of the 24 hours
+                db.session.execute(delete(PatientFeatureBucket).where(
+                    PatientFeatureBucket.patient_id == vital.patient_id,
+                    PatientFeatureBucket.bucket_start < horizon(ts)
+                ))
+            else:
+                bucket.aggregates = aggregates
+            estimators = PatientEstimators.from_dict(head['risk'])
+            estimators.push(vital)
+            self._store_head(row, state, estimators, vital.id, recorded_at, vital.status)
+            self.stats['ingested'] += 1
+        self._drop(vital.patient_id)
+        return row
+
+    def rebuild(self, patient_id):
+        """
+        Replay the last 24 hours (and at least RISK_WINDOW) of vitals into a
+        fresh head row, buckets and features (added to the session, not committed)
+        """
+        from sqlalchemy import delete
+        from app import db
+        from models import PatientFeatureBucket, PatientFeatures, VitalSign
+
+        recent = VitalSign.query.filter_by(patient_id=patient_id).order_by(
+            VitalSign.recorded_at.desc(), VitalSign.id.desc()
+        ).limit(RISK_WINDOW).all()
+        latest = recent[0] if recent else None
+        vitals = []
+        if latest is not None:
+            since = latest.recorded_at - timedelta(seconds=max(WINDOWS.values()))
+            vitals = VitalSign.query.filter(
+                VitalSign.patient_id == patient_id, VitalSign.recorded_at >= since
+            ).order_by(VitalSign.recorded_at, VitalSign.id).all()
+
+        state = PatientFeatureState()
+        for vital in vitals:
+            state.push(vital.recorded_at.timestamp(), reading_values(vital))
+        estimators = PatientEstimators()
+        for vital in vitals[-RISK_WINDOW:] if len(vitals) >= RISK_WINDOW else reversed(recent):
+            estimators.push(vital)
+
+        db.session.execute(delete(PatientFeatureBucket).where(PatientFeatureBucket.patient_id == patient_id))
+        db.session.add_all(PatientFeatureBucket(patient_id=patient_id, bucket_start=start,
+                                                aggregates=aggregates_json(aggregates))
+                           for start, aggregates in state.buckets)
+        row = db.session.get(PatientFeatures, patient_id)
+        if row is None:
+            row = PatientFeatures(patient_id=patient_id)
+            db.session.add(row)
+        vital_id, status = (latest.id, latest.status) if latest else (None, None)
+        self._store_head(row, state, estimators, vital_id, latest.recorded_at if latest else None, status)
+        row.features = json.dumps(state.features(vital_id, status), separators=(',', ':'))
+        row.features_vital_id = vital_id
+        self.stats['rebuilt'] += 1
+        return row
+
+    def _store_head(self, row, state, estimators, vital_id, recorded_at, status):
+        row.state = json.dumps({'v': HEAD_VERSION, 'last': state.last, 'ts': state.last_ts, 'status': status,
+                                'risk': estimators.to_dict()}, separators=(',', ':'))
+        row.last_vital_id = vital_id
+        row.last_recorded_at = recorded_at
+
+    def _head(self, row):
+        """The parsed head state of `row`, or None if it needs a rebuild"""
+        head = json.loads(row.state)
+        return head if head.get('v') == HEAD_VERSION else None
+
+    def _materialize(self, rows):
+        """Recompute `features` of head rows whose buckets changed since they were last read"""
+        from models import PatientFeatureBucket
+
+        buckets = {pid: [] for pid in rows}
+        for bucket in PatientFeatureBucket.query.filter(PatientFeatureBucket.patient_id.in_(list(rows))).order_by(
+            PatientFeatureBucket.patient_id, PatientFeatureBucket.bucket_start
+        ):
+            buckets[bucket.patient_id].append([bucket.bucket_start, json.loads(bucket.aggregates)])
+        for pid, row in rows.items():
+            head = self._head(row)
+            state = PatientFeatureState(buckets[pid], head['last'], head['ts'])
+            row.features = json.dumps(state.features(row.last_vital_id, head['status']), separators=(',', ':'))
+            row.features_vital_id = row.last_vital_id
+        self.stats['materialized'] += len(rows)
+
+    def get(self, patient_id):
+        """Features of one patient, or None if they have no vitals"""
+        return self.get_many([patient_id]).get(patient_id)
+
+    def get_many(self, patient_ids):
+        """{patient_id: features} for patients with vitals; one query for the uncached ones"""
+        from app import db
+        from models import PatientFeatures
+
+        found, missing = {}, []
+        now = time.monotonic()
+        with self._lock:
+            for pid in patient_ids:
+                entry = self._entries.get(pid)
+                if entry is not None and (not self.ttl_seconds or now - entry[0] < self.ttl_seconds):
+                    self._entries.move_to_end(pid)
+                    found[pid] = entry[1]
+                    self.stats['hits'] += 1
+                else:
+                    missing.append(pid)
+                    self.stats['misses'] += 1
+        if not missing:
+            return found
+
+        rows = {row.patient_id: row for row in PatientFeatures.query.filter(PatientFeatures.patient_id.in_(missing))}
+        # Latest by recorded_at, as rebuild() records it; ids need not follow time
+        latest = latest_vital_ids(missing)
+        stale = [pid for pid in missing if pid in latest and (
+            pid not in rows or rows[pid].last_vital_id != latest[pid] or self._head(rows[pid]) is None)]
+        for pid in stale:
+            rows[pid] = self.rebuild(pid)
+        unread = {pid: rows[pid] for pid in missing
+                  if pid in latest and rows[pid].features_vital_id != rows[pid].last_vital_id}
+        if unread:
+            self._materialize(unread)
+        if stale or unread:
+            try:
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Could not persist rebuilt features: {e}")
+
+        with self._lock:
+            for pid in missing:
+                if pid not in latest:
+                    continue
+                features = json.loads(rows[pid].features)
+                found[pid] = features
+                self._entries[pid] = (now, features)
+                self._entries.move_to_end(pid)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return found
+
+    def risk_stats(self, patient_id):
+        """
+        (per-channel stats, readings in the window, latest vital id) for the
+        risk model. Rebuilds the head row if it is behind.
+        """
+        from app import db
+        from models import PatientFeatures
+
+        latest = latest_vital_id(patient_id)
+        if latest is None:
+            return {}, 0, None
+
+        row = db.session.get(PatientFeatures, patient_id)
+        head = self._head(row) if row is not None and row.last_vital_id == latest else None
+        if head is None:
+            head = self._head(self.rebuild(patient_id))
+            try:
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Could not persist rebuilt features for patient {patient_id}: {e}")
+        estimators = PatientEstimators.from_dict(head['risk'])
+        return estimators.stats(), estimators.rows, latest
+
+    def _drop(self, patient_id):
+        with self._lock:
+            self._entries.pop(patient_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def report(self):
+        with self._lock:
+            entries = len(self._entries)
+        return {**self.stats, 'entries': entries, 'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl_seconds, 'bucket_minutes': BUCKET_MINUTES}
+
+
+def format_vitals_summary(features):
+    """One line of the latest vitals with 6h trend arrows, for prompts and handoffs"""
+    if not features:
+        return "No vitals recorded."
+    channels = features['channels']
+    labels = [('heart_rate', 'HR', ''), ('blood_pressure_systolic', 'BP', ''), ('oxygen_saturation', 'SpO2', '%'),
+              ('temperature', 'Temp', 'F'), ('respiratory_rate', 'RR', ''), ('news', 'NEWS', '')]
+    parts = []
+    for channel, label, unit in labels:
+        feature = channels[channel]
+        if feature['last'] is None:
+            continue
+        value = f"{feature['last']:g}"
+        if channel == 'blood_pressure_systolic' and channels['blood_pressure_diastolic']['last'] is not None:
+            value += f"/{channels['blood_pressure_diastolic']['last']:g}"
+        slope = feature['6h']['slope']
+        arrow = '' if not slope or math.isclose(slope, 0, abs_tol=0.05) else (' ↑' if slope > 0 else ' ↓')
+        parts.append(f"{label} {value}{unit}{arrow}{' (abnormal)' if feature['abnormal'] else ''}")
+    return ', '.join(parts) + '.'
+
+
+feature_store = FeatureStore()
@@ -0,0 +1,183 @@
+"""
+Block-allocated id sequences backed by the id_sequences table.
+
+New patient ids used to be derived by reading the highest existing
+patient_id and adding one, which scans the patients table and lets two
+concurrent bookings pick the same id. A BlockSequence instead reserves
+ids in blocks of PATIENT_ID_BLOCK (default 20):
+
+  UPDATE id_sequences SET next_value = next_value + block WHERE name = ...
+
+runs in its own short transaction, separate from the request's session.
+The row lock taken by that UPDATE serializes concurrent reservations, and
+each block is committed before any of its ids is handed out, so no two
+workers ever share a block.
+
+SQLite allows a single writer, and a separate connection would wait on the
+lock the request's transaction holds once it has flushed a write. There the
+UPDATE runs in a savepoint of the request's own transaction instead. Until
+that transaction commits, the block serves only its session, and a
+rollback discards it, so its ids can never outlive the reservation.
+
+Ids are handed out from the block in memory under a lock and are never
+reused; take(n) hands out n at once, e.g. before a bulk insert. A request
+that rolls back, or a worker that exits with ids left in its block, leaves
+gaps in the numbering, never duplicates. A worker forked with a reserved
+block discards it and reserves its own.
+
+The first reservation seeds the row with one more than the highest
+existing PAT<number> id, so the sequence continues the current
+numbering.
+"""
+
+import logging
+import os
+import re
+import threading
+from contextlib import contextmanager
+
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+PATIENT_ID_PATTERN = re.compile(r'^PAT(\d+)$')
+
+
+def highest_patient_number():
+    from database import db
+    from models import Patient
+
+    highest = 0
+    for (patient_id,) in db.session.query(Patient.patient_id).filter(Patient.patient_id.like('PAT%')):
+        match = PATIENT_ID_PATTERN.match(patient_id or '')
+        if match:
+            highest = max(highest, int(match.group(1)))
+    return highest
+
+
+class BlockSequence:
+    def __init__(self, name, block_size, seed=lambda: 0):
+        self.name = name
+        self.block_size = block_size
+        self.seed = seed  # highest value already in use, read when the row is created
+        self._next = None
+        self._end = None  # first value past the reserved block
+        self._pid = None
+        self._provisional = None  # session whose uncommitted transaction holds the block
+        self._watching = False
+        self._lock = threading.RLock()
+        self.stats = {'issued': 0, 'blocks_reserved': 0}
+
+    def next(self):
+        return self.take(1)[0]
+
+    def take(self, n):
+        """n unused values, reserving at most one more block (of at least n) for them"""
+        from database import db
+
+        with self._lock:
+            if self._pid != os.getpid() or (self._provisional is not None and self._provisional is not db.session()):
+                # Forked, or the block is not committed yet and belongs to another session
+                self._next = self._end = None
+                self._provisional = None
+                self._pid = os.getpid()
+            values = []
+            if self._next is not None:
+                count = min(n, self._end - self._next)
+                values = list(range(self._next, self._next + count))
+                self._next += count
+            if len(values) < n:
+                needed = n - len(values)
+                first, end = self._reserve(max(needed, self.block_size))
+                values.extend(range(first, first + needed))
+                self._next, self._end = first + needed, end
+            self.stats['issued'] += n
+            return values
+
+    def _reserve(self, size):
+        """Reserve `size` values for this process; returns (first, end)"""
+        from database import db
+
+        if db.engine.dialect.name == 'sqlite' and db.session.in_transaction():
+            # SQLite has a single writer: a separate connection would wait on
+            # the write lock this session holds once it has flushed anything.
+            # Reserve inside the session's transaction instead; the block
+            # commits with it and is dropped if it rolls back.
+            self._watch_session()
+            self._provisional = db.session()
+
+            @contextmanager
+            def savepoint():
+                with db.session.begin_nested():
+                    yield db.session
+
+            return self._claim(savepoint, size)
+        self._provisional = None
+        return self._claim(db.engine.begin, size)
+
+    def _claim(self, transaction, size):
+        """Advance the row by `size` (creating it on first use) in `transaction()`"""
+        from sqlalchemy import insert, select, update
+        from sqlalchemy.exc import IntegrityError
+        from models import IdSequence
+
+        table = IdSequence.__table__
+        for _ in range(2):
+            with transaction() as conn:
+                updated = conn.execute(
+                    update(table).where(table.c.name == self.name)
+                    .values(next_value=table.c.next_value + size)
+                ).rowcount
+                if updated:
+                    end = conn.execute(select(table.c.next_value).where(table.c.name == self.name)).scalar_one()
+                    self.stats['blocks_reserved'] += 1
+                    return end - size, end
+            first = self.seed() + 1
+            try:
+                with transaction() as conn:
+                    conn.execute(insert(table).values(name=self.name, next_value=first + size))
+                self.stats['blocks_reserved'] += 1
+                logger.info(f"Started id sequence {self.name} at {first}")
+                return first, first + size
+            except IntegrityError:
+                # Another worker created the row first; reserve from it
+                continue
+        raise RuntimeError(f"Could not reserve a block from id sequence {self.name}")
+
+    def _watch_session(self):
+        from sqlalchemy import event
+        from database import db
+
+        if self._watching:
+            return
+        event.listen(db.session, 'after_commit', self._on_commit)
+        event.listen(db.session, 'after_rollback', self._on_rollback)
+        self._watching = True
+
+    def _on_commit(self, session):
+        with self._lock:
+            if session is self._provisional:
+                self._provisional = None
+
+    def _on_rollback(self, session):
+        with self._lock:
+            if session is self._provisional:
+                # The reservation was rolled back with it; another worker may get these values
+                self._provisional = None
+                self._next = self._end = None
+
+    def report(self):
+        with self._lock:
+            remaining = self._end - self._next if self._next is not None and self._pid == os.getpid() else 0
+        return {**self.stats, 'name': self.name, 'block_size': self.block_size, 'remaining_in_block': remaining}
+
+
+patient_id_sequence = BlockSequence('patient_id', int(os.environ.get('PATIENT_ID_BLOCK', '20')),
+                                    seed=highest_patient_number)
+
+
+def next_patient_id():
+    return f"PAT{patient_id_sequence.next():06d}"
+
+
+def next_patient_ids(n):
+    return [f"PAT{value:06d}" for value in patient_id_sequence.take(n)]
@@ -0,0 +1,67 @@
+"""Bring an existing database up to date with models.py.
+
+db.create_all() only creates missing tables; it never adds columns to tables
+that already exist. This script creates missing tables and then adds any
+model columns the live schema lacks, so older dev databases keep working
+after new fields are introduced.
+
+Usage:
+  python migrate_schema.py
+"""
+from sqlalchemy import inspect, text
+from app import app, db
+import models  # noqa: F401 - registers all tables on db.metadata
+from early_warning import backfill_news_scores
+from patient_matching import backfill_contact_index
+
+
+def add_missing_columns():
+    inspector = inspect(db.engine)
+    added = []
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {col['name'] for col in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            col_type = column.type.compile(dialect=db.engine.dialect)
+            with db.engine.begin() as conn:
+                conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {col_type}'))
+            added.append(f"{table.name}.{column.name}")
+    return added
+
+
+def create_missing_indexes():
+    inspector = inspect(db.engine)
+    created = []
+    for table in db.metadata.sorted_tables:
+        existing = {ix['name'] for ix in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(db.engine)
+                created.append(index.name)
+    return created
+
+
+def migrate():
+    with app.app_context():
+        db.create_all()
+        added = add_missing_columns()
+        indexes = create_missing_indexes()
+        scored = backfill_news_scores()
+        indexed = backfill_contact_index()
+        for name in added:
+            print(f"Added column {name}")
+        for name in indexes:
+            print(f"Created index {name}")
+        if scored:
+            print(f"Computed NEWS for {scored} vital signs")
+        if indexed:
+            print(f"Indexed contact details of {indexed} patients")
+        if not added and not indexes and not scored and not indexed:
+            print("Schema is up to date.")
+
+
+if __name__ == "__main__":
+    migrate()
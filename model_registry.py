@@ -0,0 +1,215 @@
+"""
+Versioned ML models for the risk predictor.
+
+The rule model in RiskPredictor stays the source of the risk score. On top
+of it a StandardScaler + classifier estimates the probability that a
+patient deteriorates (has a critical reading soon), and an IsolationForest
+flags vital patterns unlike anything in the training history. Both work on
+the per-channel window stats the rule model already computes (mean, std and
+trend of each vital), so the whole census is scored with one predict_proba
+call on the batch engine's stat matrices.
+
+Artifacts live under RISK_MODEL_DIR (default ./model_artifacts), one
+directory per version, with a CURRENT file naming the active version:
+
+    model_artifacts/
+        CURRENT
+        20260101-120000/
+            scaler.joblib  anomaly.joblib  classifier.joblib  meta.json
+
+Nothing is loaded at import or startup. The active version is loaded on
+the first prediction, with numpy arrays memory-mapped, and reloaded when
+CURRENT changes.
+
+Models are trained offline with train_models.py.
+
+Usage:
+  python model_registry.py versions            # list saved versions
+  python model_registry.py activate <version>  # roll forward or back
+"""
+
+import json
+import logging
+import os
+import sys
+import threading
+from datetime import datetime
+
+import numpy as np
+
+from predictive_analytics import VITAL_CHANNELS
+
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+MODEL_DIR = os.environ.get('RISK_MODEL_DIR') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'model_artifacts')
+
+FEATURE_STATS = ('avg', 'std', 'trend')
+FEATURE_NAMES = [f'{channel}_{stat}' for channel in VITAL_CHANNELS for stat in FEATURE_STATS]
+
+# Used for a channel with no readings in the window
+DEFAULT_VITALS = {
+    'heart_rate': 75,
+    'blood_pressure_systolic': 120,
+    'blood_pressure_diastolic': 80,
+    'oxygen_saturation': 98,
+    'temperature': 98.6,
+    'respiratory_rate': 16,
+}
+
+def feature_row(stats):
+    """Feature vector from one patient's per-channel stats dicts"""
+    row = []
+    for channel in VITAL_CHANNELS:
+        channel_stats = stats.get(channel)
+        if channel_stats:
+            row.extend([channel_stats['avg'], channel_stats['std'], channel_stats['trend']])
+        else:
+            row.extend([DEFAULT_VITALS[channel], 0.0, 0.0])
+    return row
+
+
+def feature_matrix(channel_stats):
+    """
+    Feature matrix from the batch engine's stats,
+    {channel: (count, mean, std, trend) arrays}.
+    """
+    columns = []
+    for channel in VITAL_CHANNELS:
+        count, mean, std, trend = channel_stats[channel]
+        present = count > 0
+        columns.append(np.where(present, mean, DEFAULT_VITALS[channel]))
+        columns.append(np.where(present, std, 0.0))
+        columns.append(np.where(present, trend, 0.0))
+    return np.column_stack(columns).astype(np.float64)
+
+
+class ModelRegistry:
+    ARTIFACTS = ('scaler', 'anomaly', 'classifier')
+
+    def __init__(self, root=MODEL_DIR):
+        self.root = root
+        self._lock = threading.Lock()
+        self._loaded = None  # (version, {name: estimator}, meta)
+        self._current = (None, None)  # (CURRENT mtime, version)
+
+    def _current_path(self):
+        return os.path.join(self.root, 'CURRENT')
+
+    def active_version(self):
+        """Version named by CURRENT, re-read only when the file changes"""
+        try:
+            mtime = os.stat(self._current_path()).st_mtime_ns
+        except OSError:
+            return None
+        if self._current[0] != mtime:
+            with open(self._current_path()) as f:
+                self._current = (mtime, f.read().strip() or None)
+        return self._current[1]
+
+    def versions(self):
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(
+            name for name in os.listdir(self.root)
+            if os.path.isfile(os.path.join(self.root, name, 'meta.json'))
+        )
+
+    def save(self, scaler, anomaly, classifier, meta, activate=True):
+        import joblib
+
+        version = datetime.now().strftime('%Y%m%d-%H%M%S')
+        path = os.path.join(self.root, version)
+        os.makedirs(path, exist_ok=True)
+        for name, estimator in zip(self.ARTIFACTS, (scaler, anomaly, classifier)):
+            # Uncompressed so numpy arrays can be memory-mapped on load
+            joblib.dump(estimator, os.path.join(path, f'{name}.joblib'))
+        meta = dict(meta, version=version, features=FEATURE_NAMES, saved_at=datetime.now().isoformat())
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump(meta, f, indent=2)
+        if activate:
+            self.activate(version)
+        logger.info(f"Saved risk models version {version}")
+        return version
+
+    def activate(self, version):
+        os.makedirs(self.root, exist_ok=True)
+        tmp = self._current_path() + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(version)
+        os.replace(tmp, self._current_path())
+
+    def _ensure_loaded(self):
+        version = self.active_version()
+        if version is None:
+            return None
+        loaded = self._loaded
+        if loaded is not None and loaded[0] == version:
+            return loaded
+        with self._lock:
+            if self._loaded is None or self._loaded[0] != version:
+                import joblib
+
+                path = os.path.join(self.root, version)
+                estimators = {
+                    name: joblib.load(os.path.join(path, f'{name}.joblib'), mmap_mode='r')
+                    for name in self.ARTIFACTS
+                }
+                with open(os.path.join(path, 'meta.json')) as f:
+                    meta = json.load(f)
+                self._loaded = (version, estimators, meta)
+                logger.info(f"Loaded risk models version {version}")
+            return self._loaded
+
+    def predict(self, X):
+        """
+        Score a (patients x features) matrix in one pass. Returns a dict of
+        arrays (probability, anomaly, anomaly_score) and the model version,
+        or None when no model has been trained.
+        """
+        try:
+            loaded = self._ensure_loaded()
+        except Exception as e:
+            logger.error(f"Could not load risk models: {e}")
+            return None
+        if loaded is None or len(X) == 0:
+            return None
+        version, estimators, _ = loaded
+        scaled = estimators['scaler'].transform(np.asarray(X, dtype=np.float64))
+        classifier = estimators['classifier']
+        proba = classifier.predict_proba(scaled)
+        classes = list(classifier.classes_)
+        probability = proba[:, classes.index(1)] if 1 in classes else np.zeros(len(scaled))
+        anomaly_score = estimators['anomaly'].decision_function(scaled)
+        return {
+            'version': version,
+            'probability': probability,
+            'anomaly': anomaly_score < 0,
+            'anomaly_score': anomaly_score,
+        }
+
+    def ml_result(self, predictions, row):
+        """The 'ml' entry of a risk analysis for one row of predict() output"""
+        return {
+            'deterioration_probability': round(float(predictions['probability'][row]), 4),
+            'anomaly': bool(predictions['anomaly'][row]),
+            'anomaly_score': round(float(predictions['anomaly_score'][row]), 4),
+            'model_version': predictions['version'],
+        }
+
+
+model_registry = ModelRegistry()
+
+
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else 'versions'
+    if command == 'versions':
+        active = model_registry.active_version()
+        for name in model_registry.versions():
+            print(f"{'*' if name == active else ' '} {name}")
+    elif command == 'activate' and len(sys.argv) == 3 and sys.argv[2] in model_registry.versions():
+        model_registry.activate(sys.argv[2])
+        print(f"Activated risk models version {sys.argv[2]}")
+    else:
+        print(__doc__)
+        sys.exit(1)
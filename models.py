@@ -1,8 +1,11 @@
 from datetime import datetime
 from database import db
+from early_warning import vital_news_default
+from patient_matching import blocking_key, normalize_email, normalize_phone
 from flask_dance.consumer.storage.sqla import OAuthConsumerMixin
 from flask_login import UserMixin
 from sqlalchemy import UniqueConstraint
+from sqlalchemy.orm import validates
 from werkzeug.security import generate_password_hash, check_password_hash
 
 
@@ -83,6 +86,10 @@ class Patient(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.now)
     updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
     department = db.Column(db.String(100), nullable=True)
+    # Derived contact index for matching bookings to patients (see patient_matching.py)
+    email_normalized = db.Column(db.String(120), nullable=True, index=True)
+    phone_normalized = db.Column(db.String(20), nullable=True, index=True)
+    match_key = db.Column(db.String(40), nullable=True, index=True)
 
     assigned_doctor = db.relationship('StaffMember', foreign_keys=[assigned_doctor_id], backref='patients_as_doctor')
     assigned_nurse = db.relationship('StaffMember', foreign_keys=[assigned_nurse_id], backref='patients_as_nurse')
@@ -101,6 +108,23 @@ class Patient(db.Model):
     def latest_vitals(self):
         return self.vitals.first()
 
+    @validates('email')
+    def _index_email(self, key, value):
+        self.email_normalized = normalize_email(value)
+        return value
+
+    @validates('phone')
+    def _index_phone(self, key, value):
+        self.phone_normalized = normalize_phone(value)
+        return value
+
+    @validates('last_name', 'date_of_birth')
+    def _index_match_key(self, key, value):
+        last_name = value if key == 'last_name' else self.last_name
+        date_of_birth = value if key == 'date_of_birth' else self.date_of_birth
+        self.match_key = blocking_key(last_name, date_of_birth)
+        return value
+
 
 class Round(db.Model):
     __tablename__ = 'rounds'
@@ -128,11 +152,52 @@ class VitalSign(db.Model):
     temperature = db.Column(db.Float, nullable=True)  # °F
     respiratory_rate = db.Column(db.Integer, nullable=True)  # breaths/min
     status = db.Column(db.String(20), default='normal')  # normal, warning, critical
+    news_score = db.Column(db.Integer, default=vital_news_default, index=True)  # see early_warning.py
     recorded_at = db.Column(db.DateTime, default=datetime.now)
     recorded_by_id = db.Column(db.Integer, db.ForeignKey('staff_members.id'), nullable=True)
 
     recorded_by = db.relationship('StaffMember', backref='recorded_vitals')
 
+    __table_args__ = (
+        db.Index('ix_vital_signs_patient_recorded', 'patient_id', 'recorded_at'),
+    )
+
+
+class PatientFeatures(db.Model):
+    """Per-patient head of the feature store: last readings and risk estimators (see feature_store.py)"""
+    __tablename__ = 'patient_features'
+    patient_id = db.Column(db.Integer, db.ForeignKey('patients.id'), primary_key=True)
+    last_vital_id = db.Column(db.Integer, nullable=True)
+    last_recorded_at = db.Column(db.DateTime, nullable=True)
+    state = db.Column(db.Text, nullable=False)  # compact JSON, see FeatureStore._store_head
+    features = db.Column(db.Text, nullable=False)  # JSON served to consumers, materialized on read
+    features_vital_id = db.Column(db.Integer, nullable=True)  # last_vital_id that `features` reflect
+    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+
+
+class PatientFeatureBucket(db.Model):
+    """One patient's per-channel aggregates for one feature-store time bucket"""
+    __tablename__ = 'patient_feature_buckets'
+    patient_id = db.Column(db.Integer, db.ForeignKey('patients.id'), primary_key=True)
+    bucket_start = db.Column(db.BigInteger, primary_key=True, autoincrement=False)  # epoch seconds
+    aggregates = db.Column(db.Text, nullable=False)  # compact JSON {channel: aggregate}
+
+
+class WardVitalSketch(db.Model):
+    """t-digest of one vital channel's readings in a ward during one hour (see ward_stats.py)"""
+    __tablename__ = 'ward_vital_sketches'
+    __table_args__ = (
+        UniqueConstraint('ward', 'channel', 'bucket_start', name='uq_ward_vital_sketch'),
+        db.Index('ix_ward_vital_sketches_channel_bucket', 'channel', 'bucket_start'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    ward = db.Column(db.String(100), nullable=False)
+    channel = db.Column(db.String(50), nullable=False)
+    bucket_start = db.Column(db.DateTime, nullable=False)
+    count = db.Column(db.Integer, default=0)
+    digest = db.Column(db.Text, nullable=False)  # compact JSON, see TDigest.to_json
+    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+
 
 class Alert(db.Model):
     __tablename__ = 'alerts'
@@ -147,11 +212,33 @@ class Alert(db.Model):
     acknowledged_by_id = db.Column(db.Integer, db.ForeignKey('staff_members.id'), nullable=True)
     acknowledged_at = db.Column(db.DateTime, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.now)
+    occurrence_count = db.Column(db.Integer, default=1)  # repeat breaches folded into this alert
+    last_seen_at = db.Column(db.DateTime, default=datetime.now)
+    escalation_tier = db.Column(db.Integer, default=0)  # highest tier routed so far, claimed in alert_escalation.py
 
     patient = db.relationship('Patient', backref='alerts')
     vital_sign = db.relationship('VitalSign', backref='alerts')
     acknowledged_by = db.relationship('StaffMember', backref='acknowledged_alerts')
 
+    __table_args__ = (
+        db.Index('ix_alerts_open', 'is_acknowledged', 'created_at'),
+        db.Index('ix_alerts_patient', 'patient_id'),
+    )
+
+
+class AlertRecipient(db.Model):
+    __tablename__ = 'alert_recipients'
+    id = db.Column(db.Integer, primary_key=True)
+    alert_id = db.Column(db.Integer, db.ForeignKey('alerts.id'), nullable=False, index=True)
+    staff_id = db.Column(db.Integer, db.ForeignKey('staff_members.id'), nullable=False, index=True)
+    tier = db.Column(db.Integer, default=0)  # 0 = initial routing, 1+ = escalation tier
+    routed_at = db.Column(db.DateTime, default=datetime.now)
+
+    alert = db.relationship('Alert', backref='recipients')
+    staff = db.relationship('StaffMember', backref='routed_alerts')
+
+    __table_args__ = (UniqueConstraint('alert_id', 'staff_id', name='uq_alert_recipient'),)
+
 
 class Medication(db.Model):
     __tablename__ = 'medications'
@@ -225,6 +312,9 @@ class MedicationAdministration(db.Model):
 
 class Shift(db.Model):
     __tablename__ = 'shifts'
+    __table_args__ = (
+        db.Index('ix_shifts_staff_start', 'staff_id', 'start_time'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     staff_id = db.Column(db.Integer, db.ForeignKey('staff_members.id'), nullable=False)
     shift_type = db.Column(db.String(20), nullable=False)  # morning, afternoon, night
@@ -278,6 +368,9 @@ class DoctorNote(db.Model):
 
 class RiskAssessment(db.Model):
     __tablename__ = 'risk_assessments'
+    __table_args__ = (
+        db.Index('ix_risk_assessments_patient_assessed', 'patient_id', 'assessed_at'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     patient_id = db.Column(db.Integer, db.ForeignKey('patients.id'), nullable=False)
     risk_level = db.Column(db.String(20), nullable=False)
@@ -285,10 +378,24 @@ class RiskAssessment(db.Model):
     risk_factors = db.Column(db.Text, nullable=True)
     predictions = db.Column(db.Text, nullable=True)
     assessed_at = db.Column(db.DateTime, default=datetime.now)
+    # Unchanged re-assessments confirm this row instead of adding one (see risk_history.py)
+    last_confirmed_at = db.Column(db.DateTime, nullable=True)
+    view_count = db.Column(db.Integer, default=1)
     
     patient = db.relationship('Patient', backref='risk_assessments')
 
 
+class PatientRiskSnapshot(db.Model):
+    """Latest scheduled risk sweep result per patient (see risk_scheduler.py)"""
+    __tablename__ = 'patient_risk_snapshots'
+    patient_id = db.Column(db.Integer, db.ForeignKey('patients.id'), primary_key=True)
+    risk_level = db.Column(db.String(20), nullable=False, index=True)
+    risk_score = db.Column(db.Integer, nullable=False)
+    result = db.Column(db.Text, nullable=False)  # full analysis as JSON
+    model_version = db.Column(db.String(100), nullable=True)
+    analyzed_at = db.Column(db.DateTime, nullable=False)
+
+
 class ChatMessage(db.Model):
     __tablename__ = 'chat_messages'
     id = db.Column(db.Integer, primary_key=True)
@@ -318,6 +425,10 @@ class Ward(db.Model):
 
 class AppointmentRequest(db.Model):
     __tablename__ = 'appointment_requests'
+    __table_args__ = (
+        db.Index('ix_appointment_requests_doctor_date', 'doctor_id', 'preferred_date'),
+        db.Index('ix_appointment_requests_status_date', 'status', 'preferred_date'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     patient_id = db.Column(db.Integer, db.ForeignKey('patients.id'), nullable=False)
     requested_at = db.Column(db.DateTime, default=datetime.now)
@@ -338,6 +449,20 @@ class AppointmentRequest(db.Model):
     doctor = db.relationship('StaffMember', backref='received_appointments')
 
 
+class DoctorSlotCalendar(db.Model):
+    """One doctor's day as bitmaps of appointment slots (see slot_calendar.py)"""
+    __tablename__ = 'doctor_slot_calendar'
+    __table_args__ = (
+        UniqueConstraint('day', 'doctor_id', name='uq_doctor_slot_calendar'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    doctor_id = db.Column(db.Integer, db.ForeignKey('staff_members.id'), nullable=False)
+    day = db.Column(db.Date, nullable=False)
+    open_mask = db.Column(db.BigInteger, default=0)  # bit i set = slot i within a shift
+    booked_mask = db.Column(db.BigInteger, default=0)  # bit i set = slot i taken by a confirmed appointment
+    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+
+
 class AuditLog(db.Model):
     __tablename__ = 'audit_logs'
     id = db.Column(db.Integer, primary_key=True)
@@ -370,3 +495,19 @@ class Notification(db.Model):
     recipient = db.relationship('StaffMember', backref='notifications')
     patient = db.relationship('Patient', backref='notifications')
 
+
+class SchedulerLease(db.Model):
+    """Which process runs a cluster-wide background job, until when (see risk_scheduler.py)"""
+    __tablename__ = 'scheduler_leases'
+    name = db.Column(db.String(100), primary_key=True)
+    holder = db.Column(db.String(200), nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+    acquired_at = db.Column(db.DateTime, default=datetime.now)
+
+
+class IdSequence(db.Model):
+    """Next unreserved value of a named id sequence (see id_sequence.py)"""
+    __tablename__ = 'id_sequences'
+    name = db.Column(db.String(100), primary_key=True)
+    next_value = db.Column(db.BigInteger, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
@@ -0,0 +1,246 @@
+"""
+Matching public bookings to existing patients through a normalized contact index.
+
+Bookings used to look patients up by the raw email and phone strings, so
+"Jane@Example.com " or "+91 97004 43157" missed the patient stored as
+"jane@example.com" / "9700443157" and a duplicate record was created, and
+neither column was indexed. Patient now keeps three derived, indexed
+columns, set whenever the source fields are assigned:
+
+  email_normalized  trimmed, lowercased email
+  phone_normalized  E.164-style: '+', country code, national number; numbers
+                    without a country code get PHONE_DEFAULT_COUNTRY_CODE
+                    (default 91) when they have NATIONAL_NUMBER_DIGITS (10)
+                    digits after dropping a trunk '0', and are otherwise
+                    kept as bare digits
+  match_key         blocking key: date of birth plus the Soundex code of the
+                    last name
+
+find_patient tries an exact indexed lookup on email, then phone. Failing
+that, and only if the booking gave a date of birth, it compares names
+within the booking's match_key block and accepts the closest whose full
+name is at least NAME_MATCH_THRESHOLD similar, unless that patient has a
+different email or phone than the booking gave: same-birthday relatives
+must not be merged, and a near miss becomes a new record that the
+duplicate report lists instead. Unauthenticated endpoints pass
+require_contact=True, which accepts a name and date of birth match only
+when the booking's email or phone equals the patient's: a name and a
+birthday alone must not attach an anonymous caller to someone's record.
+
+Rows written before these columns existed are filled, and the report of
+likely duplicates among existing records printed, with:
+
+  python patient_matching.py
+"""
+
+import difflib
+import json
+import logging
+import os
+import re
+import unicodedata
+
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+DEFAULT_COUNTRY_CODE = os.environ.get('PHONE_DEFAULT_COUNTRY_CODE', '91')
+NATIONAL_NUMBER_DIGITS = 10
+NAME_MATCH_THRESHOLD = 0.85
+
+SOUNDEX_CODES = {c: str(d) for d, letters in enumerate(
+    ['aeiouyhw', 'bfpv', 'cgjkqsxz', 'dt', 'l', 'mn', 'r']) for c in letters}
+
+
+def normalize_email(email):
+    email = (email or '').strip().lower()
+    return email or None
+
+
+def normalize_phone(phone):
+    raw = (phone or '').strip()
+    digits = re.sub(r'\D', '', raw)
+    if not digits:
+        return None
+    if raw.startswith('+'):
+        return '+' + digits
+    if digits.startswith('00'):
+        return '+' + digits[2:]
+    if len(digits) == NATIONAL_NUMBER_DIGITS + 1 and digits.startswith('0'):
+        digits = digits[1:]
+    if len(digits) == NATIONAL_NUMBER_DIGITS:
+        return f'+{DEFAULT_COUNTRY_CODE}{digits}'
+    if len(digits) == NATIONAL_NUMBER_DIGITS + len(DEFAULT_COUNTRY_CODE) and digits.startswith(DEFAULT_COUNTRY_CODE):
+        return '+' + digits
+    return digits
+
+
+def normalize_name(name):
+    """Lowercase ASCII letters and single spaces; accents dropped"""
+    ascii_name = unicodedata.normalize('NFKD', name or '').encode('ascii', 'ignore').decode()
+    return ' '.join(re.sub(r'[^a-z ]', ' ', ascii_name.lower()).split())
+
+
+def soundex(name):
+    letters = normalize_name(name).replace(' ', '')
+    if not letters:
+        return ''
+    code, previous = letters[0].upper(), SOUNDEX_CODES.get(letters[0])
+    for c in letters[1:]:
+        digit = SOUNDEX_CODES.get(c)
+        if digit != '0' and digit != previous:
+            code += digit
+        if c not in 'hw':
+            previous = digit
+    return (code + '000')[:4]
+
+
+def blocking_key(last_name, date_of_birth):
+    if not date_of_birth or not normalize_name(last_name):
+        return None
+    return f"{date_of_birth.isoformat()}|{soundex(last_name)}"
+
+
+def name_similarity(first_a, last_a, first_b, last_b):
+    return difflib.SequenceMatcher(None, normalize_name(f"{first_a} {last_a}"),
+                                   normalize_name(f"{first_b} {last_b}")).ratio()
+
+
+def contact_conflicts(patient, email, phone):
+    """True if the patient has an email or phone and it differs from the one given"""
+    return any(given and stored and given != stored for given, stored in (
+        (email, patient.email_normalized), (phone, patient.phone_normalized)))
+
+
+def contact_matches(patient, email, phone):
+    """True if the email or phone given equals the one stored for the patient"""
+    return any(given and given == stored for given, stored in (
+        (email, patient.email_normalized), (phone, patient.phone_normalized)))
+
+
+def find_patient(email=None, phone=None, first_name=None, last_name=None, date_of_birth=None,
+                 require_contact=False):
+    """(patient, 'email' | 'phone' | 'name_dob') for the best existing match, or (None, None)"""
+    from models import Patient
+
+    email, phone = normalize_email(email), normalize_phone(phone)
+    if email:
+        patient = Patient.query.filter_by(email_normalized=email).order_by(Patient.id).first()
+        if patient:
+            return patient, 'email'
+    if phone:
+        patient = Patient.query.filter_by(phone_normalized=phone).order_by(Patient.id).first()
+        if patient:
+            return patient, 'phone'
+
+    key = blocking_key(last_name, date_of_birth)
+    if not key or not first_name:
+        return None, None
+    best, best_score = None, NAME_MATCH_THRESHOLD
+    for candidate in Patient.query.filter_by(match_key=key).order_by(Patient.id):
+        score = name_similarity(first_name, last_name, candidate.first_name, candidate.last_name)
+        if score < best_score or contact_conflicts(candidate, email, phone):
+            continue
+        if not require_contact or contact_matches(candidate, email, phone):
+            best, best_score = candidate, score
+    if best is not None:
+        logger.info(f"Booking matched patient {best.patient_id} by name and date of birth ({best_score:.2f})")
+        return best, 'name_dob'
+    return None, None
+
+
+def backfill_contact_index(chunk_rows=1000):
+    """Fill the derived columns where they are stale or missing; returns the rows updated"""
+    from sqlalchemy import select, update
+    from app import db
+    from models import Patient
+
+    query = select(
+        Patient.id, Patient.email, Patient.phone, Patient.last_name, Patient.date_of_birth,
+        Patient.email_normalized, Patient.phone_normalized, Patient.match_key
+    ).execution_options(yield_per=chunk_rows)
+    updates = []
+    for row in db.session.execute(query):
+        values = {
+            'email_normalized': normalize_email(row.email),
+            'phone_normalized': normalize_phone(row.phone),
+            'match_key': blocking_key(row.last_name, row.date_of_birth),
+        }
+        if any(values[name] != getattr(row, name) for name in values):
+            updates.append({'id': row.id, **values})
+    for i in range(0, len(updates), chunk_rows):
+        db.session.execute(update(Patient), updates[i:i + chunk_rows])
+    db.session.commit()
+    return len(updates)
+
+
+def duplicate_report():
+    """Clusters of existing patients that share an email or phone or match by name and DOB"""
+    from app import db
+    from models import Patient
+
+    rows = db.session.query(
+        Patient.id, Patient.patient_id, Patient.first_name, Patient.last_name, Patient.date_of_birth,
+        Patient.email_normalized, Patient.phone_normalized, Patient.match_key, Patient.status
+    ).order_by(Patient.id).all()
+    parent = {row.id: row.id for row in rows}
+    reasons = {}
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def link(a, b, reason):
+        root_a, root_b = find(a), find(b)
+        if root_a != root_b:
+            parent[max(root_a, root_b)] = min(root_a, root_b)
+        reasons.setdefault(a, set()).add(reason)
+        reasons.setdefault(b, set()).add(reason)
+
+    for column in ('email_normalized', 'phone_normalized', 'match_key'):
+        groups = {}
+        for row in rows:
+            value = getattr(row, column)
+            if value:
+                groups.setdefault(value, []).append(row)
+        for group in groups.values():
+            if column != 'match_key':
+                # Equal values: linking everyone to the first is enough
+                for other in group[1:]:
+                    link(group[0].id, other.id, column.replace('_normalized', ''))
+                continue
+            # Blocks are small, so the pairwise name comparison stays cheap
+            for i, a in enumerate(group):
+                for b in group[i + 1:]:
+                    if name_similarity(a.first_name, a.last_name, b.first_name, b.last_name) >= NAME_MATCH_THRESHOLD:
+                        link(a.id, b.id, 'name_dob')
+
+    clusters = {}
+    for row in rows:
+        if row.id in reasons:
+            clusters.setdefault(find(row.id), []).append(row)
+    return {
+        'patients': len(rows),
+        'clusters': len(clusters),
+        'patients_in_clusters': sum(len(members) for members in clusters.values()),
+        'duplicates': [{
+            'patients': [{
+                'id': row.id,
+                'patient_id': row.patient_id,
+                'name': f"{row.first_name} {row.last_name}",
+                'date_of_birth': row.date_of_birth.isoformat() if row.date_of_birth else None,
+                'status': row.status,
+                'matched_on': sorted(reasons[row.id]),
+            } for row in members]
+        } for members in clusters.values()],
+    }
+
+
+if __name__ == "__main__":
+    from app import app
+
+    with app.app_context():
+        updated = backfill_contact_index()
+        print(f"Updated the contact index of {updated} patients.")
+        print(json.dumps(duplicate_report(), indent=2))
@@ -1,76 +1,93 @@
+import json
 import logging
 import re
 import numpy as np
 from datetime import datetime, timedelta
-from sklearn.ensemble import IsolationForest, RandomForestClassifier
-from sklearn.preprocessing import StandardScaler
 
 logging.basicConfig(level=logging.DEBUG)
 
+# Bump when the scoring rules change so cached results are recomputed
+RISK_MODEL_VERSION = 'rules-2'
+
+# Number of most recent readings a risk assessment looks at
+RISK_WINDOW = 20
+TREND_WINDOW = 5
+# Vitals are recorded to one decimal, so window stats often land exactly on
+# a rule threshold; stats are rounded to this many places to drop float noise.
+STAT_DECIMALS = 9
+
+AI_RISK_LEVELS = ('critical', 'high', 'moderate', 'low', 'stable')
+AI_BATCH_RESPONSE_SCHEMA = '[{"case": 1, "risk_level": "high", "risk_score": 70, "note": "..."}]'
+
+VITAL_CHANNELS = [
+    'heart_rate',
+    'blood_pressure_systolic',
+    'blood_pressure_diastolic',
+    'oxygen_saturation',
+    'temperature',
+    'respiratory_rate',
+]
+
+
+def insufficient_data_result():
+    return {
+        'risk_level': 'unknown',
+        'risk_score': 0,
+        'predictions': [],
+        'message': 'Insufficient data for analysis'
+    }
+
+
 class RiskPredictor:
-    def __init__(self):
-        self.scaler = StandardScaler()
-        self.anomaly_detector = IsolationForest(contamination=0.1, random_state=42)
-        self.risk_classifier = RandomForestClassifier(n_estimators=50, random_state=42)
-        self.is_trained = False
-        
-    def prepare_vital_features(self, vitals):
-        features = []
-        for vital in vitals:
-            feature_vector = [
-                vital.heart_rate or 75,
-                vital.blood_pressure_systolic or 120,
-                vital.blood_pressure_diastolic or 80,
-                vital.oxygen_saturation or 98,
-                vital.temperature or 98.6,
-                vital.respiratory_rate or 16
-            ]
-            features.append(feature_vector)
-        return np.array(features) if features else np.array([])
+    @property
+    def models(self):
+        """Trained ML models; the registry loads them lazily on first prediction"""
+        from model_registry import model_registry
+        return model_registry
     
-    def calculate_trend(self, values, window=5):
-        if len(values) < 2:
-            return 0
-        values = values[-window:]
+    def model_version(self):
+        """Rule version plus the active ML model version; part of the risk cache key"""
+        return f"{RISK_MODEL_VERSION}/{self.models.active_version() or 'untrained'}"
+    
+    def ml_assessment(self, stats):
+        """ML probability/anomaly entry for one patient's stats, or None without a trained model"""
+        from model_registry import feature_row
+        predictions = self.models.predict([feature_row(stats)])
+        return self.models.ml_result(predictions, 0) if predictions else None
+    
+    def calculate_trend(self, values, window=TREND_WINDOW):
+        """Slope per reading over the most recent `window` values (values most recent first)"""
         if len(values) < 2:
             return 0
+        values = values[:window][::-1]
         x = np.arange(len(values))
         slope = np.polyfit(x, values, 1)[0]
-        return slope
+        return round(float(slope), STAT_DECIMALS)
     
-    def analyze_patient_risk(self, patient_id):
-        from models import VitalSign
-        vitals = VitalSign.query.filter_by(patient_id=patient_id).order_by(
-            VitalSign.recorded_at.desc()
-        ).limit(20).all()
-        
-        if len(vitals) < 3:
-            return {
-                'risk_level': 'unknown',
-                'risk_score': 0,
-                'predictions': [],
-                'message': 'Insufficient data for analysis'
-            }
-        
-        latest = vitals[0]
-        features = self.prepare_vital_features(vitals)
-        
-        if len(features) == 0:
-            return {
-                'risk_level': 'unknown',
-                'risk_score': 0,
-                'predictions': [],
-                'message': 'No vital data available'
-            }
-        
+    def channel_stats(self, values):
+        """Mean, standard deviation and trend for one vital channel (values most recent first)"""
+        if not values:
+            return None
+        return {
+            'avg': round(float(np.mean(values)), STAT_DECIMALS),
+            'std': round(float(np.std(values)), STAT_DECIMALS),
+            'trend': self.calculate_trend(values),
+            'count': len(values)
+        }
+    
+    def assess_from_stats(self, stats):
+        """
+        Apply the rule-based risk model to per-channel stats.
+        Returns (risk_score, risk_level, risk_factors, predictions).
+        """
         risk_factors = []
         risk_score = 0
         
-        hr_values = [v.heart_rate for v in vitals if v.heart_rate]
-        if hr_values:
-            hr_trend = self.calculate_trend(hr_values)
-            hr_avg = np.mean(hr_values)
-            hr_std = np.std(hr_values)
+        hr = stats.get('heart_rate')
+        if hr:
+            hr_trend = hr['trend']
+            hr_avg = hr['avg']
+            hr_std = hr['std']
             
             if hr_avg < 55 or hr_avg > 110:
                 risk_score += 25
@@ -98,10 +115,10 @@ class RiskPredictor:
                     'trend': 'unstable'
                 })
         
-        bp_systolic = [v.blood_pressure_systolic for v in vitals if v.blood_pressure_systolic]
-        if bp_systolic:
-            bp_trend = self.calculate_trend(bp_systolic)
-            bp_avg = np.mean(bp_systolic)
+        bp = stats.get('blood_pressure_systolic')
+        if bp:
+            bp_trend = bp['trend']
+            bp_avg = bp['avg']
             
             if bp_avg < 85 or bp_avg > 165:
                 risk_score += 30
@@ -120,10 +137,10 @@ class RiskPredictor:
                     'trend': 'increasing' if bp_trend > 1 else 'decreasing' if bp_trend < -1 else 'stable'
                 })
         
-        oxygen_values = [v.oxygen_saturation for v in vitals if v.oxygen_saturation]
-        if oxygen_values:
-            o2_trend = self.calculate_trend(oxygen_values)
-            o2_avg = np.mean(oxygen_values)
+        o2 = stats.get('oxygen_saturation')
+        if o2:
+            o2_trend = o2['trend']
+            o2_avg = o2['avg']
             
             if o2_avg < 90:
                 risk_score += 35
@@ -151,10 +168,10 @@ class RiskPredictor:
                     'trend': 'decreasing'
                 })
         
-        temp_values = [v.temperature for v in vitals if v.temperature]
-        if temp_values:
-            temp_avg = np.mean(temp_values)
-            temp_trend = self.calculate_trend(temp_values)
+        temp = stats.get('temperature')
+        if temp:
+            temp_avg = temp['avg']
+            temp_trend = temp['trend']
             
             if temp_avg < 96 or temp_avg > 102:
                 risk_score += 25
@@ -173,9 +190,9 @@ class RiskPredictor:
                     'trend': 'increasing' if temp_trend > 0.1 else 'decreasing' if temp_trend < -0.1 else 'stable'
                 })
         
-        resp_values = [v.respiratory_rate for v in vitals if v.respiratory_rate]
-        if resp_values:
-            resp_avg = np.mean(resp_values)
+        resp = stats.get('respiratory_rate')
+        if resp:
+            resp_avg = resp['avg']
             
             if resp_avg < 10 or resp_avg > 28:
                 risk_score += 25
@@ -209,165 +226,200 @@ class RiskPredictor:
                 elif factor['type'] == 'temperature' and factor['trend'] == 'increasing':
                     predictions.append('Fever may worsen - consider intervention')
         
-        # Optionally consult AI (Gemini) to refine/override assessment
-        try:
-            patient = Patient.query.get(patient_id)
-            ai_advice = self.ai_consult(patient, vitals, risk_score, risk_factors)
-            if ai_advice:
-                # Apply suggested numeric score if provided
-                if 'suggested_score' in ai_advice:
-                    try:
-                        risk_score = int(ai_advice['suggested_score'])
-                    except Exception:
-                        pass
-                # Apply suggested level if provided
-                if 'suggested_level' in ai_advice:
-                    risk_level = ai_advice['suggested_level']
-
-                # Attach AI note to predictions for visibility in UI
-                note = ai_advice.get('note')
-                if note:
-                    predictions.insert(0, f"AI: {note}")
-        except Exception as e:
-            logging.debug(f"AI advice skipped due to error: {e}")
+        return risk_score, risk_level, risk_factors, predictions
+    
+    def analyze_patient_risk(self, patient_id):
+        from ai_consult import ai_consultant
+        from risk_cache import risk_cache
+        from feature_store import feature_store
+        from vital_stream import latest_vital_id
 
-        return {
+        model_version = self.model_version()
+        cached = risk_cache.get(patient_id, model_version, latest_vital_id(patient_id))
+        if cached is not None:
+            return dict(cached)
+        generation = risk_cache.generation(patient_id)
+        stats, vital_count, latest_vital_id = feature_store.risk_stats(patient_id)
+        
+        if vital_count < 3:
+            result = insufficient_data_result()
+            risk_cache.put(patient_id, latest_vital_id, model_version, result, generation)
+            return dict(result)
+        
+        risk_score, risk_level, risk_factors, predictions = self.assess_from_stats(stats)
+        ml = self.ml_assessment(stats)
+        
+        result = {
             'risk_level': risk_level,
             'risk_score': min(int(risk_score), 100),
             'risk_factors': risk_factors,
             'predictions': predictions,
             'analyzed_at': datetime.now().isoformat(),
-            'vital_count': len(vitals)
+            'vital_count': vital_count
         }
+        if ml:
+            result['ml'] = ml
+        risk_cache.put(patient_id, latest_vital_id, model_version, result, generation)
+        # AI advice is attached when it is already known for this vital;
+        # otherwise a background consult is queued and patched in later
+        ai_consultant.request(patient_id, latest_vital_id, result)
+        return dict(result)
 
-    def ai_consult(self, patient, vitals, current_score, risk_factors):
-        """Optional: consult Gemini to get an AI opinion on risk.
-        Returns a dict with optional 'suggested_level' and 'suggested_score' and a note.
-        This call is best-effort and will not raise on error.
-        """
+    def build_ai_case(self, patient, vitals, current_score, risk_factors):
+        """Summary of one patient, recent vitals (most recent first) and the rule-based result"""
+        vitals_summary = []
+        for v in vitals[:10]:
+            t = v.recorded_at.isoformat() if v.recorded_at else ''
+            vitals_summary.append(f"{t}: HR={v.heart_rate or 'n/a'}, BP={v.blood_pressure_systolic or 'n/a'}/{v.blood_pressure_diastolic or 'n/a'}, O2={v.oxygen_saturation or 'n/a'}%, Temp={v.temperature or 'n/a'}F, RR={v.respiratory_rate or 'n/a'}")
+
+        return (
+            f"Computed risk score: {current_score}\n"
+            f"Patient: {patient.full_name} (ID: {patient.patient_id}), age={patient.age}, status={patient.status}.\n"
+            f"Recent vitals (most recent first):\n" + "\n".join(vitals_summary) + "\n"
+            f"Risk factors: {risk_factors}"
+        )
+
+    def build_ai_prompt(self, case):
+        """Single-patient prompt; the answer is free text parsed by parse_ai_advice"""
+        return (
+            "You are a clinical risk assistant. Evaluate the following patient vitals and the computed risk score.\n"
+            f"{case}\n"
+            "Provide a short recommendation in one line and optionally suggest a risk level (critical/high/moderate/low/stable) and a suggested numeric score (0-100)."
+        )
+
+    def build_batch_ai_prompt(self, cases):
+        """Several patients in one prompt; the answer is a JSON array parsed by parse_batch_ai_advice"""
+        blocks = [f"### Case {n}\n{case}" for n, case in enumerate(cases, start=1)]
+        return (
+            "You are a clinical risk assistant. Evaluate each of the following patients independently, "
+            "using their recent vitals and computed risk score.\n\n"
+            + "\n\n".join(blocks) + "\n\n"
+            f"Respond with only a JSON array of exactly {len(cases)} objects, one per case, in this form:\n"
+            f"{AI_BATCH_RESPONSE_SCHEMA}\n"
+            "\"risk_level\" is one of critical, high, moderate, low, stable; \"risk_score\" is 0-100; "
+            "\"note\" is a one-line recommendation."
+        )
+
+    def call_llm(self, prompt):
+        """Raw model response text, or None when no LLM is configured. Raises on call errors."""
         from app import genai, gemini_model
         if genai is None:
             return None
 
-        try:
-            # Build a concise prompt summarizing patient and recent vitals
-            vitals_summary = []
-            for v in vitals[:10]:
-                t = v.recorded_at.isoformat() if v.recorded_at else ''
-                vitals_summary.append(f"{t}: HR={v.heart_rate or 'n/a'}, BP={v.blood_pressure_systolic or 'n/a'}/{v.blood_pressure_diastolic or 'n/a'}, O2={v.oxygen_saturation or 'n/a'}%, Temp={v.temperature or 'n/a'}F, RR={v.respiratory_rate or 'n/a'}")
+        # Attempt to call Gemini; support both genai.generate and gemini_model.generate APIs
+        resp_text = None
+        if hasattr(genai, 'generate'):
+            out = genai.generate(model='gemini-2.5-flash', input=prompt)
+            # Attempt to extract text
+            if isinstance(out, dict):
+                # google generativeai may return candidates
+                cand = out.get('candidates') or out.get('outputs')
+                if cand:
+                    first = cand[0]
+                    resp_text = first.get('output') or first.get('content') or str(first)
+            else:
+                resp_text = str(out)
+        elif gemini_model is not None and hasattr(gemini_model, 'generate'):
+            out = gemini_model.generate(prompt)
+            resp_text = str(out)
+        return resp_text or None
 
-            prompt = (
-                f"You are a clinical risk assistant. Evaluate the following patient vitals and the computed risk score {current_score}. "
-                f"Patient: {patient.full_name} (ID: {patient.patient_id}), age={patient.age}, status={patient.status}.\n"
-                f"Recent vitals (most recent first):\n" + "\n".join(vitals_summary) + "\n"
-                f"Risk factors: {risk_factors}\n"
-                "Provide a short recommendation in one line and optionally suggest a risk level (critical/high/moderate/low/stable) and a suggested numeric score (0-100)."
-            )
+    def ai_consult(self, prompt):
+        """Consult Gemini for an AI opinion on risk.
+        Returns a dict with optional 'suggested_level' and 'suggested_score' and a note,
+        or None when no LLM is configured or it gave no answer. Raises on call errors
+        so callers (see ai_consult.py) can track failures.
+        """
+        resp_text = self.call_llm(prompt)
+        if not resp_text:
+            return None
+        return self.parse_ai_advice(resp_text)
 
-            # Attempt to call Gemini; support both genai.generate and gemini_model.generate APIs
-            resp_text = None
+    def parse_ai_advice(self, resp_text):
+        # Parse suggested level and numeric score if present
+        suggested = {}
+        txt = resp_text.lower()
+        if 'critical' in txt:
+            suggested['suggested_level'] = 'critical'
+        elif 'high' in txt:
+            suggested['suggested_level'] = 'high'
+        elif 'moderate' in txt:
+            suggested['suggested_level'] = 'moderate'
+        elif 'low' in txt:
+            suggested['suggested_level'] = 'low'
+        elif 'stable' in txt:
+            suggested['suggested_level'] = 'stable'
+
+        m = re.search(r"(score|score:?)\s*(\d{1,3})", txt)
+        if m:
             try:
-                if hasattr(genai, 'generate'):
-                    out = genai.generate(model='gemini-2.5-flash', input=prompt)
-                    # Attempt to extract text
-                    if isinstance(out, dict):
-                        # google generativeai may return candidates
-                        cand = out.get('candidates') or out.get('outputs')
-                        if cand:
-                            first = cand[0]
-                            resp_text = first.get('output') or first.get('content') or str(first)
-                    else:
-                        resp_text = str(out)
-                elif gemini_model is not None and hasattr(gemini_model, 'generate'):
-                    out = gemini_model.generate(prompt)
-                    resp_text = str(out)
+                suggested['suggested_score'] = max(0, min(100, int(m.group(2))))
             except Exception:
-                # If the higher-level generate fails, fallback to a safe str on object
-                try:
-                    resp_text = str(out)
-                except Exception:
-                    resp_text = None
+                pass
 
-            if not resp_text:
-                return None
+        suggested['note'] = resp_text.strip()[:1000]
+        return suggested
 
-            # Parse suggested level and numeric score if present
-            suggested = {}
-            txt = resp_text.lower()
-            if 'critical' in txt:
-                suggested['suggested_level'] = 'critical'
-            elif 'high' in txt:
-                suggested['suggested_level'] = 'high'
-            elif 'moderate' in txt:
-                suggested['suggested_level'] = 'moderate'
-            elif 'low' in txt:
-                suggested['suggested_level'] = 'low'
-            elif 'stable' in txt:
-                suggested['suggested_level'] = 'stable'
+    def parse_batch_ai_advice(self, resp_text, case_count):
+        """
+        Advice per case number (1-based) from a JSON-array answer to
+        build_batch_ai_prompt. Cases missing or malformed in the answer are
+        left out; a response that is not a JSON array raises ValueError.
+        """
+        text = resp_text.strip()
+        start, end = text.find('['), text.rfind(']')
+        if start < 0 or end < start:
+            raise ValueError('no JSON array in batched AI response')
+        items = json.loads(text[start:end + 1])
+        if not isinstance(items, list):
+            raise ValueError('batched AI response is not a JSON array')
 
-            m = re.search(r"(score|score:?)\s*(\d{1,3})", txt)
-            if m:
-                try:
-                    suggested['suggested_score'] = max(0, min(100, int(m.group(2))))
-                except Exception:
-                    pass
+        advice = {}
+        for item in items:
+            if not isinstance(item, dict):
+                continue
+            try:
+                case = int(item.get('case'))
+            except (TypeError, ValueError):
+                continue
+            note = str(item.get('note') or '').strip()
+            if not 1 <= case <= case_count or not note or case in advice:
+                continue
+            suggested = {'note': note[:1000]}
+            level = str(item.get('risk_level') or '').lower()
+            if level in AI_RISK_LEVELS:
+                suggested['suggested_level'] = level
+            try:
+                suggested['suggested_score'] = max(0, min(100, int(item['risk_score'])))
+            except (KeyError, TypeError, ValueError):
+                pass
+            advice[case] = suggested
+        return advice
 
-            suggested['note'] = resp_text.strip()[:1000]
-            return suggested
-        except Exception as e:
-            logging.error(f"AI consult failed: {e}")
-            return None
+    def apply_ai_advice(self, result, advice):
+        """Fold AI advice into a risk analysis result dict (in place)"""
+        # Apply suggested numeric score if provided
+        if 'suggested_score' in advice:
+            try:
+                result['risk_score'] = min(int(advice['suggested_score']), 100)
+            except Exception:
+                pass
+        # Apply suggested level if provided
+        if 'suggested_level' in advice:
+            result['risk_level'] = advice['suggested_level']
+
+        # Attach AI note to predictions for visibility in UI
+        note = advice.get('note')
+        if note:
+            result['predictions'] = [f"AI: {note}"] + list(result.get('predictions', []))
+        result['ai'] = advice
+        return result
     
     def get_early_warning_score(self, vital):
-        score = 0
-        
-        if vital.respiratory_rate:
-            if vital.respiratory_rate <= 8:
-                score += 3
-            elif vital.respiratory_rate <= 11:
-                score += 1
-            elif vital.respiratory_rate >= 25:
-                score += 3
-            elif vital.respiratory_rate >= 21:
-                score += 2
-        
-        if vital.oxygen_saturation:
-            if vital.oxygen_saturation <= 91:
-                score += 3
-            elif vital.oxygen_saturation <= 93:
-                score += 2
-            elif vital.oxygen_saturation <= 95:
-                score += 1
-        
-        if vital.heart_rate:
-            if vital.heart_rate <= 40:
-                score += 3
-            elif vital.heart_rate <= 50:
-                score += 1
-            elif vital.heart_rate >= 131:
-                score += 3
-            elif vital.heart_rate >= 111:
-                score += 2
-            elif vital.heart_rate >= 91:
-                score += 1
-        
-        if vital.blood_pressure_systolic:
-            if vital.blood_pressure_systolic <= 90:
-                score += 3
-            elif vital.blood_pressure_systolic <= 100:
-                score += 2
-            elif vital.blood_pressure_systolic >= 220:
-                score += 3
-        
-        if vital.temperature:
-            if vital.temperature <= 95:
-                score += 3
-            elif vital.temperature >= 102.2:
-                score += 2
-            elif vital.temperature >= 100.4:
-                score += 1
-        
-        return score
+        from early_warning import news_score
+        if getattr(vital, 'news_score', None) is not None:
+            return vital.news_score
+        return news_score(vital)
 
 
 def create_predictive_alert(patient_id, risk_analysis):
@@ -417,33 +469,10 @@ risk_predictor = RiskPredictor()
 
 
 def analyze_all_patients():
-    # Use a simple, non-transactional approach to avoid SQLAlchemy context issues
-    from models import Patient
+    """Score every active patient with the batch engine and raise predictive alerts"""
+    from risk_batch import batch_risk_engine
     try:
-        patients = Patient.query.filter(Patient.status.in_(['admitted', 'icu', 'emergency'])).all()
+        return batch_risk_engine.analyze_all()
     except Exception as e:
-        logging.error(f"Error fetching patients: {e}")
+        logging.error(f"Error analyzing patients: {e}")
         return []
-
-    results = []
-    for patient in patients:
-        try:
-            pid = patient.id
-            pname = f"{patient.first_name or ''} {patient.last_name or ''}".strip()
-            room = patient.room_number or ''
-            
-            analysis = risk_predictor.analyze_patient_risk(pid)
-            results.append({
-                'patient_id': pid,
-                'patient_name': pname,
-                'room': room,
-                **analysis
-            })
-
-            if analysis['risk_level'] in ['critical', 'high']:
-                create_predictive_alert(pid, analysis)
-
-        except Exception as e:
-            logging.error(f"Error analyzing patient {pid}: {e}")
-
-    return results
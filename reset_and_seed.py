@@ -14,6 +14,7 @@ import random
 from app import app, db, genai, gemini_model
 from models import Patient, VitalSign, Alert, RiskAssessment, ChatMessage, Medication, StaffMember, LabReport
 from predictive_analytics import analyze_all_patients
+from id_sequence import next_patient_id
 
 # Generate 25 doctors and 60 nurses
 # Use Indian (Andhra Pradesh / Telugu) style sample names for realism
@@ -368,11 +369,12 @@ with app.app_context():
                     ))
                 db.session.add_all(vitals)
         db.session.flush()
-        next_idx = 4
         first_names = ['John','Jane','Sam','Sara','Liam','Noah','Olivia','Emma','Lucas','Mia','Ethan','Ava','Sophia','Isabella']
         last_names = ['Smith','Johnson','Lee','Brown','Garcia','Martinez','Davis','Lopez','Wilson','Anderson']
         while existing_count < target:
-            pid = f"PAT{next_idx:06d}"
+            # From the id sequence, which a reset does not rewind, so ids
+            # reserved by running workers are never seeded
+            pid = next_patient_id()
             fn = random.choice(first_names)
             ln = random.choice(last_names)
             dob = datetime.now().date().replace(year=random.randint(1940,2005))
@@ -454,7 +456,6 @@ with app.app_context():
                 )
                 db.session.add(lr)
             existing_count += 1
-            next_idx += 1
         db.session.commit()
 
     print('Running AI risk analysis for all patients...')
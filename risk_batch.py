@@ -0,0 +1,262 @@
+"""
+Batch risk scoring for the whole census.
+
+Scoring patients one at a time costs queries per patient. The batch engine
+loads the last RISK_WINDOW readings of every patient in one windowed query,
+lays them out as (patients x window) NumPy matrices per vital channel and
+computes means, standard deviations and trend slopes for all patients at
+once (risk_scoring). The per-patient rule model (RiskPredictor.assess_from_stats) is then
+applied to those stats, so results match the single-patient path.
+Patients with a current entry in risk_cache are not rescored, and fresh
+results are cached. Newly flagged patients get a background AI consult. Resulting predictive alerts are written in one
+transaction.
+
+For very large censuses the scoring can be sharded across a process pool
+(RISK_SWEEP_WORKERS, default 1 = in process). Patients to score are split
+into contiguous id ranges, one per worker; each worker process keeps its
+own database engine, loads and scores its range and returns the results,
+and the parent merges them and writes alerts in one batch as usual.
+Workers are spawned with risk_scoring as their main module, so they never
+import the web app. A patient's result depends only on its own readings,
+so the output is the same for any number of workers. Sweeps with fewer than
+RISK_SWEEP_PARALLEL_MIN patients to score (default 2000) stay in process,
+where the pool round trip would cost more than it saves.
+"""
+
+import logging
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+
+import numpy as np
+
+import risk_scoring
+from predictive_analytics import RISK_WINDOW, VITAL_CHANNELS, risk_predictor
+from ai_consult import ai_consultant
+from risk_cache import risk_cache
+from vital_stream import latest_vital_ids
+from risk_scoring import (
+    channel_stat_matrix, load_vital_windows, score_shard, score_windows
+)
+
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATUSES = ['admitted', 'icu', 'emergency']
+
+_spawn_lock = threading.Lock()
+
+
+@contextmanager
+def _spawn_from_risk_scoring():
+    """
+    Spawned children re-run the parent's __main__ (main.py: the whole app,
+    its routes and schedulers) before unpickling their task. Workers start
+    while this is held, so they run risk_scoring as their main module instead.
+    """
+    with _spawn_lock:
+        main = sys.modules['__main__']
+        sys.modules['__main__'] = risk_scoring
+        try:
+            yield
+        finally:
+            sys.modules['__main__'] = main
+
+
+def shard_ids(patient_ids, shards):
+    """Split sorted patient ids into up to `shards` contiguous, equally sized id ranges"""
+    patient_ids = sorted(patient_ids)
+    shards = max(1, min(shards, len(patient_ids)))
+    bounds = np.linspace(0, len(patient_ids), shards + 1).round().astype(int)
+    return [patient_ids[a:b] for a, b in zip(bounds[:-1], bounds[1:]) if b > a]
+
+
+class BatchRiskEngine:
+    def __init__(self, predictor=None, window=RISK_WINDOW, workers=None):
+        self.predictor = predictor or risk_predictor
+        self.window = window
+        self.workers = workers or int(os.environ.get('RISK_SWEEP_WORKERS', '1'))
+        self.parallel_min = int(os.environ.get('RISK_SWEEP_PARALLEL_MIN', '2000'))
+        self._pool = None
+        self._pool_key = None
+
+    def compute_stats(self, windows):
+        return {channel: channel_stat_matrix(windows.channels[channel]) for channel in VITAL_CHANNELS}
+
+    def score(self, windows, analyzed_at=None):
+        """Rule-based analysis for every patient in `windows`, keyed by patient id"""
+        return score_windows(windows, self.predictor, analyzed_at)
+
+    def _process_pool(self, database_url):
+        key = (database_url, self.workers)
+        if self._pool is None or self._pool_key != key:
+            self.shutdown()
+            # spawn, not fork: the web process has socket and consult threads
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=risk_scoring.init_worker,
+                initargs=(database_url,),
+            )
+            self._pool_key = key
+        return self._pool
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def score_patients(self, patient_ids, analyzed_at=None):
+        """
+        Score `patient_ids`, in process or sharded across the worker pool.
+        Returns ({patient_id: result}, {patient_id: latest vital id or None}).
+        """
+        from app import db
+
+        analyzed_at = analyzed_at or datetime.now().isoformat()
+        if self.workers > 1 and len(patient_ids) >= self.parallel_min:
+            try:
+                return self._score_sharded(patient_ids, analyzed_at, db.engine.url.render_as_string(hide_password=False))
+            except Exception as e:
+                logger.error(f"Parallel risk sweep failed, scoring in process: {e}")
+                self.shutdown()
+
+        windows = load_vital_windows(db.session, patient_ids, self.window)
+        fresh = self.score(windows, analyzed_at)
+        latest = {pid: int(vid) or None for pid, vid in zip(windows.patient_ids.tolist(), windows.latest_vital_ids)}
+        return fresh, latest
+
+    def _score_sharded(self, patient_ids, analyzed_at, database_url):
+        pool = self._process_pool(database_url)
+        # The pool starts its processes on demand as tasks are submitted
+        with _spawn_from_risk_scoring():
+            futures = [pool.submit(score_shard, shard, self.window, analyzed_at)
+                       for shard in shard_ids(patient_ids, self.workers)]
+        fresh, latest = {}, {}
+        for future in futures:
+            ids, latest_ids, results = future.result()
+            for pid, vid, result in zip(ids, latest_ids, results):
+                fresh[pid] = result
+                latest[pid] = vid or None
+        return fresh, latest
+
+    def analyze_all(self, write_alerts=True, use_cache=True):
+        """
+        Score every active patient; same output shape as analyze_all_patients.
+        With use_cache=False every patient is rescored from the vitals (and
+        the cache refilled).
+        """
+        from app import db
+        from models import Patient
+
+        started = time.perf_counter()
+        patients = db.session.query(
+            Patient.id, Patient.first_name, Patient.last_name, Patient.room_number
+        ).filter(Patient.status.in_(ACTIVE_STATUSES)).order_by(Patient.id).all()
+
+        # Only patients without a current cached analysis are scored
+        model_version = self.predictor.model_version()
+        scored = {}
+        if use_cache:
+            current = latest_vital_ids([p.id for p in patients])
+            for p in patients:
+                hit = risk_cache.get(p.id, model_version, current.get(p.id))
+                if hit is not None:
+                    scored[p.id] = hit
+        misses = [p.id for p in patients if p.id not in scored]
+        generations = {pid: risk_cache.generation(pid) for pid in misses}
+
+        fresh, latest_ids = self.score_patients(misses)
+        for patient_id in misses:
+            risk_cache.put(patient_id, latest_ids[patient_id], model_version, fresh[patient_id],
+                           generations[patient_id])
+        scored.update(fresh)
+
+        # AI advice for newly flagged patients arrives in the background,
+        # within one sweep budget
+        if ai_consultant.enabled():
+            budget = ai_consultant.begin_sweep()
+            for patient_id in misses:
+                if fresh[patient_id]['risk_level'] in ('critical', 'high'):
+                    ai_consultant.request(patient_id, latest_ids[patient_id], fresh[patient_id], budget)
+
+        results = []
+        for p in patients:
+            results.append({
+                'patient_id': p.id,
+                'patient_name': f"{p.first_name or ''} {p.last_name or ''}".strip(),
+                'room': p.room_number or '',
+                **scored[p.id]
+            })
+
+        if write_alerts:
+            write_predictive_alerts(results)
+        logger.info(f"Batch risk sweep scored {len(misses)} of {len(results)} patients "
+                    f"({len(results) - len(misses)} cached) in {time.perf_counter() - started:.3f}s")
+        return results
+
+
+def write_predictive_alerts(results):
+    """
+    Batched create_predictive_alert: refresh or create the open
+    predictive_warning alert of every high/critical patient, in one commit.
+    `results` are analyze_all_patients rows (patient_id, patient_name, analysis).
+    """
+    from app import db
+    from models import Alert
+    from alert_router import send_to_n8n_webhook
+
+    flagged = [r for r in results if r['risk_level'] in ['critical', 'high']]
+    if not flagged:
+        return []
+
+    existing = {}
+    for alert in Alert.query.filter(
+        Alert.patient_id.in_([r['patient_id'] for r in flagged]),
+        Alert.alert_type == 'predictive_warning',
+        Alert.is_acknowledged == False
+    ).order_by(Alert.id):
+        existing.setdefault(alert.patient_id, alert)
+
+    now = datetime.now()
+    touched = []
+    for r in flagged:
+        severity = 'critical' if r['risk_level'] == 'critical' else 'warning'
+        message = f"Risk Score: {r['risk_score']}. " + "; ".join(r.get('predictions', []))
+        alert = existing.get(r['patient_id'])
+        if alert:
+            alert.message = message
+            alert.severity = severity
+            alert.created_at = now
+        else:
+            alert = Alert(
+                patient_id=r['patient_id'],
+                alert_type='predictive_warning',
+                severity=severity,
+                title=f"AI Risk Alert - {r['patient_name']}",
+                message=message
+            )
+            db.session.add(alert)
+        touched.append(alert)
+
+    try:
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error writing predictive alerts: {e}")
+        return []
+
+    for alert in touched:
+        try:
+            send_to_n8n_webhook(alert)
+        except Exception:
+            pass
+    return touched
+
+
+batch_risk_engine = BatchRiskEngine()
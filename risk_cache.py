@@ -0,0 +1,111 @@
+"""
+In-process cache of risk analysis results.
+
+A patient's risk analysis only changes when a new vital arrives or the
+model changes, so results are cached per patient together with the id of
+the latest vital and the model version they were computed from. A lookup
+passes the patient's current latest vital id (one indexed query) and any
+other id is a miss, so vitals written by other workers are never served
+stale. The ingest path also calls on_vital(), which drops the entry at
+once. Entries are evicted least recently used first.
+
+Each patient also carries a generation counter bumped on every ingest. A
+result computed while a vital was being ingested is not stored, so a slow
+analysis can never overwrite the invalidation with stale data.
+
+Configured with RISK_CACHE_SIZE (default 4096 patients) and
+RISK_CACHE_TTL_SECONDS (default 300; bounds the age of an entry, 0
+disables).
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+
+class RiskResultCache:
+    def __init__(self, max_entries=None, ttl_seconds=None):
+        self.max_entries = max_entries or int(os.environ.get('RISK_CACHE_SIZE', '4096'))
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else int(os.environ.get('RISK_CACHE_TTL_SECONDS', '300'))
+        self._entries = OrderedDict()  # patient_id -> (latest_vital_id, model_version, stored_at, result)
+        self._generations = {}  # patient_id -> ingest counter
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'invalidations': 0, 'evictions': 0, 'stale_puts': 0}
+
+    def generation(self, patient_id):
+        """Capture before computing a result; pass to put()"""
+        return self._generations.get(patient_id, 0)
+
+    def get(self, patient_id, model_version, latest_vital_id):
+        """The cached result if it was computed from `latest_vital_id` with `model_version`"""
+        with self._lock:
+            entry = self._entries.get(patient_id)
+            if entry is not None:
+                vital_id, version, stored_at, result = entry
+                fresh = not self.ttl_seconds or time.monotonic() - stored_at < self.ttl_seconds
+                if vital_id == latest_vital_id and version == model_version and fresh:
+                    self._entries.move_to_end(patient_id)
+                    self.stats['hits'] += 1
+                    return result
+                del self._entries[patient_id]
+            self.stats['misses'] += 1
+            return None
+
+    def put(self, patient_id, latest_vital_id, model_version, result, generation=None):
+        with self._lock:
+            if generation is not None and generation != self._generations.get(patient_id, 0):
+                self.stats['stale_puts'] += 1
+                return False
+            self._entries[patient_id] = (latest_vital_id, model_version, time.monotonic(), dict(result))
+            self._entries.move_to_end(patient_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats['evictions'] += 1
+            return True
+
+    def patch(self, patient_id, latest_vital_id, update):
+        """
+        Apply `update(result)` to the cached result if it is still the one for
+        `latest_vital_id`, e.g. to attach advice that arrived asynchronously.
+        """
+        with self._lock:
+            entry = self._entries.get(patient_id)
+            if entry is None or entry[0] != latest_vital_id:
+                return False
+            vital_id, version, stored_at, result = entry
+            result = dict(result)
+            update(result)
+            self._entries[patient_id] = (vital_id, version, stored_at, result)
+            return True
+
+    def on_vital(self, patient_id, vital_id=None):
+        """Ingest hook: a new vital makes the patient's cached analysis obsolete"""
+        with self._lock:
+            self._generations[patient_id] = self._generations.get(patient_id, 0) + 1
+            entry = self._entries.get(patient_id)
+            if entry is not None and entry[0] != vital_id:
+                del self._entries[patient_id]
+                self.stats['invalidations'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def report(self):
+        with self._lock:
+            lookups = self.stats['hits'] + self.stats['misses']
+            return {
+                **self.stats,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl_seconds,
+                'hit_rate': round(self.stats['hits'] / lookups, 4) if lookups else None,
+            }
+
+
+risk_cache = RiskResultCache()
@@ -0,0 +1,143 @@
+"""
+Change-only persistence of RiskAssessment history.
+
+Viewing a patient's risk page used to insert an assessment every time. Now
+a new row is written only when the assessment changed materially from the
+patient's latest row:
+
+- the risk level differs,
+- the score moved by RISK_HISTORY_SCORE_DELTA points or more (default 5), or
+- the set of risk factors differs, compared by (type, severity) so that
+  numbers quoted in the factor messages do not count as a change.
+
+Otherwise the latest row is confirmed in place: view_count is incremented
+and last_confirmed_at set to now.
+
+compact_history() collapses existing runs of assessments that would not
+have been written under this rule into their first row, carrying over the
+run's total view count and last timestamp. Run it once after upgrading:
+
+  python risk_history.py
+"""
+
+import json
+import logging
+import os
+from datetime import datetime
+
+from sqlalchemy import delete, update
+
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+SCORE_DELTA = int(os.environ.get('RISK_HISTORY_SCORE_DELTA', '5'))
+
+
+def factor_set(risk_factors):
+    """(type, severity) of each factor; accepts the JSON column or a list"""
+    if isinstance(risk_factors, str):
+        try:
+            risk_factors = json.loads(risk_factors)
+        except ValueError:
+            return frozenset()
+    return frozenset(
+        (f.get('type'), f.get('severity')) for f in risk_factors or [] if isinstance(f, dict)
+    )
+
+
+def is_material_change(previous, risk_level, risk_score, risk_factors):
+    """Whether an assessment differs enough from `previous` (a RiskAssessment or None) to be stored"""
+    if previous is None:
+        return True
+    return (
+        previous.risk_level != risk_level
+        or abs((previous.risk_score or 0) - (risk_score or 0)) >= SCORE_DELTA
+        or factor_set(previous.risk_factors) != factor_set(risk_factors)
+    )
+
+
+def record_assessment(patient_id, analysis):
+    """
+    Store `analysis` (an analyze_patient_risk result) if it changed
+    materially, else confirm the patient's latest assessment. Commits and
+    returns the current RiskAssessment row.
+    """
+    from app import db
+    from models import RiskAssessment
+
+    latest = RiskAssessment.query.filter_by(patient_id=patient_id).order_by(
+        RiskAssessment.assessed_at.desc(), RiskAssessment.id.desc()
+    ).first()
+    factors = analysis.get('risk_factors', [])
+    now = datetime.now()
+
+    if not is_material_change(latest, analysis['risk_level'], analysis['risk_score'], factors):
+        latest.view_count = (latest.view_count or 1) + 1
+        latest.last_confirmed_at = now
+        db.session.commit()
+        return latest
+
+    assessment = RiskAssessment(
+        patient_id=patient_id,
+        risk_level=analysis['risk_level'],
+        risk_score=analysis['risk_score'],
+        risk_factors=json.dumps(factors),
+        predictions=json.dumps(analysis.get('predictions', [])),
+        assessed_at=now,
+        last_confirmed_at=now,
+        view_count=1
+    )
+    db.session.add(assessment)
+    db.session.commit()
+    return assessment
+
+
+def compact_history(patient_ids=None):
+    """
+    Collapse runs of non-material changes in each patient's history into
+    the run's first row. Returns the number of rows deleted.
+    """
+    from app import db
+    from models import RiskAssessment
+
+    if patient_ids is None:
+        patient_ids = [pid for (pid,) in db.session.query(RiskAssessment.patient_id).distinct()]
+
+    deleted = 0
+    for patient_id in patient_ids:
+        rows = RiskAssessment.query.filter_by(patient_id=patient_id).order_by(
+            RiskAssessment.assessed_at, RiskAssessment.id
+        ).all()
+        keep_updates, drop_ids = [], []
+        head, views, last_seen = None, 0, None
+        for row in rows:
+            seen = row.last_confirmed_at or row.assessed_at
+            if head is not None and not is_material_change(head, row.risk_level, row.risk_score, row.risk_factors):
+                drop_ids.append(row.id)
+                views += row.view_count or 1
+                last_seen = max(filter(None, (last_seen, seen)), default=None)
+                continue
+            if head is not None:
+                keep_updates.append({'id': head.id, 'view_count': views, 'last_confirmed_at': last_seen})
+            head, views, last_seen = row, row.view_count or 1, seen
+        if head is not None:
+            keep_updates.append({'id': head.id, 'view_count': views, 'last_confirmed_at': last_seen})
+
+        if not drop_ids:
+            continue
+        db.session.execute(update(RiskAssessment), keep_updates)
+        for i in range(0, len(drop_ids), 500):
+            db.session.execute(delete(RiskAssessment).where(RiskAssessment.id.in_(drop_ids[i:i + 500])))
+        db.session.commit()
+        deleted += len(drop_ids)
+
+    logger.info(f"Risk history compaction removed {deleted} duplicate assessments")
+    return deleted
+
+
+if __name__ == "__main__":
+    from app import app
+
+    with app.app_context():
+        removed = compact_history()
+        print(f"Removed {removed} duplicate risk assessments.")
@@ -0,0 +1,256 @@
+"""
+Scheduled census risk sweep with materialized results.
+
+An APScheduler job runs the batch risk sweep every
+RISK_SWEEP_INTERVAL_SECONDS (default 60, 0 disables) and stores the latest
+result of every active patient in patient_risk_snapshots, one row per
+patient. The risk APIs and dashboards read that table instead of scoring
+on demand.
+
+Every web process starts the job (on its first request), but only the
+holder of the 'risk_sweep' lease in scheduler_leases actually sweeps. The
+lease is taken with a conditional UPDATE (or INSERT for the first holder),
+so exactly one process wins on SQLite and PostgreSQL alike; the holder
+renews it every run, and another process takes over once it has not been
+renewed for RISK_SWEEP_LEASE_SECONDS (default three intervals).
+
+The sweep scores from the vitals themselves, bypassing risk_cache, so a
+snapshot is never older than one interval; fresh results still refill the
+cache for the single-patient path.
+
+Predictive alerts are written only for patients whose level or score
+changed since the previous sweep, so an unchanged high-risk patient does
+not re-notify every interval.
+"""
+
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import case, delete, insert, or_, update
+from sqlalchemy.exc import IntegrityError
+
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+
+class DbLease:
+    """A named, expiring lock row shared through the database"""
+
+    def __init__(self, name, seconds, holder=None):
+        self.name = name
+        self.seconds = seconds
+        self.holder = holder or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+    def acquire(self):
+        """Take or renew the lease; True if this process holds it afterwards"""
+        from app import db
+        from models import SchedulerLease
+
+        now = datetime.now()
+        expires_at = now + timedelta(seconds=self.seconds)
+        table = SchedulerLease.__table__
+        result = db.session.execute(
+            update(table)
+            .where(table.c.name == self.name, or_(table.c.holder == self.holder, table.c.expires_at < now))
+            .values(
+                holder=self.holder,
+                expires_at=expires_at,
+                acquired_at=case((table.c.holder == self.holder, table.c.acquired_at), else_=now),
+            )
+        )
+        if result.rowcount == 1:
+            db.session.commit()
+            return True
+        try:
+            db.session.execute(insert(table).values(
+                name=self.name, holder=self.holder, expires_at=expires_at, acquired_at=now
+            ))
+            db.session.commit()
+            return True
+        except IntegrityError:
+            # Someone else holds an unexpired lease
+            db.session.rollback()
+            return False
+
+    def release(self):
+        from app import db
+        from models import SchedulerLease
+
+        db.session.execute(delete(SchedulerLease).where(
+            SchedulerLease.name == self.name, SchedulerLease.holder == self.holder
+        ))
+        db.session.commit()
+
+    def current(self):
+        from models import SchedulerLease
+        lease = SchedulerLease.query.get(self.name)
+        if lease is None:
+            return None
+        return {
+            'holder': lease.holder,
+            'this_process': lease.holder == self.holder,
+            'acquired_at': lease.acquired_at.isoformat() if lease.acquired_at else None,
+            'expires_at': lease.expires_at.isoformat(),
+        }
+
+
+def materialize(results, model_version):
+    """
+    Replace the snapshot table's contents with `results` (analyze_all_patients
+    rows). Returns the rows that are new or whose level or score changed.
+    """
+    from app import db
+    from models import PatientRiskSnapshot
+
+    previous = {
+        pid: (level, score)
+        for pid, level, score in db.session.query(
+            PatientRiskSnapshot.patient_id, PatientRiskSnapshot.risk_level, PatientRiskSnapshot.risk_score
+        )
+    }
+    now = datetime.now()
+    inserts, updates, changed = [], [], []
+    for r in results:
+        analyzed_at = datetime.fromisoformat(r['analyzed_at']) if r.get('analyzed_at') else now
+        row = {
+            'patient_id': r['patient_id'],
+            'risk_level': r['risk_level'],
+            'risk_score': r['risk_score'],
+            'result': json.dumps(r, default=str),
+            'model_version': model_version,
+            'analyzed_at': analyzed_at,
+        }
+        before = previous.pop(r['patient_id'], None)
+        (updates if before is not None else inserts).append(row)
+        if before != (r['risk_level'], r['risk_score']):
+            changed.append(r)
+
+    if updates:
+        db.session.execute(update(PatientRiskSnapshot), updates)
+    if inserts:
+        db.session.execute(insert(PatientRiskSnapshot), inserts)
+    # Patients discharged since the last sweep
+    gone = list(previous)
+    for i in range(0, len(gone), 500):
+        db.session.execute(delete(PatientRiskSnapshot).where(PatientRiskSnapshot.patient_id.in_(gone[i:i + 500])))
+    db.session.commit()
+    return changed
+
+
+def latest_results():
+    """Every materialized result in analyze_all_patients format, or None if no sweep has run"""
+    from models import PatientRiskSnapshot
+
+    rows = PatientRiskSnapshot.query.order_by(PatientRiskSnapshot.patient_id).with_entities(PatientRiskSnapshot.result).all()
+    if not rows:
+        return None
+    return [json.loads(r.result) for r in rows]
+
+
+def latest_result(patient_id):
+    from models import PatientRiskSnapshot
+
+    snapshot = PatientRiskSnapshot.query.get(patient_id)
+    return json.loads(snapshot.result) if snapshot else None
+
+
+def current_result(patient_id):
+    """
+    The patient's materialized result for detail views. The sweep consults
+    the AI only for high and critical patients, so a snapshot without advice
+    falls back to analyze_patient_risk, which attaches known advice or
+    queues a consult (a cache hit once the vital is scored).
+    """
+    from ai_consult import ai_consultant
+    from predictive_analytics import risk_predictor
+
+    result = latest_result(patient_id)
+    if result is not None and ('ai' in result or result['risk_level'] == 'unknown' or not ai_consultant.enabled()):
+        return result
+    return risk_predictor.analyze_patient_risk(patient_id)
+
+
+def latest_levels(patient_ids):
+    """{patient_id: (risk_level, risk_score)} for the given patients, for dashboards"""
+    from models import PatientRiskSnapshot
+
+    if not patient_ids:
+        return {}
+    rows = PatientRiskSnapshot.query.filter(PatientRiskSnapshot.patient_id.in_(patient_ids)).with_entities(
+        PatientRiskSnapshot.patient_id, PatientRiskSnapshot.risk_level, PatientRiskSnapshot.risk_score
+    )
+    return {pid: (level, score) for pid, level, score in rows}
+
+
+class RiskSweepScheduler:
+    def __init__(self):
+        self.interval_seconds = int(os.environ.get('RISK_SWEEP_INTERVAL_SECONDS', '60'))
+        lease_seconds = float(os.environ.get('RISK_SWEEP_LEASE_SECONDS') or 3 * max(self.interval_seconds, 1))
+        self.lease = DbLease('risk_sweep', lease_seconds)
+        self._scheduler = None
+        self._lock = threading.Lock()
+        self.stats = {'runs': 0, 'not_leader': 0, 'failed': 0, 'last_run_at': None,
+                      'last_duration_seconds': None, 'last_patients': 0, 'last_changed': 0}
+
+    def start(self):
+        """Start the interval job once per process"""
+        if self.interval_seconds <= 0 or self._scheduler is not None:
+            return
+        with self._lock:
+            if self._scheduler is not None:
+                return
+            from apscheduler.schedulers.background import BackgroundScheduler
+
+            scheduler = BackgroundScheduler(daemon=True)
+            scheduler.add_job(
+                self.run_once, 'interval', seconds=self.interval_seconds, id='risk_sweep',
+                max_instances=1, coalesce=True, next_run_time=datetime.now()
+            )
+            scheduler.start()
+            self._scheduler = scheduler
+            logger.info(f"Risk sweep scheduled every {self.interval_seconds}s")
+
+    def run_once(self):
+        """One sweep if this process holds the lease; returns True if it swept"""
+        from app import app, db
+        from predictive_analytics import risk_predictor
+        from risk_batch import batch_risk_engine, write_predictive_alerts
+
+        with app.app_context():
+            try:
+                if not self.lease.acquire():
+                    self.stats['not_leader'] += 1
+                    return False
+                started = time.perf_counter()
+                results = batch_risk_engine.analyze_all(write_alerts=False, use_cache=False)
+                changed = materialize(results, risk_predictor.model_version())
+                write_predictive_alerts(changed)
+                self.stats['runs'] += 1
+                self.stats['last_run_at'] = datetime.now().isoformat()
+                self.stats['last_duration_seconds'] = round(time.perf_counter() - started, 3)
+                self.stats['last_patients'] = len(results)
+                self.stats['last_changed'] = len(changed)
+                return True
+            except Exception as e:
+                db.session.rollback()
+                self.stats['failed'] += 1
+                logger.error(f"Scheduled risk sweep failed: {e}")
+                return False
+
+    def report(self):
+        return {
+            **self.stats,
+            'interval_seconds': self.interval_seconds,
+            'lease_seconds': self.lease.seconds,
+            'running': self._scheduler is not None,
+            'lease': self.lease.current(),
+        }
+
+
+risk_sweep_scheduler = RiskSweepScheduler()
@@ -0,0 +1,182 @@
+"""
+Vectorised risk scoring over windows of recent vitals.
+
+Loads the last RISK_WINDOW readings of a set of patients as
+(patients x window) NumPy matrices per vital channel and scores them all at
+once; risk_batch builds the census sweep on top of this.
+
+The module is also the entry point of the sweep's process-pool workers.
+They are spawned with this module as their __main__ (see
+risk_batch.BatchRiskEngine._process_pool), so a worker imports only the
+scoring code and the models, never the web app, its routes or its
+schedulers.
+"""
+
+import logging
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import func, select
+
+from predictive_analytics import (
+    RISK_WINDOW, STAT_DECIMALS, TREND_WINDOW, VITAL_CHANNELS,
+    insufficient_data_result, risk_predictor
+)
+from model_registry import feature_matrix
+
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# Patient ids per IN (...) list; well under SQLite's bound-parameter limit
+ID_CHUNK = 900
+
+
+class VitalWindows:
+    """Last-N vitals for a set of patients as dense matrices (NaN = missing reading)"""
+
+    def __init__(self, patient_ids, channels, row_counts, latest_vital_ids):
+        self.patient_ids = patient_ids
+        self.channels = channels
+        self.row_counts = row_counts
+        self.latest_vital_ids = latest_vital_ids  # 0 where the patient has no vitals
+
+
+def load_vital_windows(conn, patient_ids, window=RISK_WINDOW):
+    """
+    Fetch the latest `window` vitals of every patient in `patient_ids` with a
+    single ROW_NUMBER() query. `conn` is a SQLAlchemy Connection or Session.
+    """
+    from models import VitalSign
+
+    patient_ids = np.asarray(sorted(set(patient_ids)), dtype=np.int64)
+    columns = [getattr(VitalSign, c) for c in VITAL_CHANNELS]
+    matrices = {c: np.full((len(patient_ids), window), np.nan) for c in VITAL_CHANNELS}
+    row_counts = np.zeros(len(patient_ids), dtype=np.int64)
+    latest_vital_ids = np.zeros(len(patient_ids), dtype=np.int64)
+    if len(patient_ids) == 0:
+        return VitalWindows(patient_ids, matrices, row_counts, latest_vital_ids)
+
+    rn = func.row_number().over(
+        partition_by=VitalSign.patient_id,
+        order_by=(VitalSign.recorded_at.desc(), VitalSign.id.desc())
+    ).label('rn')
+    rows = []
+    # Exactly the requested patients, so discharged ones in between are never read
+    for start in range(0, len(patient_ids), ID_CHUNK):
+        chunk = patient_ids[start:start + ID_CHUNK].tolist()
+        ranked = select(VitalSign.patient_id, rn, VitalSign.id, *columns).where(
+            VitalSign.patient_id.in_(chunk)
+        ).subquery()
+        rows.extend(conn.execute(select(ranked).where(ranked.c.rn <= window)).all())
+    if not rows:
+        return VitalWindows(patient_ids, matrices, row_counts, latest_vital_ids)
+
+    data = np.array([tuple(np.nan if v is None else v for v in row) for row in rows], dtype=np.float64)
+    row_idx = np.searchsorted(patient_ids, data[:, 0].astype(np.int64))
+    col_idx = data[:, 1].astype(np.int64) - 1
+
+    for i, channel in enumerate(VITAL_CHANNELS):
+        values = data[:, 3 + i]
+        # The per-patient path skips falsy readings, so 0 counts as missing
+        values[values == 0] = np.nan
+        matrices[channel][row_idx, col_idx] = values
+    np.add.at(row_counts, row_idx, 1)
+    newest = col_idx == 0
+    latest_vital_ids[row_idx[newest]] = data[newest, 2].astype(np.int64)
+    return VitalWindows(patient_ids, matrices, row_counts, latest_vital_ids)
+
+
+def channel_stat_matrix(values, trend_window=TREND_WINDOW):
+    """
+    Vectorised equivalent of RiskPredictor.channel_stats for every row of a
+    (patients x window) matrix ordered most recent first.
+    Returns (count, mean, std, trend) arrays.
+    """
+    valid = ~np.isnan(values)
+    count = valid.sum(axis=1)
+    safe_count = np.maximum(count, 1)
+
+    filled = np.where(valid, values, 0.0)
+    mean = filled.sum(axis=1) / safe_count
+    dev = np.where(valid, values - mean[:, None], 0.0)
+    std = np.sqrt((dev ** 2).sum(axis=1) / safe_count)
+
+    # Pack valid readings to the left, keeping their order, and fit the
+    # first `trend_window` of them (the most recent readings).
+    order = np.argsort(~valid, axis=1, kind='stable')
+    packed = np.take_along_axis(values, order, axis=1)
+    k = np.minimum(count, trend_window)
+    offsets = np.arange(trend_window)[None, :]
+    idx = np.clip(np.broadcast_to(offsets, (len(values), trend_window)), 0, values.shape[1] - 1)
+    y = np.take_along_axis(packed, idx, axis=1)
+    in_fit = offsets < k[:, None]
+
+    safe_k = np.maximum(k, 1)
+    x = np.broadcast_to(offsets, y.shape).astype(np.float64)
+    x_mean = np.where(in_fit, x, 0.0).sum(axis=1) / safe_k
+    y_mean = np.where(in_fit, y, 0.0).sum(axis=1) / safe_k
+    xc = np.where(in_fit, x - x_mean[:, None], 0.0)
+    yc = np.where(in_fit, y - y_mean[:, None], 0.0)
+    sxx = (xc ** 2).sum(axis=1)
+    # x counts back in time here, so the chronological slope is the negation
+    trend = np.where(k >= 2, -(xc * yc).sum(axis=1) / np.where(sxx > 0, sxx, 1.0), 0.0)
+    return count, np.round(mean, STAT_DECIMALS), np.round(std, STAT_DECIMALS), np.round(trend, STAT_DECIMALS)
+
+
+def score_windows(windows, predictor=None, analyzed_at=None):
+    """Rule-based analysis for every patient in `windows`, keyed by patient id"""
+    predictor = predictor or risk_predictor
+    stats = {channel: channel_stat_matrix(windows.channels[channel]) for channel in VITAL_CHANNELS}
+    analyzed_at = analyzed_at or datetime.now().isoformat()
+    # One predict_proba over every patient with enough data
+    scorable = np.flatnonzero(windows.row_counts >= 3)
+    ml_predictions = predictor.models.predict(feature_matrix(stats)[scorable]) if len(scorable) else None
+    ml_rows = {int(row): i for i, row in enumerate(scorable)}
+    results = {}
+    for row, patient_id in enumerate(windows.patient_ids.tolist()):
+        vital_count = int(windows.row_counts[row])
+        if vital_count < 3:
+            results[patient_id] = insufficient_data_result()
+            continue
+        patient_stats = {}
+        for channel, (count, mean, std, trend) in stats.items():
+            if count[row] == 0:
+                patient_stats[channel] = None
+                continue
+            patient_stats[channel] = {
+                'avg': mean[row],
+                'std': std[row],
+                'trend': trend[row],
+                'count': int(count[row])
+            }
+        risk_score, risk_level, risk_factors, predictions = predictor.assess_from_stats(patient_stats)
+        results[patient_id] = {
+            'risk_level': risk_level,
+            'risk_score': min(int(risk_score), 100),
+            'risk_factors': risk_factors,
+            'predictions': predictions,
+            'analyzed_at': analyzed_at,
+            'vital_count': vital_count
+        }
+        if ml_predictions:
+            results[patient_id]['ml'] = predictor.models.ml_result(ml_predictions, ml_rows[row])
+    return results
+
+
+# Per-process state of sweep pool workers
+_worker_engine = None
+
+
+def init_worker(database_url):
+    global _worker_engine
+    from sqlalchemy import create_engine
+    _worker_engine = create_engine(database_url, pool_pre_ping=True)
+
+
+def score_shard(patient_ids, window, analyzed_at):
+    """Pool task: load and score one id range on the worker's own connection"""
+    with _worker_engine.connect() as conn:
+        windows = load_vital_windows(conn, patient_ids, window)
+    results = score_windows(windows, analyzed_at=analyzed_at)
+    ids = windows.patient_ids.tolist()
+    return ids, windows.latest_vital_ids.tolist(), [results[pid] for pid in ids]
@@ -1,3 +1,4 @@
+import base64
 import json
 import logging
 from datetime import datetime
@@ -5,9 +6,14 @@ from functools import wraps
 from flask import render_template, redirect, url_for, request, flash, session, Response, jsonify
 from flask_login import current_user
 from app import app, db
-from models import StaffMember, Patient, VitalSign, Alert, Medication, TreatmentLog, MedicationAdministration, Shift, ShiftHandoff, DoctorNote, RiskAssessment, ChatMessage, LabReport, AppointmentRequest, AuditLog, Round, Ward
+from models import StaffMember, Patient, VitalSign, Alert, Medication, TreatmentLog, MedicationAdministration, Shift, ShiftHandoff, DoctorNote, RiskAssessment, ChatMessage, LabReport, AppointmentRequest, AuditLog, Round, Ward, AlertRecipient
 # Removed Replit-specific auth integration; using local session-based auth instead
 from synthetic_data import initialize_synthetic_data
+from alert_escalation import escalation_scheduler
+from slot_calendar import slot_calendar
+from id_sequence import next_patient_id
+from patient_matching import find_patient
+from alert_router import SEVERITY_RANK, severity_rank
 
 logging.basicConfig(level=logging.DEBUG)
 
@@ -18,8 +24,12 @@ def generate_fallback_response(patient, user_message, language='en'):
     msg_lower = user_message.lower()
     
     # Get patient data
+    from feature_store import feature_store
     active_meds = Medication.query.filter_by(patient_id=patient.id, is_active=True).all()
-    latest_vital = patient.vitals.order_by(VitalSign.recorded_at.desc()).first()
+    features = feature_store.get(patient.id)
+    latest_vital = {
+        c: f"{f['last']:g}" if f['last'] is not None else 'n/a' for c, f in features['channels'].items()
+    } if features else None
     
     if language == 'hi':
         if any(word in msg_lower for word in ['medicine', 'medication', 'दवा']):
@@ -29,7 +39,7 @@ def generate_fallback_response(patient, user_message, language='en'):
             return "आपके पास वर्तमान में कोई सक्रिय दवा नहीं है।"
         elif any(word in msg_lower for word in ['blood pressure', 'bp', 'ब्लड प्रेशर']):
             if latest_vital:
-                return f"आपका नवीनतम रक्तचाप: {latest_vital.blood_pressure_systolic}/{latest_vital.blood_pressure_diastolic} mmHg है।"
+                return f"आपका नवीनतम रक्तचाप: {latest_vital['blood_pressure_systolic']}/{latest_vital['blood_pressure_diastolic']} mmHg है।"
             return "रक्तचाप डेटा उपलब्ध नहीं है।"
         elif any(word in msg_lower for word in ['diagnosis', 'बीमारी', 'रोग']):
             return f"आपका निदान: {patient.diagnosis}। अधिक जानकारी के लिए अपने डॉक्टर से बात करें।"
@@ -44,7 +54,7 @@ def generate_fallback_response(patient, user_message, language='en'):
     
     elif any(word in msg_lower for word in ['blood pressure', 'bp', 'vitals', 'vital signs']):
         if latest_vital:
-            return f"Your latest blood pressure: {latest_vital.blood_pressure_systolic}/{latest_vital.blood_pressure_diastolic} mmHg. Heart rate: {latest_vital.heart_rate} bpm. SpO2: {latest_vital.oxygen_saturation}%."
+            return f"Your latest blood pressure: {latest_vital['blood_pressure_systolic']}/{latest_vital['blood_pressure_diastolic']} mmHg. Heart rate: {latest_vital['heart_rate']} bpm. SpO2: {latest_vital['oxygen_saturation']}%."
         return "Vital signs data not available."
     
     elif any(word in msg_lower for word in ['diagnosis', 'condition', 'disease']):
@@ -65,6 +75,14 @@ def make_session_permanent():
     session.permanent = True
 
 
+@app.before_request
+def start_background_jobs():
+    from risk_scheduler import risk_sweep_scheduler
+    from ward_anomaly import ward_anomaly_detector
+    risk_sweep_scheduler.start()
+    ward_anomaly_detector.start()
+
+
 def get_staff_user():
     if 'staff_id' in session:
         return StaffMember.query.filter_by(id=session['staff_id']).first()
@@ -223,13 +241,15 @@ def ward_dashboard(department_name):
     ).order_by(Patient.room_number).all()
     
     # Quick stats
+    from feature_store import feature_store
+    patient_features = feature_store.get_many([p.id for p in patients])
     critical_count = 0
     stable_count = 0
     for p in patients:
-        lv = p.latest_vitals
-        if lv and lv.status == 'critical':
+        status = patient_features.get(p.id, {}).get('last_status')
+        if status == 'critical':
             critical_count += 1
-        elif lv and lv.status == 'normal':
+        elif status == 'normal':
             stable_count += 1
             
     # Staff on duty in this department
@@ -242,6 +262,7 @@ def ward_dashboard(department_name):
         staff=staff,
         department=department_name,
         patients=patients,
+        patient_features=patient_features,
         critical_count=critical_count,
         stable_count=stable_count,
         staff_on_duty_count=staff_on_duty_count
@@ -285,6 +306,126 @@ def admin_dashboard():
     )
 
 
+@app.route('/admin/alert-latency')
+@staff_login_required
+@admin_required
+def admin_alert_latency():
+    staff = get_staff_user()
+    from alert_latency import latency_tracker
+    return render_template('admin/alert_latency.html', staff=staff, report=latency_tracker.report())
+
+
+@app.route('/api/admin/alert-latency')
+@staff_login_required
+@admin_required
+def api_alert_latency():
+    from alert_latency import latency_tracker
+    return jsonify(latency_tracker.report())
+
+
+@app.route('/api/admin/risk-cache')
+@staff_login_required
+@admin_required
+def api_risk_cache():
+    from risk_cache import risk_cache
+    return jsonify(risk_cache.report())
+
+
+@app.route('/api/admin/ai-consult')
+@staff_login_required
+@admin_required
+def api_ai_consult():
+    from ai_consult import ai_consultant
+    return jsonify(ai_consultant.report())
+
+
+@app.route('/api/admin/feature-store')
+@staff_login_required
+@admin_required
+def api_feature_store():
+    from feature_store import feature_store
+    return jsonify(feature_store.report())
+
+
+@app.route('/api/admin/ward-stats')
+@staff_login_required
+@admin_required
+def api_ward_stats():
+    from ward_stats import ward_stats
+    return jsonify(ward_stats.report())
+
+
+@app.route('/api/admin/vital-drift')
+@staff_login_required
+@admin_required
+def api_vital_drift():
+    from datetime import timedelta
+    from ward_stats import ward_stats
+    from predictive_analytics import VITAL_CHANNELS
+    baseline_days = request.args.get('baseline_days', 7, type=int)
+    current_hours = request.args.get('current_hours', 24, type=int)
+    wards = request.args.getlist('ward') or None
+    now = datetime.now()
+    current_since = now - timedelta(hours=current_hours)
+    baseline = (current_since - timedelta(days=baseline_days), current_since)
+    return jsonify([ward_stats.drift(channel, baseline, (current_since, None), wards) for channel in VITAL_CHANNELS])
+
+
+@app.route('/api/admin/ward-anomaly')
+@staff_login_required
+@admin_required
+def api_ward_anomaly():
+    from ward_anomaly import ward_anomaly_detector
+    return jsonify(ward_anomaly_detector.report())
+
+
+@app.route('/api/admin/risk-sweep')
+@staff_login_required
+@admin_required
+def api_risk_sweep():
+    from risk_scheduler import risk_sweep_scheduler
+    return jsonify(risk_sweep_scheduler.report())
+
+
+@app.route('/api/admin/slot-calendar')
+@staff_login_required
+@admin_required
+def api_slot_calendar():
+    return jsonify(slot_calendar.report())
+
+
+@app.route('/api/admin/id-sequences')
+@staff_login_required
+@admin_required
+def api_id_sequences():
+    from id_sequence import patient_id_sequence
+    return jsonify([patient_id_sequence.report()])
+
+
+@app.route('/api/admin/patient-duplicates')
+@staff_login_required
+@admin_required
+def api_patient_duplicates():
+    from patient_matching import duplicate_report
+    return jsonify(duplicate_report())
+
+
+@app.route('/api/admin/appointments/batch-allocate', methods=['POST'])
+@staff_login_required
+@admin_required
+def api_batch_allocate_appointments():
+    from appointment_batch import allocate_batch
+    data = request.get_json(silent=True) or {}
+    try:
+        start = datetime.strptime(data['start'], '%Y-%m-%d').date()
+        end = datetime.strptime(data.get('end') or data['start'], '%Y-%m-%d').date()
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'error': 'start and end must be YYYY-MM-DD dates'}), 400
+    if end < start:
+        return jsonify({'error': 'end is before start'}), 400
+    return jsonify(allocate_batch(start, end, apply=bool(data.get('apply'))))
+
+
 @app.route('/admin/users')
 @staff_login_required
 @admin_required
@@ -397,12 +538,43 @@ def confirm_appointment(appt_id):
         return redirect(url_for('dashboard'))
         
     appt = AppointmentRequest.query.get_or_404(appt_id)
-    appt.status = 'confirmed'
+    if appt.status != 'confirmed':
+        if not slot_calendar.book(appt):
+            db.session.rollback()
+            flash("That slot is outside the doctor's shifts or already has a confirmed appointment.", 'warning')
+            return redirect(request.referrer or url_for('admin_appointments'))
+        appt.status = 'confirmed'
     db.session.commit()
     flash('Appointment confirmed.', 'success')
     return redirect(request.referrer or url_for('admin_appointments'))
 
 
+@app.route('/admin/appointment/<int:appt_id>/cancel', methods=['POST'])
+@staff_login_required
+def cancel_appointment(appt_id):
+    staff = get_staff_user()
+    if staff.role not in ['admin', 'doctor']:
+        flash('Permission denied.', 'danger')
+        return redirect(url_for('dashboard'))
+
+    appt = AppointmentRequest.query.get_or_404(appt_id)
+    if appt.status == 'confirmed':
+        slot_calendar.release(appt)
+    appt.status = 'cancelled'
+    db.session.commit()
+    flash('Appointment cancelled.', 'success')
+    return redirect(request.referrer or url_for('admin_appointments'))
+
+
+@app.route('/api/appointments/free-slots')
+def api_free_slots():
+    """Next free appointment slots for a department, for the booking pages"""
+    department = request.args.get('department') or None
+    n = max(1, min(request.args.get('n', 5, type=int), 50))
+    days = max(1, min(request.args.get('days', 14, type=int), 60))
+    return jsonify(slot_calendar.next_free_slots(department, n=n, days=days))
+
+
 
 @app.route('/doctor')
 @staff_login_required
@@ -422,15 +594,17 @@ def doctor_dashboard():
             active_alerts = Alert.query.filter(
                 Alert.patient_id.in_(patient_ids),
                 Alert.is_acknowledged == False
-            ).order_by(Alert.severity.desc(), Alert.created_at.desc()).all()
+            ).order_by(severity_rank(Alert.severity).desc(), Alert.created_at.desc()).all()
             critical_alerts = [a for a in active_alerts if a.severity == 'critical']
         else:
             active_alerts = []
             critical_alerts = []
     
+    from risk_scheduler import latest_levels
     return render_template('doctor/dashboard.html',
         staff=staff,
         patients=patients,
+        risk_levels=latest_levels([p.id for p in patients]),
         active_alerts=active_alerts,
         critical_alerts=critical_alerts,
         todays_rounds=Round.query.filter(
@@ -539,7 +713,7 @@ def nurse_dashboard():
             active_alerts = Alert.query.filter(
                 Alert.patient_id.in_(patient_ids),
                 Alert.is_acknowledged == False
-            ).order_by(Alert.severity.desc(), Alert.created_at.desc()).all()
+            ).order_by(severity_rank(Alert.severity).desc(), Alert.created_at.desc()).all()
         else:
             active_alerts = []
     
@@ -628,6 +802,7 @@ def acknowledge_alert(alert_id):
     alert.acknowledged_by_id = staff.id
     alert.acknowledged_at = datetime.now()
     db.session.commit()
+    escalation_scheduler.cancel(alert_id)
     # If this was an AJAX request, return a JSON response so the client can update UI without reload
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest' or request.is_json:
         return jsonify({'ok': True, 'alert_id': alert_id}), 200
@@ -635,6 +810,88 @@ def acknowledge_alert(alert_id):
     return redirect(request.referrer or url_for('dashboard'))
 
 
+@app.route('/api/alerts/acknowledge', methods=['POST'])
+@staff_login_required
+def bulk_acknowledge_alerts():
+    """
+    Acknowledge many alerts in one transaction. The JSON body selects them by
+    one of: {"alert_ids": [...]}, {"patient_id": id}, or
+    {"scope": "mine", "max_severity": "warning"} for every open alert routed
+    to the caller or raised for their patients, up to that severity.
+    """
+    staff = get_staff_user()
+    data = request.get_json(silent=True) or {}
+    
+    criteria = [Alert.is_acknowledged == False]
+    if data.get('alert_ids'):
+        try:
+            alert_ids = [int(a) for a in data['alert_ids']]
+        except (TypeError, ValueError):
+            return jsonify({'ok': False, 'error': 'alert_ids must be a list of integers'}), 400
+        if len(alert_ids) > 1000:
+            return jsonify({'ok': False, 'error': 'At most 1000 alert_ids per request'}), 400
+        criteria.append(Alert.id.in_(alert_ids))
+    elif data.get('patient_id'):
+        try:
+            patient_id = int(data['patient_id'])
+        except (TypeError, ValueError):
+            return jsonify({'ok': False, 'error': 'patient_id must be an integer'}), 400
+        criteria.append(Alert.patient_id == patient_id)
+    elif data.get('scope') == 'mine':
+        max_severity = data.get('max_severity', 'critical')
+        if max_severity not in SEVERITY_RANK:
+            return jsonify({'ok': False, 'error': f'Unknown severity {max_severity}'}), 400
+        routed_to_me = db.session.query(AlertRecipient.id).filter(
+            AlertRecipient.alert_id == Alert.id,
+            AlertRecipient.staff_id == staff.id
+        ).exists()
+        my_patients = db.session.query(Patient.id).filter(
+            Patient.id == Alert.patient_id,
+            db.or_(Patient.assigned_nurse_id == staff.id, Patient.assigned_doctor_id == staff.id)
+        ).exists()
+        criteria.append(db.or_(routed_to_me, my_patients))
+        criteria.append(severity_rank(Alert.severity) <= SEVERITY_RANK[max_severity])
+    else:
+        return jsonify({'ok': False, 'error': 'Provide alert_ids, patient_id or scope'}), 400
+    
+    now = datetime.now()
+    try:
+        alert_ids = [alert_id for (alert_id,) in db.session.query(Alert.id).filter(*criteria)]
+        if alert_ids:
+            db.session.execute(
+                db.update(Alert)
+                .where(Alert.id.in_(alert_ids), Alert.is_acknowledged == False)
+                .values(is_acknowledged=True, acknowledged_by_id=staff.id, acknowledged_at=now)
+            )
+            staff_ids = {
+                staff_id for (staff_id,) in db.session.query(AlertRecipient.staff_id)
+                .filter(AlertRecipient.alert_id.in_(alert_ids)).distinct()
+            }
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"Error bulk acknowledging alerts: {e}")
+        return jsonify({'ok': False, 'error': 'Could not acknowledge alerts'}), 500
+    
+    if not alert_ids:
+        return jsonify({'ok': True, 'acknowledged': 0, 'alert_ids': []})
+    
+    for alert_id in alert_ids:
+        escalation_scheduler.cancel(alert_id)
+    
+    staff_ids.add(staff.id)
+    try:
+        app.socketio.emit('alerts_acknowledged', {
+            'alert_ids': alert_ids,
+            'acknowledged_by': staff.full_name,
+            'acknowledged_at': now.isoformat()
+        }, to=[f"staff_{staff_id}" for staff_id in sorted(staff_ids)])
+    except Exception as e:
+        logging.error(f"Socket emit error for bulk acknowledgement: {e}")
+    
+    return jsonify({'ok': True, 'acknowledged': len(alert_ids), 'alert_ids': alert_ids})
+
+
 @app.route('/api/trigger-emergency-alert', methods=['POST'])
 @staff_login_required
 def trigger_emergency_alert():
@@ -705,39 +962,104 @@ def vitals_stream():
     return Response(generate(), mimetype='text/event-stream')
 
 
+def _encode_alert_cursor(rank, created_at, alert_id):
+    raw = json.dumps([rank, created_at.isoformat(), alert_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+
+def _decode_alert_cursor(cursor):
+    rank, created_at, alert_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    return int(rank), datetime.fromisoformat(created_at), int(alert_id)
+
+
 @app.route('/api/alerts/active')
 @staff_login_required
 def get_active_alerts():
+    """
+    Unacknowledged alerts routed to the caller or raised for their patients,
+    most severe first. Keyset-paginated with `cursor`/`limit`; `since`
+    (ISO timestamp) returns only alerts created or re-triggered after it.
+    """
     staff = get_staff_user()
     
-    if staff.role == 'admin':
-        return jsonify([])
+    if staff.role == 'admin' or not staff.is_on_duty:
+        return jsonify({'alerts': [], 'next_cursor': None, 'server_time': datetime.now().isoformat()})
+    
+    try:
+        limit = max(1, min(int(request.args.get('limit', 50)), 200))
+        since = datetime.fromisoformat(request.args['since']) if request.args.get('since') else None
+        cursor = _decode_alert_cursor(request.args['cursor']) if request.args.get('cursor') else None
+    except (ValueError, TypeError):
+        return jsonify({'error': 'Invalid limit, since or cursor parameter'}), 400
+    
+    server_time = datetime.now()
+    rank = severity_rank(Alert.severity)
+    routed_to_me = db.session.query(AlertRecipient.id).filter(
+        AlertRecipient.alert_id == Alert.id,
+        AlertRecipient.staff_id == staff.id
+    ).exists()
+    
+    query = db.session.query(
+        Alert.id, Alert.patient_id, Alert.alert_type, Alert.severity, Alert.title, Alert.message,
+        Alert.created_at, Alert.last_seen_at, Alert.occurrence_count, rank.label('rank'),
+        Patient.first_name, Patient.last_name, Patient.room_number, Patient.bed_number
+    ).join(Patient, Patient.id == Alert.patient_id).filter(
+        Alert.is_acknowledged == False,
+        db.or_(
+            routed_to_me,
+            Patient.assigned_nurse_id == staff.id,
+            Patient.assigned_doctor_id == staff.id
+        )
+    )
     
-    if not staff.is_on_duty:
-        return jsonify([])
+    if since:
+        query = query.filter(db.func.coalesce(Alert.last_seen_at, Alert.created_at) > since)
     
-    alerts = Alert.query.filter_by(is_acknowledged=False).order_by(
-        Alert.severity.desc(),
-        Alert.created_at.desc()
-    ).all()
+    if cursor:
+        c_rank, c_created, c_id = cursor
+        query = query.filter(db.or_(
+            rank < c_rank,
+            db.and_(rank == c_rank, Alert.created_at < c_created),
+            db.and_(rank == c_rank, Alert.created_at == c_created, Alert.id < c_id)
+        ))
+    
+    rows = query.order_by(rank.desc(), Alert.created_at.desc(), Alert.id.desc()).limit(limit + 1).all()
     
     alerts_data = []
-    for alert in alerts:
-        patient = Patient.query.get(alert.patient_id)
+    for row in rows[:limit]:
         alerts_data.append({
-            'id': alert.id,
-            'patient_id': alert.patient_id,
-            'patient_name': patient.full_name if patient else 'Unknown',
-            'room': patient.room_number if patient else '',
-            'bed': patient.bed_number if patient else '',
-            'type': alert.alert_type,
-            'severity': alert.severity,
-            'title': alert.title,
-            'message': alert.message,
-            'created_at': alert.created_at.isoformat()
+            'id': row.id,
+            'patient_id': row.patient_id,
+            'patient_name': f"{row.first_name} {row.last_name}",
+            'room': row.room_number or '',
+            'bed': row.bed_number or '',
+            'type': row.alert_type,
+            'severity': row.severity,
+            'title': row.title,
+            'message': row.message,
+            'occurrence_count': row.occurrence_count or 1,
+            'created_at': row.created_at.isoformat(),
+            'last_seen_at': (row.last_seen_at or row.created_at).isoformat()
         })
     
-    return jsonify(alerts_data)
+    next_cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        next_cursor = _encode_alert_cursor(last.rank, last.created_at, last.id)
+    
+    return jsonify({
+        'alerts': alerts_data,
+        'next_cursor': next_cursor,
+        'server_time': server_time.isoformat()
+    })
+
+
+@app.route('/api/patient/<int:patient_id>/features')
+@staff_login_required
+def get_patient_features(patient_id):
+    from feature_store import feature_store
+    Patient.query.get_or_404(patient_id)
+    return jsonify(feature_store.get(patient_id) or {})
 
 
 @app.route('/api/patient/<int:patient_id>/vitals')
@@ -799,50 +1121,86 @@ def utility_processor():
 @app.route('/patient/<int:patient_id>/risk-analysis')
 @staff_login_required
 def patient_risk_analysis(patient_id):
-    from predictive_analytics import risk_predictor
+    from risk_scheduler import current_result
     staff = get_staff_user()
     patient = Patient.query.get_or_404(patient_id)
     
-    analysis = risk_predictor.analyze_patient_risk(patient_id)
+    analysis = current_result(patient_id)
     
-    risk_assessment = RiskAssessment(
-        patient_id=patient_id,
-        risk_level=analysis['risk_level'],
-        risk_score=analysis['risk_score'],
-        risk_factors=json.dumps(analysis.get('risk_factors', [])),
-        predictions=json.dumps(analysis.get('predictions', []))
-    )
-    db.session.add(risk_assessment)
-    db.session.commit()
+    from risk_history import record_assessment
+    record_assessment(patient_id, analysis)
     
     past_assessments = RiskAssessment.query.filter_by(patient_id=patient_id).order_by(
-        RiskAssessment.assessed_at.desc()
+        RiskAssessment.assessed_at.desc(), RiskAssessment.id.desc()
     ).limit(10).all()
     
+    from ai_consult import ai_consultant
     return render_template('risk_analysis.html',
         staff=staff,
         patient=patient,
         analysis=analysis,
-        past_assessments=past_assessments
+        past_assessments=past_assessments,
+        ai_pending='ai' not in analysis and analysis['risk_level'] != 'unknown' and ai_consultant.enabled()
     )
 
 
 @app.route('/api/risk-analysis/<int:patient_id>')
 @staff_login_required
 def api_risk_analysis(patient_id):
-    from predictive_analytics import risk_predictor
-    analysis = risk_predictor.analyze_patient_risk(patient_id)
-    return jsonify(analysis)
+    from risk_scheduler import current_result
+    return jsonify(current_result(patient_id))
 
 
 @app.route('/api/risk-analysis/all')
 @staff_login_required
 def api_all_risk_analysis():
     from predictive_analytics import analyze_all_patients
-    results = analyze_all_patients()
+    from risk_scheduler import latest_results
+    # Materialized by the scheduled sweep; scored on demand only before its first run
+    results = latest_results()
+    if results is None:
+        results = analyze_all_patients()
     return jsonify(results)
 
 
+@app.route('/api/vital-percentiles')
+@staff_login_required
+def api_vital_percentiles():
+    """Percentiles of one vital channel from the ward sketches; repeat ?ward= to merge wards, none for the hospital"""
+    from datetime import timedelta
+    from ward_stats import ward_stats
+    from predictive_analytics import VITAL_CHANNELS
+    channel = request.args.get('channel', 'oxygen_saturation')
+    if channel not in VITAL_CHANNELS:
+        return jsonify({'error': f"channel must be one of {', '.join(VITAL_CHANNELS)}"}), 400
+    hours = request.args.get('hours', 24, type=int)
+    wards = request.args.getlist('ward') or None
+    return jsonify(ward_stats.percentiles(channel, wards=wards, since=datetime.now() - timedelta(hours=hours)))
+
+
+@app.route('/api/news/high')
+@staff_login_required
+def api_high_news_patients():
+    from early_warning import NEWS_ALERT_THRESHOLD, patients_with_news_at_least
+    threshold = request.args.get('threshold', NEWS_ALERT_THRESHOLD, type=int)
+    rows = patients_with_news_at_least(threshold)
+    return jsonify({
+        'threshold': threshold,
+        'count': len(rows),
+        'patients': [{
+            'patient_id': patient.id,
+            'patient_code': patient.patient_id,
+            'name': patient.full_name,
+            'status': patient.status,
+            'room_number': patient.room_number,
+            'bed_number': patient.bed_number,
+            'news_score': vital.news_score,
+            'vital_id': vital.id,
+            'recorded_at': vital.recorded_at.isoformat() if vital.recorded_at else None,
+        } for patient, vital in rows],
+    })
+
+
 @app.route('/medication/<int:patient_id>/schedule', methods=['GET', 'POST'])
 @staff_login_required
 @role_required('doctor', 'nurse', 'admin')
@@ -1033,6 +1391,8 @@ def create_shift():
     )
     db.session.add(shift)
     db.session.commit()
+    slot_calendar.add_shift(shift)
+    db.session.commit()
     
     flash('Shift created successfully.', 'success')
     return redirect(url_for('shift_management'))
@@ -1126,10 +1486,13 @@ def create_handoff():
     else:
         patients = Patient.query.filter(Patient.status != 'discharged').all()
     
+    from feature_store import feature_store, format_vitals_summary
+    patient_features = feature_store.get_many([p.id for p in patients])
     return render_template('handoff_create.html',
         staff=staff,
         incoming_staff_list=incoming_staff_list,
-        patients=patients
+        patients=patients,
+        vitals_summaries={p.id: format_vitals_summary(patient_features.get(p.id)) for p in patients}
     )
 
 
@@ -1408,10 +1771,11 @@ def patient_chat(patient_id):
             
             lang_name = {'en':'English', 'hi':'Hindi', 'ta':'Tamil', 'te':'Telugu', 'ml':'Malayalam'}.get(language, 'English')
             
+            from feature_store import feature_store, format_vitals_summary
             context = f"Patient: {patient.full_name}. Diagnosis: {patient.diagnosis}. "
-            lv = patient.vitals.order_by(VitalSign.recorded_at.desc()).first()
-            if lv:
-                context += f"Latest Vitals: HR {lv.heart_rate}, BP {lv.blood_pressure_systolic}/{lv.blood_pressure_diastolic}, SpO2 {lv.oxygen_saturation}%. "
+            features = feature_store.get(patient_id)
+            if features:
+                context += f"Latest Vitals (arrows: 6h trend): {format_vitals_summary(features)} "
             
             active_meds = Medication.query.filter_by(patient_id=patient_id, is_active=True).all()
             if active_meds:
@@ -1512,9 +1876,10 @@ def patient_book_appointment(patient_id):
     # Try intelligent doctor allocation if no doctor specified
     if not appt.doctor_id and appt.appointment_type != 'emergency':
         allocated_doctor = allocate_appointment(appt)
-        if allocated_doctor:
+        # Confirm only if the doctor's slot is still free; otherwise staff reschedule it
+        if allocated_doctor and slot_calendar.book(appt):
             appt.status = 'confirmed'
-            db.session.commit()
+        db.session.commit()
     
     return jsonify({
         'ok': True, 
@@ -1661,29 +2026,23 @@ def landing_page_book_appointment():
         return jsonify({'error': 'Missing required fields'}), 400
     
     # Try to find existing patient
-    patient = None
-    if phone:
-        patient = Patient.query.filter_by(phone=phone).first()
-    if not patient and email:
-        patient = Patient.query.filter_by(email=email).first()
+    try:
+        dob = datetime.strptime(data['dob'], '%Y-%m-%d').date() if data.get('dob') else None
+    except ValueError:
+        return jsonify({'error': 'Invalid date of birth'}), 400
+    patient, matched_on = find_patient(email=email, phone=phone, first_name=first_name, last_name=last_name,
+                                       date_of_birth=dob, require_contact=True)
     
     # If patient doesn't exist, create new patient record
     if not patient:
         try:
-            # Generate patient ID
-            last_patient = Patient.query.order_by(Patient.patient_id.desc()).first()
-            if last_patient:
-                patient_num = int(last_patient.patient_id.replace('PAT', '')) + 1
-            else:
-                patient_num = 1
-            
             patient = Patient(
-                patient_id=f'PAT{patient_num:06d}',
+                patient_id=next_patient_id(),
                 first_name=first_name,
                 last_name=last_name,
                 phone=phone,
                 email=email,
-                date_of_birth=datetime.strptime(data.get('dob', '2000-01-01'), '%Y-%m-%d').date() if data.get('dob') else datetime(2000, 1, 1).date(),
+                date_of_birth=dob or datetime(2000, 1, 1).date(),
                 gender=data.get('gender', 'Other'),
                 status='inquiry',
                 department=data.get('department', 'General')
@@ -1717,15 +2076,16 @@ def landing_page_book_appointment():
     
     # Try intelligent doctor allocation
     allocated_doctor = allocate_appointment(appt)
-    if allocated_doctor:
+    if allocated_doctor and slot_calendar.book(appt):
         appt.status = 'confirmed'
-        db.session.commit()
+    db.session.commit()
     
     return jsonify({
         'ok': True,
         'appointment_id': appt.id,
         'patient_id': patient.id,
-        'patient_code': patient.patient_id,
+        # Never reveal an existing record's code to a caller matched by name and DOB
+        'patient_code': None if matched_on == 'name_dob' else patient.patient_id,
         'status': appt.status,
         'message': 'Appointment request submitted. You will receive a confirmation.'
     })
@@ -2381,31 +2741,17 @@ def book_appointment_public():
             return redirect(url_for('index'))
 
         # 2. Find or Create Patient
-        # Simple matching logic: email or phone
-        patient = None
-        if email:
-            patient = Patient.query.filter_by(email=email).first()
-        if not patient and phone:
-            patient = Patient.query.filter_by(phone=phone).first()
-            
+        try:
+            dob = datetime.strptime(dob_str, '%Y-%m-%d').date()
+        except ValueError:
+            flash('Invalid date format for Date of Birth.', 'danger')
+            return redirect(url_for('index'))
+
+        patient, _ = find_patient(email=email, phone=phone, first_name=first_name, last_name=last_name,
+                                  date_of_birth=dob, require_contact=True)
         if not patient:
-            # Generate new Patient ID
-            last_patient = Patient.query.order_by(Patient.id.desc()).first()
-            next_num = 1
-            if last_patient and last_patient.patient_id and last_patient.patient_id.startswith('PAT'):
-                try:
-                    next_num = int(last_patient.patient_id[3:]) + 1
-                except ValueError:
-                    pass
-            
-            new_patient_id = f"PAT{str(next_num).zfill(4)}"
-            
             # Create new patient
-            try:
-                dob = datetime.strptime(dob_str, '%Y-%m-%d').date()
-            except ValueError:
-                flash('Invalid date format for Date of Birth.', 'danger')
-                return redirect(url_for('index'))
+            new_patient_id = next_patient_id()
 
             patient = Patient(
                 patient_id=new_patient_id,
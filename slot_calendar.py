@@ -0,0 +1,295 @@
+"""
+Per-doctor appointment slot calendar.
+
+Each (doctor, day) pair has one row in doctor_slot_calendar with two
+bitmaps of the day's SLOT_MINUTES slots (48 of 30 minutes, so a BIGINT
+holds each):
+
+  open_mask    slots that start and end inside one of the doctor's shifts
+  booked_mask  slots taken by a confirmed appointment (doctor, preferred
+               date and a parseable preferred_time)
+
+A slot is free when it is open and not booked, so an availability check
+(is_free, or free_doctors for all routing candidates at once) is one indexed
+row read per doctor and a bit test, and next_free_slots scans one row per
+doctor and day instead of shifts and appointments. Doctor allocation only
+picks a doctor whose requested slot is free when any candidate has it.
+
+Rows are built from shifts and confirmed appointments the first time a
+(doctor, day) is touched and then kept current incrementally: book() claims
+a slot with a conditional UPDATE (open_mask & bit != 0 and booked_mask &
+bit = 0), so a slot outside the doctor's shifts is never booked and two
+concurrent bookings of the same slot cannot both succeed; release() frees
+it on cancellation, and add_shift() opens a new shift's slots. None of them
+commit; the caller commits with its own change. Appointment changes that
+bypass these calls leave the rows stale until they are cleared with:
+
+  python slot_calendar.py
+"""
+
+import logging
+from datetime import datetime, timedelta
+
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+SLOT_MINUTES = 30
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+TIME_FORMATS = ('%H:%M', '%H:%M:%S', '%I:%M %p')
+
+
+def parse_time(text):
+    for fmt in TIME_FORMATS:
+        try:
+            return datetime.strptime(text.strip(), fmt).time()
+        except (AttributeError, ValueError):
+            continue
+    return None
+
+
+def slot_index(when):
+    """Slot containing a time of day"""
+    return (when.hour * 60 + when.minute) // SLOT_MINUTES
+
+
+def slot_start(day, index):
+    return datetime.combine(day, datetime.min.time()) + timedelta(minutes=index * SLOT_MINUTES)
+
+
+def requested_start(appt):
+    """When an appointment asks to start (preferred date and time), or None if it has no time"""
+    if not appt.preferred_date:
+        return None
+    when = parse_time(appt.preferred_time) if appt.preferred_time else None
+    if when is None:
+        # A preferred_date given with a time of day carries the time itself
+        when = appt.preferred_date.time()
+        if when == datetime.min.time():
+            return None
+    return datetime.combine(appt.preferred_date.date(), when)
+
+
+def appointment_slot(appt):
+    """(doctor_id, day, slot index) an appointment occupies, or None if it has no timed slot"""
+    start = requested_start(appt)
+    if not appt.doctor_id or start is None:
+        return None
+    return appt.doctor_id, start.date(), slot_index(start)
+
+
+def span_mask(start, end, day):
+    """Bits of the slots on `day` lying wholly within [start, end)"""
+    midnight = datetime.combine(day, datetime.min.time())
+    first = max(0, -(-int((start - midnight).total_seconds()) // (SLOT_MINUTES * 60)))
+    last = min(SLOTS_PER_DAY, int((end - midnight).total_seconds()) // (SLOT_MINUTES * 60))
+    if last <= first:
+        return 0
+    return ((1 << (last - first)) - 1) << first
+
+
+def iter_bits(mask):
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+def build_masks(doctor_ids, days):
+    """{(doctor_id, day): [open_mask, booked_mask]} from shifts and confirmed appointments"""
+    from database import db
+    from models import AppointmentRequest, Shift
+
+    masks = {(doctor_id, day): [0, 0] for doctor_id in doctor_ids for day in days}
+    since = datetime.combine(min(days), datetime.min.time())
+    until = datetime.combine(max(days), datetime.min.time()) + timedelta(days=1)
+
+    for staff_id, start_time, end_time in db.session.query(
+        Shift.staff_id, Shift.start_time, Shift.end_time
+    ).filter(
+        Shift.staff_id.in_(doctor_ids),
+        Shift.start_time < until,
+        Shift.end_time > since
+    ):
+        # Night shifts cover two days
+        day = start_time.date()
+        while day <= end_time.date():
+            if (staff_id, day) in masks:
+                masks[(staff_id, day)][0] |= span_mask(start_time, end_time, day)
+            day += timedelta(days=1)
+
+    for appt in db.session.query(AppointmentRequest).filter(
+        AppointmentRequest.doctor_id.in_(doctor_ids),
+        AppointmentRequest.status == 'confirmed',
+        AppointmentRequest.preferred_date >= since,
+        AppointmentRequest.preferred_date < until
+    ):
+        slot = appointment_slot(appt)
+        if slot and slot[:2] in masks:
+            masks[slot[:2]][1] |= 1 << slot[2]
+    return masks
+
+
+class SlotCalendar:
+    def __init__(self):
+        self.stats = {'rows_built': 0, 'booked': 0, 'conflicts': 0, 'released': 0}
+
+    def rows(self, doctor_ids, days):
+        """{(doctor_id, day): DoctorSlotCalendar}, building any missing rows"""
+        from sqlalchemy.exc import IntegrityError
+        from database import db
+        from models import DoctorSlotCalendar
+
+        doctor_ids, days = list(doctor_ids), list(days)
+        if not doctor_ids or not days:
+            return {}
+
+        def load():
+            return {(row.doctor_id, row.day): row for row in DoctorSlotCalendar.query.filter(
+                DoctorSlotCalendar.day.in_(days),
+                DoctorSlotCalendar.doctor_id.in_(doctor_ids)
+            )}
+
+        found, attempts = load(), 0
+        while True:
+            missing = [(d, day) for d in doctor_ids for day in days if (d, day) not in found]
+            if not missing:
+                return found
+            if attempts == 3:
+                raise RuntimeError(f"Could not build {len(missing)} slot calendar rows")
+            attempts += 1
+            masks = build_masks(sorted({d for d, _ in missing}), sorted({day for _, day in missing}))
+            try:
+                with db.session.begin_nested():
+                    for key in missing:
+                        open_mask, booked_mask = masks[key]
+                        db.session.add(DoctorSlotCalendar(doctor_id=key[0], day=key[1],
+                                                          open_mask=open_mask, booked_mask=booked_mask))
+                self.stats['rows_built'] += len(missing)
+            except IntegrityError:
+                # Another worker built some of them first; theirs are equivalent.
+                # The savepoint dropped ours as well, so insert the rest again.
+                pass
+            found = load()
+
+    def free_doctors(self, doctor_ids, when):
+        """The doctors among `doctor_ids` whose slot at `when` is open and not booked"""
+        day, bit = when.date(), 1 << slot_index(when)
+        rows = self.rows(doctor_ids, [day])
+        return {doctor_id for doctor_id in doctor_ids
+                if (rows[(doctor_id, day)].open_mask or 0) & bit and not (rows[(doctor_id, day)].booked_mask or 0) & bit}
+
+    def is_free(self, doctor_id, when):
+        """One indexed row read and a bit test"""
+        return doctor_id in self.free_doctors([doctor_id], when)
+
+    def _update(self, doctor_id, day, **where_and_values):
+        from sqlalchemy import update
+        from database import db
+        from models import DoctorSlotCalendar
+
+        self.rows([doctor_id], [day])
+        where = where_and_values.pop('where', [])
+        return db.session.execute(update(DoctorSlotCalendar).where(
+            DoctorSlotCalendar.doctor_id == doctor_id,
+            DoctorSlotCalendar.day == day,
+            *where
+        ).values(**where_and_values)).rowcount
+
+    def book(self, appt):
+        """Claim the appointment's slot; False if it is taken or outside the doctor's shifts"""
+        from models import DoctorSlotCalendar
+
+        slot = appointment_slot(appt)
+        if slot is None:
+            return True
+        doctor_id, day, index = slot
+        bit = 1 << index
+        claimed = self._update(doctor_id, day,
+                               where=[DoctorSlotCalendar.open_mask.op('&')(bit) != 0,
+                                      DoctorSlotCalendar.booked_mask.op('&')(bit) == 0],
+                               booked_mask=DoctorSlotCalendar.booked_mask.op('|')(bit))
+        self.stats['booked' if claimed else 'conflicts'] += 1
+        return bool(claimed)
+
+    def release(self, appt):
+        from models import DoctorSlotCalendar
+
+        slot = appointment_slot(appt)
+        if slot is None:
+            return
+        doctor_id, day, index = slot
+        self._update(doctor_id, day, booked_mask=DoctorSlotCalendar.booked_mask.op('&')(~(1 << index)))
+        self.stats['released'] += 1
+
+    def add_shift(self, shift):
+        from models import DoctorSlotCalendar
+
+        day = shift.start_time.date()
+        while day <= shift.end_time.date():
+            mask = span_mask(shift.start_time, shift.end_time, day)
+            if mask:
+                self._update(shift.staff_id, day, open_mask=DoctorSlotCalendar.open_mask.op('|')(mask))
+            day += timedelta(days=1)
+
+    def next_free_slots(self, department=None, n=5, after=None, days=14):
+        """The first n free (slot, doctor) pairs after `after` among allocate_doctor's candidates"""
+        from models import StaffMember
+
+        after = after or datetime.now()
+        query = StaffMember.query.filter(StaffMember.role == 'doctor', StaffMember.is_active == True)
+        if department:
+            query = query.filter((StaffMember.department == department) |
+                                 (StaffMember.specialization.ilike(f'%{department}%')))
+        doctors = {d.id: d for d in query.order_by(StaffMember.id)}
+        day_list = [after.date() + timedelta(days=i) for i in range(days)]
+        rows = self.rows(doctors, day_list)
+
+        slots = []
+        for day in day_list:
+            # Slots already started today are not offered
+            not_before = slot_index(after) + 1 if day == after.date() else 0
+            candidates = []
+            for doctor_id in doctors:
+                row = rows[(doctor_id, day)]
+                free = (row.open_mask or 0) & ~(row.booked_mask or 0) & ~((1 << not_before) - 1)
+                candidates.extend((index, doctor_id) for index in iter_bits(free))
+            for index, doctor_id in sorted(candidates):
+                start = slot_start(day, index)
+                slots.append({
+                    'doctor_id': doctor_id,
+                    'doctor_name': doctors[doctor_id].full_name,
+                    'start': start.isoformat(),
+                    'date': day.isoformat(),
+                    'time': start.strftime('%H:%M'),
+                })
+                if len(slots) >= n:
+                    return slots
+        return slots
+
+    def report(self):
+        return {**self.stats, 'slot_minutes': SLOT_MINUTES}
+
+
+def clear(since=None):
+    """Drop calendar rows (from `since` on) so they are rebuilt on next use"""
+    from sqlalchemy import delete
+    from database import db
+    from models import DoctorSlotCalendar
+
+    statement = delete(DoctorSlotCalendar)
+    if since:
+        statement = statement.where(DoctorSlotCalendar.day >= since)
+    removed = db.session.execute(statement).rowcount
+    db.session.commit()
+    return removed
+
+
+slot_calendar = SlotCalendar()
+
+
+if __name__ == "__main__":
+    from app import app
+
+    with app.app_context():
+        removed = clear()
+        print(f"Cleared {removed} slot calendar rows; they are rebuilt on next use.")
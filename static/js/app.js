@@ -156,6 +156,51 @@ function acknowledgeAlert(alertId) {
     });
 }
 
+function bulkAcknowledgeAlerts(selection) {
+    // selection: {alert_ids: [...]}, {patient_id: id} or {scope: 'mine', max_severity: 'warning'}
+    return fetch('/api/alerts/acknowledge', {
+        method: 'POST',
+        credentials: 'same-origin',
+        headers: {
+            'Content-Type': 'application/json',
+            'X-Requested-With': 'XMLHttpRequest'
+        },
+        body: JSON.stringify(selection)
+    }).then(resp => resp.json()).then(result => {
+        if (result.ok) {
+            markAlertsAcknowledged(result.alert_ids);
+        }
+        return result;
+    });
+}
+
+function markAlertsAcknowledged(alertIds) {
+    (alertIds || []).forEach(alertId => {
+        const el = document.querySelector(`.alert-item[data-alert-id="${alertId}"]`);
+        if (el) {
+            el.classList.add('acknowledged');
+            el.style.opacity = '0.6';
+        }
+    });
+}
+
+document.addEventListener('DOMContentLoaded', function() {
+    document.querySelectorAll('.bulk-ack-btn').forEach(btn => {
+        btn.addEventListener('click', function() {
+            btn.disabled = true;
+            bulkAcknowledgeAlerts({scope: 'mine', max_severity: btn.dataset.maxSeverity})
+                .then(result => showToast(`Acknowledged ${result.acknowledged || 0} alert(s)`, 'success'))
+                .catch(() => showToast('Could not acknowledge alerts', 'danger'))
+                .finally(() => { btn.disabled = false; });
+        });
+    });
+});
+
+if (typeof window !== 'undefined') {
+    window.bulkAcknowledgeAlerts = bulkAcknowledgeAlerts;
+    window.markAlertsAcknowledged = markAlertsAcknowledged;
+}
+
 function showToast(message, type = 'info') {
     const container = document.getElementById('alertContainer') || document.body;
     
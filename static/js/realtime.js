@@ -16,11 +16,41 @@ document.addEventListener('DOMContentLoaded', function() {
 
         socket.on('new_alert', function(data) {
             console.log('New Alert:', data);
+            // Report receipt so the server can measure vital-to-nurse latency
+            socket.emit('alert_received', {id: data.id, escalation_tier: data.escalation_tier || 0});
             handleNewAlert(data);
         });
+
+        socket.on('risk_ai_update', function(data) {
+            console.log('AI risk note:', data);
+            showRiskAiNote(data);
+        });
+
+        socket.on('alerts_acknowledged', function(data) {
+            console.log('Alerts acknowledged:', data);
+            if (typeof markAlertsAcknowledged === 'function') {
+                markAlertsAcknowledged(data.alert_ids);
+            }
+        });
     }
 });
 
+function showRiskAiNote(data) {
+    // Risk analysis page: AI advice arrives after the rule-based result
+    const panel = document.querySelector(`.ai-risk-note[data-patient-id="${data.patient_id}"]`);
+    if (!panel) return;
+    panel.querySelector('.ai-risk-note-text').textContent = data.note || '';
+    const level = panel.querySelector('.ai-risk-note-level');
+    if (level) {
+        level.textContent = data.suggested_level
+            ? `Suggested: ${data.suggested_level}${data.suggested_score != null ? ` (score ${data.suggested_score})` : ''}`
+            : '';
+    }
+    panel.classList.remove('d-none');
+    const pending = document.querySelector(`.ai-risk-pending[data-patient-id="${data.patient_id}"]`);
+    if (pending) pending.classList.add('d-none');
+}
+
 function updatePatientCard(data) {
     // Find the patient card
     const card = document.querySelector(`.patient-card[data-patient-id="${data.patient_id}"]`);
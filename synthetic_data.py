@@ -50,10 +50,6 @@ def generate_staff_id(role, index):
     return f"{prefix.get(role, 'STF')}{str(index).zfill(4)}"
 
 
-def generate_patient_id(index):
-    return f"PAT{str(index).zfill(6)}"
-
-
 def create_admin():
     existing = StaffMember.query.filter_by(role='admin').first()
     if existing:
@@ -176,6 +172,8 @@ def create_ward_staff():
 
 
 def create_synthetic_patients(num_patients=5, num_discharged=0):
+    from id_sequence import next_patient_ids
+
     patients_created = []
     existing_count = Patient.query.count()
 
@@ -185,10 +183,12 @@ def create_synthetic_patients(num_patients=5, num_discharged=0):
     if not doctors or not nurses:
         return []
 
-    for i in range(existing_count + 1, existing_count + num_patients + 1):
+    # Same sequence as bookings, so seeding never takes an id a worker has
+    # reserved; taken before any patient is added to the session
+    patient_ids = next_patient_ids(num_patients)
+    for i, patient_id in enumerate(patient_ids, start=existing_count + 1):
         first_name = random.choice(FIRST_NAMES)
         last_name = random.choice(LAST_NAMES)
-        patient_id = generate_patient_id(i)
         
         if Patient.query.filter_by(patient_id=patient_id).first():
             continue
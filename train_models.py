@@ -0,0 +1,264 @@
+"""Train the risk ML models offline from the whole vital-sign history.
+
+Usage:
+  python train_models.py [--classifier rf|sgd] [--chunk-rows 50000]
+                         [--sample 200000] [--n-jobs -1] [--horizon 3]
+                         [--no-activate]
+
+VitalSign rows are streamed in (patient, time) order as plain tuples, in
+chunks of --chunk-rows, never as ORM objects. Each chunk becomes NumPy
+arrays; for every reading the last RISK_WINDOW readings of the same
+patient (carried over across chunk boundaries) are turned into the same
+mean/std/trend features the batch risk engine serves with, using the
+engine's own vectorised kernel.
+
+A sample is labelled 1 when one of the patient's next --horizon readings
+is critical, i.e. the models learn to anticipate deterioration.
+Patients with id % 5 == 0 are held out for validation.
+
+Memory stays bounded however long the history is:
+  - the StandardScaler is fitted with partial_fit on every training row
+  - the IsolationForest and, with --classifier rf, the RandomForest are
+    fitted with n_jobs parallelism on a uniform reservoir sample of
+    --sample rows
+  - with --classifier sgd a logistic SGDClassifier is trained with
+    partial_fit over every training row in a second streaming pass
+
+Throughput of each pass and validation metrics are printed, and the
+models are saved to the model registry as a new version (activated
+unless --no-activate).
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+from sqlalchemy import case, select
+
+from predictive_analytics import RISK_WINDOW, VITAL_CHANNELS
+from risk_scoring import channel_stat_matrix
+from model_registry import feature_matrix, model_registry
+
+VALIDATION_MODULUS = 5
+
+
+class Reservoir:
+    """Uniform fixed-size sample of a stream of (X, y) rows (algorithm R, vectorised per chunk)"""
+
+    def __init__(self, capacity, n_features, seed=42):
+        self.capacity = capacity
+        self.X = np.empty((capacity, n_features))
+        self.y = np.empty(capacity, dtype=np.int64)
+        self.seen = 0
+        self.rng = np.random.default_rng(seed)
+
+    def add(self, X, y):
+        n = len(X)
+        fill = max(0, min(n, self.capacity - self.seen))
+        if fill:
+            self.X[self.seen:self.seen + fill] = X[:fill]
+            self.y[self.seen:self.seen + fill] = y[:fill]
+        if fill < n:
+            # Row number t (0-based) replaces a random slot with probability capacity / (t + 1)
+            t = self.seen + np.arange(fill, n)
+            slots = self.rng.integers(0, t + 1)
+            keep = slots < self.capacity
+            self.X[slots[keep]] = X[fill:][keep]
+            self.y[slots[keep]] = y[fill:][keep]
+        self.seen += n
+
+    def sample(self):
+        size = min(self.seen, self.capacity)
+        return self.X[:size], self.y[:size]
+
+
+def stream_chunks(chunk_rows):
+    """Yield (patient_id, critical, *channels) float arrays of up to chunk_rows readings"""
+    from app import db
+    from models import VitalSign
+
+    columns = [getattr(VitalSign, c) for c in VITAL_CHANNELS]
+    stmt = select(
+        VitalSign.patient_id,
+        case((VitalSign.status == 'critical', 1), else_=0),
+        *columns
+    ).order_by(VitalSign.patient_id, VitalSign.recorded_at, VitalSign.id)
+    result = db.session.execute(stmt.execution_options(yield_per=chunk_rows))
+    for rows in result.partitions():
+        yield np.array([tuple(np.nan if v is None else v for v in row) for row in rows], dtype=np.float64)
+
+
+def chunk_samples(buf, start, end, horizon):
+    """
+    Features and labels for rows [start, end) of `buf`; earlier rows give
+    window context and later rows the label horizon.
+    Returns (patient_ids, X, y) for readings with at least 3 rows of history.
+    """
+    pid = buf[:, 0]
+    targets = np.arange(start, end)
+    if len(targets) == 0:
+        return pid[:0], np.empty((0, 3 * len(VITAL_CHANNELS))), np.empty(0, dtype=np.int64)
+
+    # Window of each target, most recent first, restricted to the same patient
+    back = targets[:, None] - np.arange(RISK_WINDOW)[None, :]
+    in_window = back >= 0
+    back = np.where(in_window, back, 0)
+    in_window &= pid[back] == pid[targets][:, None]
+    row_counts = in_window.sum(axis=1)
+
+    stats = {}
+    for i, channel in enumerate(VITAL_CHANNELS):
+        values = np.where(in_window, buf[back, 2 + i], np.nan)
+        values[values == 0] = np.nan
+        stats[channel] = channel_stat_matrix(values)
+
+    ahead = targets[:, None] + np.arange(1, horizon + 1)[None, :]
+    in_horizon = ahead < len(buf)
+    ahead = np.where(in_horizon, ahead, 0)
+    in_horizon &= pid[ahead] == pid[targets][:, None]
+    y = (in_horizon & (buf[ahead, 1] == 1)).any(axis=1).astype(np.int64)
+
+    keep = row_counts >= 3
+    return pid[targets][keep], feature_matrix(stats)[keep], y[keep]
+
+
+def iter_samples(chunk_rows, horizon):
+    """Stream (patient_ids, X, y, raw_rows) per chunk, carrying window context and horizon across chunks"""
+    buf = None
+    start = 0
+    for chunk in stream_chunks(chunk_rows):
+        buf = chunk if buf is None else np.vstack([buf, chunk])
+        # The last `horizon` rows wait for their future readings in the next chunk
+        end = max(start, len(buf) - horizon)
+        pids, X, y = chunk_samples(buf, start, end, horizon)
+        yield pids, X, y, len(chunk)
+        keep_from = max(0, end - (RISK_WINDOW - 1))
+        buf = buf[keep_from:]
+        start = end - keep_from
+    if buf is not None and start < len(buf):
+        pids, X, y = chunk_samples(buf, start, len(buf), horizon)
+        yield pids, X, y, 0
+
+
+def split(pids, X, y):
+    held_out = pids.astype(np.int64) % VALIDATION_MODULUS == 0
+    return (X[~held_out], y[~held_out]), (X[held_out], y[held_out])
+
+
+def report_pass(name, rows, samples, seconds):
+    print(f"{name}: {rows:,} rows, {samples:,} samples in {seconds:.1f}s "
+          f"({rows / max(seconds, 1e-9):,.0f} rows/s, {samples / max(seconds, 1e-9):,.0f} samples/s)")
+
+
+def validation_metrics(classifier, anomaly, scaler, X, y):
+    from sklearn.metrics import f1_score, precision_score, recall_score, roc_auc_score
+
+    if len(X) == 0:
+        return {}
+    scaled = scaler.transform(X)
+    classes = list(classifier.classes_)
+    proba = classifier.predict_proba(scaled)[:, classes.index(1)] if 1 in classes else np.zeros(len(X))
+    predicted = (proba >= 0.5).astype(np.int64)
+    metrics = {
+        'samples': int(len(X)),
+        'positive_rate': round(float(y.mean()), 4),
+        'precision': round(float(precision_score(y, predicted, zero_division=0)), 4),
+        'recall': round(float(recall_score(y, predicted, zero_division=0)), 4),
+        'f1': round(float(f1_score(y, predicted, zero_division=0)), 4),
+        'anomaly_rate': round(float((anomaly.decision_function(scaled) < 0).mean()), 4),
+    }
+    if len(set(y.tolist())) == 2:
+        metrics['roc_auc'] = round(float(roc_auc_score(y, proba)), 4)
+    return metrics
+
+
+def train(args):
+    from sklearn.ensemble import IsolationForest, RandomForestClassifier
+    from sklearn.linear_model import SGDClassifier
+    from sklearn.preprocessing import StandardScaler
+
+    n_features = 3 * len(VITAL_CHANNELS)
+    scaler = StandardScaler()
+    train_sample = Reservoir(args.sample, n_features)
+    val_sample = Reservoir(max(1, args.sample // 4), n_features, seed=7)
+
+    started = time.perf_counter()
+    rows = samples = 0
+    for pids, X, y, chunk_len in iter_samples(args.chunk_rows, args.horizon):
+        rows += chunk_len
+        samples += len(X)
+        (X_train, y_train), (X_val, y_val) = split(pids, X, y)
+        if len(X_train):
+            scaler.partial_fit(X_train)
+            train_sample.add(X_train, y_train)
+        if len(X_val):
+            val_sample.add(X_val, y_val)
+    report_pass('Pass 1 (features, scaler, sampling)', rows, samples, time.perf_counter() - started)
+
+    X_sample, y_sample = train_sample.sample()
+    if len(X_sample) == 0 or len(set(y_sample.tolist())) < 2:
+        print('Not enough labelled history to train (need both deteriorating and stable samples).', file=sys.stderr)
+        return None
+    scaled_sample = scaler.transform(X_sample)
+
+    fit_started = time.perf_counter()
+    anomaly = IsolationForest(contamination=0.1, random_state=42, n_jobs=args.n_jobs).fit(scaled_sample)
+    if args.classifier == 'rf':
+        classifier = RandomForestClassifier(n_estimators=50, random_state=42, n_jobs=args.n_jobs)
+        classifier.fit(scaled_sample, y_sample)
+        fit_seconds = time.perf_counter() - fit_started
+        print(f"Fitted anomaly detector and random forest on {len(X_sample):,} sampled rows in {fit_seconds:.1f}s "
+              f"({len(X_sample) / max(fit_seconds, 1e-9):,.0f} samples/s)")
+    else:
+        classifier = SGDClassifier(loss='log_loss', random_state=42)
+        pass_started = time.perf_counter()
+        rows = samples = 0
+        for pids, X, y, chunk_len in iter_samples(args.chunk_rows, args.horizon):
+            rows += chunk_len
+            (X_train, y_train), _ = split(pids, X, y)
+            if len(X_train):
+                classifier.partial_fit(scaler.transform(X_train), y_train, classes=np.array([0, 1]))
+                samples += len(X_train)
+        report_pass('Pass 2 (SGD partial_fit)', rows, samples, time.perf_counter() - pass_started)
+    # Parallelism is for training only; a thread pool per single-patient
+    # prediction costs far more than the prediction itself
+    anomaly.set_params(n_jobs=None)
+    if 'n_jobs' in classifier.get_params():
+        classifier.set_params(n_jobs=None)
+
+    X_val, y_val = val_sample.sample()
+    metrics = validation_metrics(classifier, anomaly, scaler, X_val, y_val)
+    print('Validation: ' + ', '.join(f"{k}={v}" for k, v in metrics.items()))
+
+    meta = {
+        'classifier': args.classifier,
+        'label': f'critical reading within the next {args.horizon} readings',
+        'training_rows': int(train_sample.seen),
+        'sampled_rows': int(len(X_sample)),
+        'scaler_rows': int(scaler.n_samples_seen_),
+        'window': RISK_WINDOW,
+        'validation': metrics,
+        'training_seconds': round(time.perf_counter() - started, 1),
+    }
+    version = model_registry.save(scaler, anomaly, classifier, meta, activate=not args.no_activate)
+    print(f"Saved risk models version {version}{'' if args.no_activate else ' (active)'}")
+    return version
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Train the risk ML models from vital-sign history.')
+    parser.add_argument('--classifier', choices=['rf', 'sgd'], default='rf')
+    parser.add_argument('--chunk-rows', type=int, default=50000)
+    parser.add_argument('--sample', type=int, default=200000, help='reservoir size for the forest models')
+    parser.add_argument('--n-jobs', type=int, default=-1)
+    parser.add_argument('--horizon', type=int, default=3, help='readings ahead a critical reading counts as deterioration')
+    parser.add_argument('--no-activate', action='store_true')
+    args = parser.parse_args(argv)
+
+    from app import app
+    with app.app_context():
+        return train(args)
+
+
+if __name__ == '__main__':
+    sys.exit(0 if main() else 1)
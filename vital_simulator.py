@@ -1,5 +1,6 @@
 import random
 import logging
+import time
 from datetime import datetime
 
 logging.basicConfig(level=logging.DEBUG)
@@ -11,9 +12,15 @@ def update_patient_vitals():
     global new_alerts
     # Import inside function to avoid circular imports
     from app import app, db
-    from models import Patient, VitalSign, Alert, StaffMember
+    from models import Patient, VitalSign, StaffMember
     from synthetic_data import generate_vital_sign, check_vital_thresholds, create_alert
-    from alert_router import distribute_alerts_to_staff
+    from alert_router import distribute_alerts_to_staff, record_recipients
+    from alert_suppression import alert_suppressor
+    from alert_escalation import escalation_scheduler
+    from alert_latency import latency_tracker
+    from feature_store import feature_store
+    from ward_stats import ward_stats
+    from risk_cache import risk_cache
     
     with app.app_context():
         try:
@@ -35,8 +42,13 @@ def update_patient_vitals():
                     status_bias = random.choices(['critical', 'warning', None], weights=[5, 10, 85])[0]
                 
                 vital = generate_vital_sign(patient, status_bias)
+                ingest_at = time.time()
                 db.session.add(vital)
+                db.session.flush()
+                feature_store.ingest(vital)
                 db.session.commit()
+                risk_cache.on_vital(patient.id, vital.id)
+                ward_stats.ingest(vital, patient.department)
                 # Emit real-time update
                 try:
                     from app import socketio
@@ -48,29 +60,31 @@ def update_patient_vitals():
                         'oxygen': vital.oxygen_saturation,
                         'temperature': vital.temperature,
                         'status': vital.status,
+                        'news_score': vital.news_score,
                         'timestamp': vital.recorded_at.strftime('%H:%M:%S')
                     })
                 except Exception as e:
                     logging.error(f"Socket emit error: {e}")
 
                 alert_data = check_vital_thresholds(vital)
+                evaluated_at = time.time()
                 for alert in alert_data:
-                    alert_obj = Alert(
-                        patient_id=patient.id,
-                        vital_sign_id=vital.id,
-                        alert_type=alert['type'],
-                        severity=alert['severity'],
-                        title=alert['title'],
-                        message=alert['message']
+                    # Repeat breaches are folded into the open alert; nothing to route
+                    alert_obj = alert_suppressor.record_breach(patient.id, vital.id, alert)
+                    if alert_obj is None:
+                        continue
+                    latency_tracker.begin(
+                        alert_obj.id, alert_obj.severity, patient.department,
+                        ingest=ingest_at, evaluated=evaluated_at, inserted=time.time()
                     )
-                    db.session.add(alert_obj)
-                    db.session.commit()
                     
                     recipients = distribute_alerts_to_staff(
                         patient.id,
                         alert['severity'],
                         alert_obj.id
                     )
+                    record_recipients(alert_obj.id, recipients)
+                    latency_tracker.mark(alert_obj.id, 'routed')
                     
                     # Emit alert event only to assigned staff
                     try:
@@ -94,6 +108,13 @@ def update_patient_vitals():
                             
                     except Exception as e:
                         logging.error(f"Socket alert emit error: {e}")
+                    latency_tracker.mark(alert_obj.id, 'emitted')
+
+                    escalation_scheduler.schedule(
+                        alert_obj.id,
+                        alert_obj.severity,
+                        notified_ids=[r.id for r in recipients]
+                    )
 
                     routing_path = []
                     if recipients:
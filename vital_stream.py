@@ -0,0 +1,175 @@
+"""
+Online per-patient estimators for the risk model.
+
+Every vital channel of a patient keeps a small running state that is
+updated in O(1) when a reading is ingested:
+
+- the last RISK_WINDOW readings (the risk model's window), with a sliding
+  Welford mean/variance over the non-missing values in it
+- a least-squares slope over the most recent TREND_WINDOW readings
+- an exponentially weighted moving average over the whole stream
+
+The state is part of the patient's feature-store row (feature_store.py),
+updated in the same ingest and the same transaction as the vital itself.
+analyze_patient_risk reads it (feature_store.risk_stats) instead of
+refitting the history. A state that is missing or behind the latest vital
+(e.g. after bulk seeding) is rebuilt from the last RISK_WINDOW rows, so the
+cost never depends on history depth.
+
+EWMA smoothing is configured with VITAL_EWMA_ALPHA (default 0.3).
+"""
+
+import logging
+import math
+import os
+
+from predictive_analytics import RISK_WINDOW, STAT_DECIMALS, TREND_WINDOW, VITAL_CHANNELS
+
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+EWMA_ALPHA = float(os.environ.get('VITAL_EWMA_ALPHA', '0.3'))
+
+
+def window_slope(values):
+    """Least-squares slope of `values` (chronological) against 0..k-1"""
+    k = len(values)
+    if k < 2:
+        return 0.0
+    x_mean = (k - 1) / 2.0
+    y_mean = sum(values) / k
+    sxy = sum((i - x_mean) * (y - y_mean) for i, y in enumerate(values))
+    sxx = sum((i - x_mean) ** 2 for i in range(k))
+    return sxy / sxx
+
+
+class ChannelEstimator:
+    """Running statistics for one vital channel; None marks a missing reading"""
+
+    def __init__(self, window=RISK_WINDOW, trend_window=TREND_WINDOW, alpha=EWMA_ALPHA):
+        self.window = window
+        self.trend_window = trend_window
+        self.alpha = alpha
+        self.values = []  # last `window` readings, oldest first
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.slope = 0.0
+        self.ewma = None
+
+    def push(self, value):
+        value = float(value) if value else None
+        self.values.append(value)
+        if value is not None:
+            self._add(value)
+            self.ewma = value if self.ewma is None else self.alpha * value + (1 - self.alpha) * self.ewma
+        if len(self.values) > self.window:
+            dropped = self.values.pop(0)
+            if dropped is not None:
+                self._remove(dropped)
+        self.slope = window_slope(self._recent())
+
+    def _add(self, x):
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (x - self.mean)
+
+    def _remove(self, x):
+        if self.n <= 1:
+            self.n, self.mean, self.m2 = 0, 0.0, 0.0
+            return
+        old_mean = self.mean
+        self.n -= 1
+        self.mean -= (x - old_mean) / self.n
+        self.m2 = max(0.0, self.m2 - (x - old_mean) * (x - self.mean))
+
+    def _recent(self):
+        recent = []
+        for value in reversed(self.values):
+            if value is not None:
+                recent.append(value)
+                if len(recent) == self.trend_window:
+                    break
+        recent.reverse()
+        return recent
+
+    def stats(self):
+        """Same shape as RiskPredictor.channel_stats, or None with no readings in the window"""
+        if self.n == 0:
+            return None
+        return {
+            'avg': round(self.mean, STAT_DECIMALS),
+            'std': round(math.sqrt(self.m2 / self.n), STAT_DECIMALS),
+            'trend': round(self.slope, STAT_DECIMALS),
+            'count': self.n,
+            'ewma': round(self.ewma, STAT_DECIMALS) if self.ewma is not None else None,
+        }
+
+    def to_dict(self):
+        return {'v': self.values, 'n': self.n, 'mean': self.mean, 'm2': self.m2,
+                'slope': self.slope, 'ewma': self.ewma}
+
+    @classmethod
+    def from_dict(cls, data):
+        est = cls()
+        est.values = list(data['v'])
+        est.n = data['n']
+        est.mean = data['mean']
+        est.m2 = data['m2']
+        est.slope = data['slope']
+        est.ewma = data['ewma']
+        return est
+
+
+class PatientEstimators:
+    def __init__(self, channels=None, rows=0):
+        self.channels = channels or {c: ChannelEstimator() for c in VITAL_CHANNELS}
+        self.rows = rows  # readings seen, capped at RISK_WINDOW
+
+    def push(self, vital):
+        for channel, est in self.channels.items():
+            est.push(getattr(vital, channel))
+        self.rows = min(self.rows + 1, RISK_WINDOW)
+
+    def stats(self):
+        return {channel: est.stats() for channel, est in self.channels.items()}
+
+    def to_dict(self):
+        return {'rows': self.rows, 'ch': {c: e.to_dict() for c, e in self.channels.items()}}
+
+    @classmethod
+    def from_dict(cls, data):
+        channels = {c: ChannelEstimator.from_dict(d) for c, d in data['ch'].items()}
+        return cls(channels, data['rows'])
+
+
+def latest_vital_id(patient_id):
+    """Id of the patient's most recent reading (by recorded_at, then id), or None"""
+    from app import db
+    from models import VitalSign
+
+    return db.session.query(VitalSign.id).filter_by(patient_id=patient_id).order_by(
+        VitalSign.recorded_at.desc(), VitalSign.id.desc()
+    ).limit(1).scalar()
+
+
+def latest_vital_ids(patient_ids):
+    """{patient_id: latest_vital_id(patient_id)} for patients with any vitals, one query per ID_CHUNK ids"""
+    from sqlalchemy import func, select
+    from app import db
+    from models import VitalSign
+    from risk_scoring import ID_CHUNK
+
+    rn = func.row_number().over(
+        partition_by=VitalSign.patient_id,
+        order_by=(VitalSign.recorded_at.desc(), VitalSign.id.desc())
+    ).label('rn')
+    patient_ids = sorted(set(patient_ids))
+    latest = {}
+    for start in range(0, len(patient_ids), ID_CHUNK):
+        ranked = select(VitalSign.patient_id, VitalSign.id, rn).where(
+            VitalSign.patient_id.in_(patient_ids[start:start + ID_CHUNK])
+        ).subquery()
+        latest.update(db.session.execute(select(ranked.c.patient_id, ranked.c.id).where(ranked.c.rn == 1)).all())
+    return latest
@@ -0,0 +1,246 @@
+"""
+Batched anomaly detection on recent readings, one IsolationForest per ward.
+
+A scheduled job (every WARD_ANOMALY_INTERVAL_SECONDS, default 120, 0
+disables) scores the readings each ward received since the previous cycle,
+up to WARD_ANOMALY_LOOKBACK_MINUTES back (default 15), as one
+(readings x vitals) matrix in a single decision_function call. Each ward
+has its own IsolationForest fitted on a sample of at most
+WARD_ANOMALY_FIT_SAMPLE readings (default 5000) from its last
+WARD_ANOMALY_HISTORY_HOURS (default 24), refitted every
+WARD_ANOMALY_REFIT_MINUTES (default 60), so "unusual" means unusual for
+that ward's population.
+
+A reading scoring below WARD_ANOMALY_THRESHOLD (default -0.1) is flagged.
+Only a patient's most anomalous reading per cycle becomes a 'vital_anomaly'
+alert, and it goes through alert_suppressor, so a patient who stays
+anomalous folds into their open alert instead of re-alerting; new alerts
+are routed, emitted and armed for escalation like threshold alerts.
+
+Each cycle stops starting new wards once WARD_ANOMALY_BUDGET_SECONDS
+(default 10) are spent, and the next cycle resumes with the wards it
+skipped, so every ward is covered within a few cycles however large the
+census. Like the risk sweep, only the holder of the 'ward_anomaly' lease
+runs the job.
+"""
+
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from model_registry import DEFAULT_VITALS
+from predictive_analytics import VITAL_CHANNELS
+from risk_scheduler import DbLease
+from ward_stats import UNASSIGNED_WARD
+
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+MIN_FIT_READINGS = 50
+
+
+def reading_matrix(rows):
+    """(readings x channels) float matrix; missing values take the channel default"""
+    X = np.array([[np.nan if v is None else v for v in row] for row in rows], dtype=np.float64)
+    if len(X):
+        defaults = np.array([DEFAULT_VITALS[c] for c in VITAL_CHANNELS])
+        X = np.where(np.isnan(X) | (X == 0), defaults, X)
+    return X.reshape(-1, len(VITAL_CHANNELS))
+
+
+class WardModel:
+    def __init__(self, forest, fitted_at, readings):
+        self.forest = forest
+        self.fitted_at = fitted_at
+        self.readings = readings
+
+
+class WardAnomalyDetector:
+    def __init__(self):
+        self.interval_seconds = int(os.environ.get('WARD_ANOMALY_INTERVAL_SECONDS', '120'))
+        self.lookback = timedelta(minutes=int(os.environ.get('WARD_ANOMALY_LOOKBACK_MINUTES', '15')))
+        self.history = timedelta(hours=int(os.environ.get('WARD_ANOMALY_HISTORY_HOURS', '24')))
+        self.refit_after = timedelta(minutes=int(os.environ.get('WARD_ANOMALY_REFIT_MINUTES', '60')))
+        self.fit_sample = int(os.environ.get('WARD_ANOMALY_FIT_SAMPLE', '5000'))
+        self.threshold = float(os.environ.get('WARD_ANOMALY_THRESHOLD', '-0.1'))
+        self.budget_seconds = float(os.environ.get('WARD_ANOMALY_BUDGET_SECONDS', '10'))
+        self.lease = DbLease('ward_anomaly', 3 * max(self.interval_seconds, 1))
+        self._models = {}  # ward -> WardModel
+        self._scored_up_to = {}  # ward -> highest vital id scored
+        self._deferred = []  # wards skipped by the last cycle's budget, served first
+        self._scheduler = None
+        self._lock = threading.Lock()
+        self.stats = {'cycles': 0, 'readings_scored': 0, 'flagged': 0, 'alerts': 0, 'fits': 0,
+                      'wards_deferred': 0, 'last_duration_seconds': None, 'failed': 0}
+
+    def start(self):
+        """Start the interval job once per process"""
+        if self.interval_seconds <= 0 or self._scheduler is not None:
+            return
+        with self._lock:
+            if self._scheduler is not None:
+                return
+            from apscheduler.schedulers.background import BackgroundScheduler
+
+            scheduler = BackgroundScheduler(daemon=True)
+            scheduler.add_job(self.run_once, 'interval', seconds=self.interval_seconds, id='ward_anomaly',
+                              max_instances=1, coalesce=True)
+            scheduler.start()
+            self._scheduler = scheduler
+
+    def run_once(self):
+        from app import app, db
+
+        with app.app_context():
+            try:
+                if not self.lease.acquire():
+                    return False
+                self.run_cycle()
+                return True
+            except Exception as e:
+                db.session.rollback()
+                self.stats['failed'] += 1
+                logger.error(f"Ward anomaly cycle failed: {e}")
+                return False
+
+    def run_cycle(self):
+        """Score every ward that fits in the budget; returns the alerts created"""
+        from app import db
+        from models import Patient
+
+        started = time.monotonic()
+        wards = sorted({d or UNASSIGNED_WARD for (d,) in db.session.query(Patient.department).filter(
+            Patient.status.in_(['admitted', 'icu', 'emergency'])
+        ).distinct()})
+        order = [w for w in self._deferred if w in wards] + [w for w in wards if w not in self._deferred]
+
+        alerts, deferred = [], []
+        for i, ward in enumerate(order):
+            if time.monotonic() - started > self.budget_seconds:
+                deferred = order[i:]
+                break
+            alerts.extend(self.score_ward(ward))
+        self._deferred = deferred
+        self.stats['wards_deferred'] += len(deferred)
+        self.stats['cycles'] += 1
+        self.stats['last_duration_seconds'] = round(time.monotonic() - started, 3)
+        if deferred:
+            logger.info(f"Ward anomaly budget spent; {len(deferred)} wards deferred to the next cycle")
+        return alerts
+
+    def _ward_readings(self, ward, since, after_id=0, limit=None):
+        from app import db
+        from models import Patient, VitalSign
+
+        ward_filter = Patient.department.is_(None) if ward == UNASSIGNED_WARD else Patient.department == ward
+        query = db.session.query(
+            VitalSign.id, VitalSign.patient_id, *[getattr(VitalSign, c) for c in VITAL_CHANNELS]
+        ).join(Patient, Patient.id == VitalSign.patient_id).filter(
+            ward_filter, VitalSign.recorded_at >= since, VitalSign.id > after_id
+        ).order_by(VitalSign.id.desc())
+        if limit:
+            query = query.limit(limit)
+        return query.all()
+
+    def model_for(self, ward, now):
+        model = self._models.get(ward)
+        if model is not None and now - model.fitted_at < self.refit_after:
+            return model
+        from sklearn.ensemble import IsolationForest
+
+        # The most recent history; id order stands in for time order
+        rows = self._ward_readings(ward, now - self.history, limit=self.fit_sample)
+        if len(rows) < MIN_FIT_READINGS:
+            return model
+        forest = IsolationForest(n_estimators=100, random_state=42, n_jobs=1)
+        forest.fit(reading_matrix([row[2:] for row in rows]))
+        model = self._models[ward] = WardModel(forest, now, len(rows))
+        self.stats['fits'] += 1
+        return model
+
+    def score_ward(self, ward):
+        now = datetime.now()
+        rows = self._ward_readings(ward, now - self.lookback, after_id=self._scored_up_to.get(ward, 0))
+        if not rows:
+            return []
+        model = self.model_for(ward, now)
+        if model is None:
+            return []
+        self._scored_up_to[ward] = rows[0][0]
+
+        scores = model.forest.decision_function(reading_matrix([row[2:] for row in rows]))
+        self.stats['readings_scored'] += len(rows)
+        flagged = np.flatnonzero(scores < self.threshold)
+        self.stats['flagged'] += len(flagged)
+
+        worst = {}  # patient_id -> (score, row)
+        for i in flagged:
+            patient_id = rows[i][1]
+            if patient_id not in worst or scores[i] < worst[patient_id][0]:
+                worst[patient_id] = (float(scores[i]), rows[i])
+        alerts = []
+        for patient_id, (score, row) in worst.items():
+            alert = self.raise_alert(patient_id, row, score, ward)
+            if alert is not None:
+                alerts.append(alert)
+        return alerts
+
+    def raise_alert(self, patient_id, row, score, ward):
+        from app import db
+        from models import Patient
+        from alert_escalation import escalation_scheduler
+        from alert_router import distribute_alerts_to_staff, record_recipients
+        from alert_suppression import alert_suppressor
+
+        patient = db.session.get(Patient, patient_id)
+        values = ', '.join(f"{c.replace('_', ' ')} {v:g}" for c, v in zip(VITAL_CHANNELS, row[2:]) if v)
+        alert = alert_suppressor.record_breach(patient_id, row[0], {
+            'type': 'vital_anomaly',
+            'severity': 'warning',
+            'title': f"Unusual Vital Pattern - {patient.full_name}",
+            'message': f"Reading unlike the {ward} ward's recent readings (anomaly score {score:.2f}): {values}. "
+                       f"Room {patient.room_number}, Bed {patient.bed_number}.",
+        })
+        if alert is None:
+            return None
+        self.stats['alerts'] += 1
+
+        recipients = distribute_alerts_to_staff(patient_id, alert.severity, alert.id)
+        record_recipients(alert.id, recipients)
+        try:
+            from app import socketio
+            payload = {
+                'id': alert.id,
+                'patient_id': patient_id,
+                'patient_name': patient.full_name,
+                'title': alert.title,
+                'message': alert.message,
+                'severity': alert.severity,
+                'room': patient.room_number,
+                'bed': patient.bed_number
+            }
+            for recipient in recipients:
+                socketio.emit('new_alert', payload, to=f"staff_{recipient.id}")
+        except Exception as e:
+            logger.error(f"Socket alert emit error: {e}")
+        escalation_scheduler.schedule(alert.id, alert.severity, notified_ids=[r.id for r in recipients])
+        return alert
+
+    def report(self):
+        return {
+            **self.stats,
+            'interval_seconds': self.interval_seconds,
+            'budget_seconds': self.budget_seconds,
+            'threshold': self.threshold,
+            'running': self._scheduler is not None,
+            'models': {ward: {'fitted_at': m.fitted_at.isoformat(), 'readings': m.readings}
+                       for ward, m in self._models.items()},
+            'deferred_wards': list(self._deferred),
+        }
+
+
+ward_anomaly_detector = WardAnomalyDetector()
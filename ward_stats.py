@@ -0,0 +1,333 @@
+"""
+Streaming distribution sketches of vital signs per ward.
+
+Percentiles of, say, SpO2 across a ward used to need a scan of
+vital_signs. Instead every ingested reading is added to a t-digest for its
+(ward, channel, hour) and the digests are persisted in
+ward_vital_sketches. A t-digest keeps at most a few hundred weighted
+centroids whatever the number of readings, estimates quantiles with the
+best accuracy at the tails, and two digests merge into one, so:
+
+  percentiles(channel, ...)  merges the requested wards and hours and reads
+                             quantiles from the result; the cost depends on
+                             the number of rows merged, not on readings
+  drift(channel, ...)        compares two periods' distributions (largest
+                             CDF gap, i.e. a Kolmogorov-Smirnov distance)
+                             as a population drift signal for the risk models
+
+The ward is the patient's department. Each process accumulates the
+readings it ingests in memory and a background thread merges them into the
+stored rows every WARD_STATS_FLUSH_SECONDS (default 60); rows are locked
+while merging so concurrent flushes from several processes add up. Until a
+flush, a process's own recent readings are not visible to queries.
+
+Existing history is loaded with:
+
+  python ward_stats.py
+"""
+
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+from predictive_analytics import VITAL_CHANNELS
+
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+COMPRESSION = 100
+BUCKET_SECONDS = 3600
+UNASSIGNED_WARD = 'Unassigned'
+
+
+class TDigest:
+    """Merging t-digest (Dunning); centroids are [mean, weight] sorted by mean"""
+
+    def __init__(self, compression=COMPRESSION, centroids=None, count=0, low=None, high=None):
+        self.compression = compression
+        self.centroids = centroids or []
+        self.count = count
+        self.min = low
+        self.max = high
+        self._buffer = []
+
+    def add(self, value, weight=1):
+        self._buffer.append([value, weight])
+        self.count += weight
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        if len(self._buffer) > 5 * self.compression:
+            self.compress()
+
+    def merge(self, other):
+        other.compress()
+        if not other.count:
+            return self
+        self._buffer.extend([m, w] for m, w in other.centroids)
+        self.count += other.count
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+        self.compress()
+        return self
+
+    def compress(self):
+        if not self._buffer:
+            return
+        points = sorted(self.centroids + self._buffer)
+        self._buffer = []
+        total = self.count
+        merged = [list(points[0])]
+        cumulative = 0.0
+        for mean, weight in points[1:]:
+            current = merged[-1]
+            proposed = current[1] + weight
+            q = (cumulative + proposed / 2) / total
+            # k1-style size bound: small centroids at the tails, large in the middle
+            if proposed <= max(1.0, 4 * total * q * (1 - q) / self.compression):
+                current[0] += (mean - current[0]) * weight / proposed
+                current[1] = proposed
+            else:
+                cumulative += current[1]
+                merged.append([mean, weight])
+        self.centroids = merged
+
+    def quantile(self, q):
+        self.compress()
+        if not self.centroids:
+            return None
+        if len(self.centroids) == 1 or q <= 0:
+            return self.centroids[0][0] if q > 0 else self.min
+        if q >= 1:
+            return self.max
+        target = q * self.count
+        cumulative = 0.0
+        previous_center, previous_mean = None, None
+        for mean, weight in self.centroids:
+            center = cumulative + weight / 2
+            if target < center:
+                if previous_center is None:
+                    # Between the minimum and the first centroid's center
+                    return self.min + (mean - self.min) * target / center
+                return previous_mean + (mean - previous_mean) * (target - previous_center) / (center - previous_center)
+            previous_center, previous_mean = center, mean
+            cumulative += weight
+        # Between the last centroid's center and the maximum
+        return previous_mean + (self.max - previous_mean) * (target - previous_center) / max(self.count - previous_center, 1e-12)
+
+    def cdf(self, value):
+        self.compress()
+        if not self.centroids:
+            return None
+        if value < self.min:
+            return 0.0
+        if value >= self.max:
+            return 1.0
+        means = [m for m, _ in self.centroids]
+        i = bisect.bisect_right(means, value)
+        cumulative = sum(w for _, w in self.centroids[:i])
+        if i == 0:
+            first_mean, first_weight = self.centroids[0]
+            span = first_mean - self.min
+            return (first_weight / 2) * ((value - self.min) / span if span else 1.0) / self.count
+        mean, weight = self.centroids[i - 1]
+        below = cumulative - weight / 2
+        if i == len(self.centroids):
+            span = self.max - mean
+            return (below + (weight / 2) * ((value - mean) / span if span else 1.0)) / self.count
+        next_mean, next_weight = self.centroids[i]
+        fraction = (value - mean) / (next_mean - mean) if next_mean > mean else 1.0
+        return (below + (weight + next_weight) / 2 * fraction) / self.count
+
+    def to_json(self):
+        self.compress()
+        return json.dumps({'c': [[round(m, 4), w] for m, w in self.centroids], 'n': self.count,
+                           'min': self.min, 'max': self.max}, separators=(',', ':'))
+
+    @classmethod
+    def from_json(cls, text):
+        data = json.loads(text)
+        return cls(centroids=data['c'], count=data['n'], low=data['min'], high=data['max'])
+
+
+def ks_distance(a, b):
+    """Largest gap between two digests' CDFs, checked at every centroid of both"""
+    a.compress()
+    b.compress()
+    if not a.count or not b.count:
+        return None
+    points = sorted({m for m, _ in a.centroids} | {m for m, _ in b.centroids})
+    return round(max(abs(a.cdf(x) - b.cdf(x)) for x in points), 4)
+
+
+def bucket_start(recorded_at):
+    ts = recorded_at.timestamp()
+    return datetime.fromtimestamp(ts - ts % BUCKET_SECONDS)
+
+
+class WardStats:
+    def __init__(self, flush_seconds=None):
+        self.flush_seconds = flush_seconds or float(os.environ.get('WARD_STATS_FLUSH_SECONDS', '60'))
+        self._pending = {}  # (ward, channel, bucket_start) -> TDigest of readings not yet flushed
+        self._lock = threading.Lock()
+        self._thread = None
+        self.stats = {'ingested': 0, 'flushes': 0, 'rows_written': 0, 'failed_flushes': 0}
+
+    def ingest(self, vital, ward):
+        """Add one reading to its ward's sketches (in memory until the next flush)"""
+        if self._thread is None:
+            self.start()
+        bucket = bucket_start(vital.recorded_at or datetime.now())
+        ward = ward or UNASSIGNED_WARD
+        with self._lock:
+            for channel in VITAL_CHANNELS:
+                value = getattr(vital, channel)
+                if not value:
+                    continue
+                key = (ward, channel, bucket)
+                digest = self._pending.get(key)
+                if digest is None:
+                    digest = self._pending[key] = TDigest()
+                digest.add(float(value))
+            self.stats['ingested'] += 1
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='ward-stats-flush', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        from app import app
+        while True:
+            time.sleep(self.flush_seconds)
+            with app.app_context():
+                self.flush()
+
+    def flush(self):
+        """Merge pending digests into their stored rows; kept for the next flush if that fails"""
+        from app import db
+        from models import WardVitalSketch
+
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        try:
+            for (ward, channel, bucket), digest in pending.items():
+                row = WardVitalSketch.query.filter_by(
+                    ward=ward, channel=channel, bucket_start=bucket
+                ).with_for_update().first()
+                if row is None:
+                    row = WardVitalSketch(ward=ward, channel=channel, bucket_start=bucket)
+                    db.session.add(row)
+                else:
+                    digest = TDigest.from_json(row.digest).merge(digest)
+                row.digest = digest.to_json()
+                row.count = digest.count
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            self.stats['failed_flushes'] += 1
+            logger.error(f"Ward stats flush failed, will retry: {e}")
+            with self._lock:
+                for key, digest in pending.items():
+                    current = self._pending.get(key)
+                    self._pending[key] = digest if current is None else digest.merge(current)
+            return 0
+        self.stats['flushes'] += 1
+        self.stats['rows_written'] += len(pending)
+        return len(pending)
+
+    def merged(self, channel, wards=None, since=None, until=None):
+        """One digest of `channel` over the given wards (None = all) and [since, until)"""
+        from models import WardVitalSketch
+
+        query = WardVitalSketch.query.filter(WardVitalSketch.channel == channel)
+        if wards:
+            query = query.filter(WardVitalSketch.ward.in_(wards))
+        if since:
+            query = query.filter(WardVitalSketch.bucket_start >= bucket_start(since))
+        if until:
+            query = query.filter(WardVitalSketch.bucket_start < until)
+        digest = TDigest()
+        for (text,) in query.with_entities(WardVitalSketch.digest):
+            digest.merge(TDigest.from_json(text))
+        return digest
+
+    def percentiles(self, channel, qs=(0.05, 0.25, 0.5, 0.75, 0.95), wards=None, since=None, until=None):
+        digest = self.merged(channel, wards, since, until)
+        return {
+            'channel': channel,
+            'wards': wards or 'all',
+            'count': digest.count,
+            'min': digest.min,
+            'max': digest.max,
+            'percentiles': {f"p{round(q * 100):g}": round(digest.quantile(q), 2) if digest.count else None
+                            for q in qs},
+        }
+
+    def drift(self, channel, baseline, current, wards=None):
+        """KS distance between two periods, each a (since, until) pair"""
+        before = self.merged(channel, wards, *baseline)
+        after = self.merged(channel, wards, *current)
+        return {
+            'channel': channel,
+            'wards': wards or 'all',
+            'baseline_count': before.count,
+            'current_count': after.count,
+            'baseline_median': round(before.quantile(0.5), 2) if before.count else None,
+            'current_median': round(after.quantile(0.5), 2) if after.count else None,
+            'ks_distance': ks_distance(before, after),
+        }
+
+    def report(self):
+        with self._lock:
+            pending = len(self._pending)
+        return {**self.stats, 'pending_sketches': pending, 'flush_seconds': self.flush_seconds}
+
+
+def backfill(chunk_rows=50000):
+    """Rebuild every stored sketch from vital_signs in one streaming pass"""
+    from sqlalchemy import delete, select
+    from app import db
+    from models import Patient, VitalSign, WardVitalSketch
+
+    columns = [getattr(VitalSign, c) for c in VITAL_CHANNELS]
+    query = select(Patient.department, VitalSign.recorded_at, *columns).join(
+        Patient, Patient.id == VitalSign.patient_id
+    ).execution_options(yield_per=chunk_rows)
+    digests = {}
+    for department, recorded_at, *values in db.session.execute(query):
+        if recorded_at is None:
+            continue
+        bucket = bucket_start(recorded_at)
+        for channel, value in zip(VITAL_CHANNELS, values):
+            if value:
+                key = (department or UNASSIGNED_WARD, channel, bucket)
+                digest = digests.get(key)
+                if digest is None:
+                    digest = digests[key] = TDigest()
+                digest.add(float(value))
+
+    db.session.execute(delete(WardVitalSketch))
+    for (ward, channel, bucket), digest in digests.items():
+        db.session.add(WardVitalSketch(ward=ward, channel=channel, bucket_start=bucket,
+                                       count=digest.count, digest=digest.to_json()))
+    db.session.commit()
+    return len(digests)
+
+
+ward_stats = WardStats()
+
+
+if __name__ == "__main__":
+    from app import app
+
+    with app.app_context():
+        rows = backfill()
+        print(f"Built {rows} ward vital sketches.")